@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+
+# CatAmount analyzes GPS collar data to find time/space relationships.
+# Copyright (C) 2012-2019 Michael Rickard
+#  
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#  
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#  
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# This times the clustering that match_survey_to_cluster does for every
+# cat, with different numbers of jobs, on a made-up data set of several
+# cats. The data set comes from a seeded random walk, so runs with the
+# same arguments search the same fixes on any machine. Each job count
+# is checked to find the same clusters as a single job.
+
+# IMPORT
+
+import sys
+import time
+import random
+import argparse
+
+import catamount.common as catcm
+import catamount.match_survey_to_cluster as catms
+
+
+# FUNCTIONS
+
+def create_synthetic_fixes(cat_count, fixes_per_cat, seed):
+	"""Create fixes for a number of cats, each wandering around its own home range and stopping now and then."""
+
+	generator = random.Random(seed)
+
+	columns = [
+		int(catcm.cfg_data_column_fixid),
+		int(catcm.cfg_data_column_catid),
+		int(catcm.cfg_data_column_utcdatetime),
+		int(catcm.cfg_data_column_utmx),
+		int(catcm.cfg_data_column_utmy)
+	]
+	fixid_column, catid_column, utcdatetime_column, utmx_column, utmy_column = columns
+
+	fixes = list()
+	start_time = 1262304000 # 2010-01-01 00:00 UTC
+	for cat_number in range(cat_count):
+		catid = 'M{}'.format(cat_number + 1)
+		center_x = 500000 + generator.randint(-20000, 20000)
+		center_y = 4840000 + generator.randint(-20000, 20000)
+		x = center_x
+		y = center_y
+		fix_time = start_time + generator.randint(0, 10800)
+		stay = 0
+
+		for count in range(fixes_per_cat):
+			# Short moves during a stay, long ones pulled toward home otherwise
+			if stay > 0:
+				stay -= 1
+				x += generator.gauss(0, 40)
+				y += generator.gauss(0, 40)
+			else:
+				if generator.random() < 0.15:
+					stay = generator.randint(3, 20)
+				x += generator.gauss(0, 900) + ((center_x - x) * 0.05)
+				y += generator.gauss(0, 900) + ((center_y - y) * 0.05)
+
+			csvrow = [''] * (max(columns) + 1)
+			csvrow[fixid_column] = str(len(fixes) + 1)
+			csvrow[catid_column] = catid
+			csvrow[utcdatetime_column] = catcm.format_time(fix_time, catcm.DATE_FMT_ISO)
+			csvrow[utmx_column] = '{:0.1f}'.format(x)
+			csvrow[utmy_column] = '{:0.1f}'.format(y)
+			fixes.append(catcm.Fix(csvrow))
+
+			fix_time += 10800
+
+	return fixes
+
+def time_clustering(fixes, radius, time_cutoff, jobs):
+	"""Find every cat's clusters with a number of jobs, returning the seconds taken and a summary of the clusters."""
+
+	datapool = catms.MSDataPool(radius, time_cutoff)
+	datapool.fixes = list(fixes)
+	datapool.sort_into_trails()
+
+	start = time.perf_counter()
+	datapool.find_all_clusters(jobs)
+	seconds = time.perf_counter() - start
+
+	summary = [(cluster.id, cluster.catid, cluster.start_time, cluster.end_time, round(cluster.x, 1), round(cluster.y, 1)) for cluster in datapool.clusters]
+	return seconds, summary
+
+
+# BEGIN SCRIPT
+
+argman = argparse.ArgumentParser(
+		prog='BENCHMARK_SURVEY_CLUSTERS',
+		description='Time the clustering of match_survey_to_cluster with different numbers of jobs',
+		epilog='Run this where the config file is, as with the other scripts. Speedup is only possible on a machine with more than one core.')
+
+argman.add_argument(
+	'-c', '--cats',
+	dest='cats', action='store',
+	type=int, default='12',
+	help='Number of cats in the made-up data set.'
+)
+
+argman.add_argument(
+	'-n', '--fixes_per_cat',
+	dest='fixes_per_cat', action='store',
+	type=int, default='4000',
+	help='Number of fixes for each cat.'
+)
+
+argman.add_argument(
+	'-j', '--jobs',
+	dest='jobs', action='store',
+	type=catcm.comma_string_to_list, default='1,2,4,8',
+	help='Numbers of jobs to time, separated with commas. 0 uses every core.'
+)
+
+argman.add_argument(
+	'-rp', '--repeats',
+	dest='repeats', action='store',
+	type=int, default='3',
+	help='Time each number of jobs this many times, keeping the fastest.'
+)
+
+argman.add_argument(
+	'-sd', '--seed',
+	dest='seed', action='store',
+	type=int, default='1',
+	help='Seed of the made-up data set.'
+)
+
+args = argman.parse_args()
+
+# Make sure integer arguments are in a reasonable range.
+args.cats = catcm.constrain_integer(args.cats, 1, 1000)
+args.fixes_per_cat = catcm.constrain_integer(args.fixes_per_cat, 10, 1000000)
+args.repeats = catcm.constrain_integer(args.repeats, 1, 100)
+job_counts = [catcm.jobs_arg_to_count(job_arg) for job_arg in args.jobs]
+
+# A single job is what the others are compared with, so it always goes first
+job_counts = [1] + [jobs for jobs in job_counts if jobs != 1]
+
+radius = int(catcm.cfg_matchsurvey_radius)
+time_cutoff = catcm.hours_arg_to_seconds(catcm.cfg_matchsurvey_time_cutoff)
+
+sys.stderr.write('Creating {} fixes for each of {} cats...\n'.format(args.fixes_per_cat, args.cats))
+fixes = create_synthetic_fixes(args.cats, args.fixes_per_cat, args.seed)
+
+sys.stdout.write('Cores: {}\n'.format(catcm.jobs_arg_to_count('0')))
+sys.stdout.write('Jobs,Seconds,Speedup,Efficiency,Clusters\n')
+
+single_seconds = False
+single_summary = False
+for jobs in job_counts:
+	fastest = False
+	for repeat in range(args.repeats):
+		seconds, summary = time_clustering(fixes, radius, time_cutoff, jobs)
+		if fastest is False or seconds < fastest:
+			fastest = seconds
+
+	if single_seconds is False:
+		single_seconds = fastest
+		single_summary = summary
+	elif summary != single_summary:
+		sys.stderr.write('ERROR: {} jobs found different clusters than a single job.\n'.format(jobs))
+
+	speedup = single_seconds / fastest
+	sys.stdout.write('{},{:0.3f},{:0.2f},{:0.0f}%,{}\n'.format(jobs, fastest, speedup, 100 * speedup / jobs, len(summary)))
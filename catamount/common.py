@@ -28,16 +28,25 @@ import os
 import re
 import sys
 import math
-import time
+import bisect
+import itertools
+import argparse
+import calendar
+import datetime
+import threading
+import multiprocessing
 
 from dateutil import parser as dateparser
 from configparser import RawConfigParser
 from csv import reader as csvreader
+from csv import writer as csvwriter
 
 from PIL import Image
 from PIL import ImageDraw
 from PIL import ImageFont
 
+import catamount.geometry as catgm
+
 
 # CONSTANTS/GLOBALS
 
@@ -50,6 +59,13 @@ DATE_FMT_ID_SHORT = '%Y%m%d'
 DATE_FMT_ISO = '%Y-%m-%d %H:%M:%S'
 DATE_FMT_ISO_SHORT = '%Y-%m-%d %H:%M'
 
+# Times are kept as seconds since the epoch, in UTC. These hold the
+# datetimes and date strings made from them, since reports ask for the
+# same times over and over.
+EPOCH_DATEOBJ = datetime.datetime(1970, 1, 1)
+utc_dateobjs = dict()
+formatted_times = dict()
+
 tiny_number_font = {
 	'0': '00000011100101001010010100111000000',
 	'1': '00000001000110000100001000111000000',
@@ -64,6 +80,44 @@ tiny_number_font = {
 	'.': '00000000000000000000000000010000000',
 }
 
+# Ruler labels drawn in the tiny font, as 1-bit masks keyed by
+# (text, vertical), since the same few labels repeat on every image
+tiny_number_labels = dict()
+
+# Tiled maps are cut into square tiles this many pixels across
+tile_size = 256
+
+# The object being cut into tiles, kept by each tile worker process
+tile_worker_graphic = False
+
+# The objects and scale of a batch of images, kept by each image worker process
+image_worker_batch = False
+
+# The file extension and Pillow format of each image output format
+image_formats = {
+	'png': ('.png', 'PNG'),
+	'webp': ('.webp', 'WEBP'),
+	'tiff': ('.tif', 'TIFF'),
+	'ppm': ('.ppm', 'PPM')
+}
+
+# Pillow save options of each image encoding preset, by format. TIFF
+# and PPM are always written uncompressed, and WebP always lossless.
+image_encodings = {
+	'speed': {
+		'PNG': {'compress_level': 1},
+		'WEBP': {'lossless': True, 'quality': 0, 'method': 0}
+	},
+	'balanced': {
+		'PNG': {'compress_level': 6},
+		'WEBP': {'lossless': True, 'quality': 70, 'method': 4}
+	},
+	'size': {
+		'PNG': {'compress_level': 9, 'optimize': True},
+		'WEBP': {'lossless': True, 'quality': 100, 'method': 6}
+	}
+}
+
 image_colors = {
 	'bg': '#FFFFFF',
 	'fg': '#000000',
@@ -78,6 +132,91 @@ image_colors = {
 	'whodunit': '#B0B0E0'
 }
 
+# A page for viewing a tiled map. TILE_TITLE, TILE_SIZE and TILE_LEVELS
+# are filled in, where each level is [tiles across, tiles down, scale].
+tile_viewer_html = '''<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>TILE_TITLE</title>
+<style>
+body { margin: 0; overflow: hidden; background: #C0C0C0; font: 12px monospace; }
+#map { position: absolute; top: 0; right: 0; bottom: 0; left: 0; cursor: move; }
+#map img { position: absolute; image-rendering: pixelated; }
+#bar { position: absolute; top: 4px; left: 4px; padding: 4px; background: #FFFFFF; }
+</style>
+</head>
+<body>
+<div id="map"></div>
+<div id="bar"><button id="zoom_in">+</button> <button id="zoom_out">-</button> <span id="status"></span></div>
+<script>
+var tileSize = TILE_SIZE;
+var levels = TILE_LEVELS;
+var map = document.getElementById('map');
+
+// The map pixel at the top left of the window, at the current zoom
+var zoom = 0;
+var left = 0;
+var top_ = 0;
+
+function draw() {
+	var level = levels[zoom];
+	var firstX = Math.max(0, Math.floor(left / tileSize));
+	var lastX = Math.min(level[0] - 1, Math.floor((left + map.clientWidth) / tileSize));
+	var firstY = Math.max(0, Math.floor(top_ / tileSize));
+	var lastY = Math.min(level[1] - 1, Math.floor((top_ + map.clientHeight) / tileSize));
+
+	map.innerHTML = '';
+	for (var x = firstX; x <= lastX; x++) {
+		for (var y = firstY; y <= lastY; y++) {
+			var tile = document.createElement('img');
+			tile.src = zoom + '/' + x + '/' + y + '.png';
+			tile.style.left = ((x * tileSize) - left) + 'px';
+			tile.style.top = ((y * tileSize) - top_) + 'px';
+			map.appendChild(tile);
+		}
+	}
+
+	document.getElementById('status').textContent = 'Zoom ' + zoom + ', 1 px = ' + level[2] + ' m';
+}
+
+function zoomTo(newZoom, centerX, centerY) {
+	if (newZoom < 0 || newZoom >= levels.length) {
+		return;
+	}
+	var factor = Math.pow(2, newZoom - zoom);
+	left = ((left + centerX) * factor) - centerX;
+	top_ = ((top_ + centerY) * factor) - centerY;
+	zoom = newZoom;
+	draw();
+}
+
+document.getElementById('zoom_in').onclick = function () { zoomTo(zoom + 1, map.clientWidth / 2, map.clientHeight / 2); };
+document.getElementById('zoom_out').onclick = function () { zoomTo(zoom - 1, map.clientWidth / 2, map.clientHeight / 2); };
+map.onwheel = function (event) {
+	event.preventDefault();
+	zoomTo(zoom + (event.deltaY < 0 ? 1 : -1), event.clientX, event.clientY);
+};
+
+var dragging = false;
+map.onmousedown = function (event) { dragging = [event.clientX, event.clientY]; };
+window.onmouseup = function () { dragging = false; };
+window.onmousemove = function (event) {
+	if (dragging) {
+		left -= event.clientX - dragging[0];
+		top_ -= event.clientY - dragging[1];
+		dragging = [event.clientX, event.clientY];
+		draw();
+	}
+};
+window.onresize = draw;
+
+draw();
+</script>
+</body>
+</html>
+'''
+
 
 # CLASSES
 
@@ -87,6 +226,13 @@ class GraphicBase(object):
 	It doesn't do much on its own, but other classes can inherit it
 	and get basic image capability."""
 
+	# Names of the lists of items that draw_object_specific_graphics
+	# draws from. A tiled map narrows each one to the items on a tile.
+	tile_lists = tuple()
+
+	# Set while drawing tiles, which have no border, rulers or legend
+	tiling = False
+
 	def __init__(self):
 		# These all get filled in by the subclass
 		self.x = 0
@@ -101,8 +247,12 @@ class GraphicBase(object):
 		self.cat_colors = dict()
 		self.legend_info = list()
 
-	def create_image(self, outfilepath, scale):
-		"""Create all the elements that are common to every image."""
+	def create_image(self, outfilepath, scale, context=False):
+		"""Create all the elements that are common to every image.
+
+		The font and background come from a RenderContext, the shared
+		one unless another is given, which also saves the image in its
+		output format on a background thread."""
 
 		# Auto-find an appropriate image scale
 		if scale == 'auto':
@@ -152,21 +302,73 @@ class GraphicBase(object):
 			self.img_max_x = self.img_min_x + (min_size * self.scale)
 			self.imgwidth = min_size
 
+		# Start from a copy of the background, if one was already drawn
+		# at this extent and scale
+		if not context:
+			context = render_context
+		self.font = context.load_font()
+
+		background_key = (self.imgwidth, self.imgheight, self.img_min_x, self.img_max_x, self.img_min_y, self.img_max_y, self.scale)
+		background = context.find_background(background_key)
+		if background:
+			self.newimage = background[0].copy()
+			self.fgimage = background[1].copy()
+			self.grid_factor = background[2]
+			self.draw = ImageDraw.Draw(self.newimage)
+			self.fgdraw = ImageDraw.Draw(self.fgimage)
+		else:
+			self.draw_background()
+			context.keep_background(background_key, self.newimage, self.fgimage, self.grid_factor)
+
+		# These are the limit strings, and where they go around the border
+		max_x_str, min_x_str, max_y_str, min_y_str = self.find_limit_strings()
+		half_wide_minus_half_text = self.padding + (self.imgwidth // 2) - (len(max_y_str) * 5 // 2)
+		half_tall_plus_half_text = self.padding + (self.imgheight // 2) + (len(max_x_str) * 5 // 2)
+
+		# This is how each subclass can have a different result
+		self.draw_object_specific_graphics()
+
+		# Paste the foreground onto the image
+		self.newimage.paste(self.fgimage, (self.padding, self.padding))
+
+		# Draw limit strings on top of the 1px border, straddling fg/bg
+		# Needs to happen after foreground is pasted
+		self.draw_horizontal_numbers(
+			(half_wide_minus_half_text),
+			(self.padding - 1),
+			max_y_str
+		)
+		self.draw_horizontal_numbers(
+			(half_wide_minus_half_text),
+			(self.padding + self.imgheight + 1),
+			min_y_str
+		)
+		self.draw_vertical_numbers(
+			(self.padding - 1),
+			(half_tall_plus_half_text),
+			min_x_str
+		)
+		self.draw_vertical_numbers(
+			(self.padding + self.imgwidth + 1),
+			(half_tall_plus_half_text),
+			max_x_str
+		)
+
+		# Save out the image, while the caller goes on to other work
+		context.save_image(self.newimage, outfilepath)
+
+	def draw_background(self):
+		"""Draw the border, grid and rulers that every image starts with."""
+
 		self.newimage = Image.new(
 			'RGB',
 			(self.imgwidth + (self.padding * 2) + 1, self.imgheight + (self.padding * 2) + 84),
 			image_colors['border']
 		)
 		self.draw = ImageDraw.Draw(self.newimage)
-		fontpath = os.path.join(basepath, 'fonts', 'proggy.pil')
-		self.font = ImageFont.load(fontpath)
 
 		# These are the limit strings
-		limit_fmt = '{:0.1f}'
-		max_x_str = limit_fmt.format(self.img_max_x)
-		min_x_str = limit_fmt.format(self.img_min_x)
-		max_y_str = limit_fmt.format(self.img_max_y)
-		min_y_str = limit_fmt.format(self.img_min_y)
+		max_x_str, min_x_str, max_y_str, min_y_str = self.find_limit_strings()
 
 		# Draw a 1px border around the foreground, to show the limits
 		self.draw.rectangle(
@@ -221,6 +423,65 @@ class GraphicBase(object):
 		)
 		self.fgdraw = ImageDraw.Draw(self.fgimage)
 
+		# Draw the grid, and make a note of how far apart its lines are
+		self.draw_grid()
+		px_offset = self.grid_factor // self.scale
+
+		# Draw number markers in the margin, as a ruler for the grid
+		number_increment = self.grid_factor / 1000
+		if self.grid_factor == 100:
+			number_format = '{:0.1f}'
+		else:
+			number_format = '{:0.0f}'
+
+		y_offset = ((int(self.img_max_y) % self.grid_factor) // self.scale) + self.padding
+		y_value = (int(self.img_max_y) // self.grid_factor) * number_increment
+		while y_offset < (self.imgheight + self.padding):
+			y_str = number_format.format(y_value)
+			self.draw_horizontal_numbers(
+				1 + ((6 - len(y_str)) * 5),
+				y_offset,
+				y_str
+			)
+			self.draw_horizontal_numbers(
+				self.padding + self.imgwidth + 4,
+				y_offset,
+				y_str
+			)
+			y_offset += px_offset
+			y_value -= number_increment
+
+		x_offset = ((self.grid_factor - (int(self.img_min_x) % self.grid_factor)) // self.scale) + self.padding
+		x_value = ((int(self.img_min_x) // self.grid_factor) + 1) * number_increment
+		while x_offset < (self.imgwidth + self.padding):
+			x_str = number_format.format(x_value)
+			self.draw_vertical_numbers(
+				x_offset,
+				self.imgheight + self.padding + ((len(x_str) * 5) + 3),
+				x_str
+			)
+			self.draw_vertical_numbers(
+				x_offset,
+				self.padding - 4,
+				x_str
+			)
+			x_offset += px_offset
+			x_value += number_increment
+
+	def find_limit_strings(self):
+		"""Format the limits of the image, as shown around the border."""
+
+		limit_fmt = '{:0.1f}'
+		return (
+			limit_fmt.format(self.img_max_x),
+			limit_fmt.format(self.img_min_x),
+			limit_fmt.format(self.img_max_y),
+			limit_fmt.format(self.img_min_y)
+		)
+
+	def draw_grid(self):
+		"""Draw a grid across the foreground, with darker lines every tenth one."""
+
 		# Determine how far apart to space the grid
 		self.grid_factor = False
 		try_grid_factor = 100
@@ -270,78 +531,109 @@ class GraphicBase(object):
 			)
 			accent_x_offset += accent_px_offset
 
-		# Draw number markers in the margin, as a ruler for the grid
-		number_increment = self.grid_factor / 1000
-		if self.grid_factor == 100:
-			number_format = '{:0.1f}'
+	def create_tiles(self, outdirpath, scale, jobs=1):
+		"""Create a tiled map of any size, as a pyramid of zoom levels with a viewer.
+
+		Tiles are written as zoom/x/y.png in the output directory. The
+		most detailed level is at the given scale, each level above it
+		has half the detail, and level 0 shows everything on one tile.
+		Each tile is drawn only from the items that touch it. Returns
+		the number of tiles written."""
+
+		self.tile_scale = scale
+		self.tile_origin_x = math.floor(self.min_x)
+		self.tile_origin_y = math.ceil(self.max_y)
+		tiled_width = self.max_x - self.tile_origin_x
+		tiled_height = self.tile_origin_y - self.min_y
+
+		finest_extent = tile_size * scale
+		tiles_across = max(1, int(math.ceil(max(tiled_width, tiled_height) / finest_extent)))
+		self.max_zoom = (tiles_across - 1).bit_length()
+
+		self.tile_indexes = dict()
+		for list_name in self.tile_lists:
+			self.tile_indexes[list_name] = AreaIndex(getattr(self, list_name), finest_extent)
+
+		levels = list()
+		tasks = list()
+		for zoom in range(self.max_zoom + 1):
+			extent = finest_extent * (2 ** (self.max_zoom - zoom))
+			tile_count_x = max(1, int(math.ceil(tiled_width / extent)))
+			tile_count_y = max(1, int(math.ceil(tiled_height / extent)))
+			levels.append((tile_count_x, tile_count_y, scale * (2 ** (self.max_zoom - zoom))))
+
+			for tile_x in range(tile_count_x):
+				for tile_y in range(tile_count_y):
+					tasks.append((outdirpath, zoom, tile_x, tile_y))
+
+		self.tiling = True
+		if jobs > 1 and len(tasks) > 1:
+			# Each worker is sent this object once, rather than with every tile
+			chunksize = max(1, len(tasks) // (jobs * 4))
+			with multiprocessing.Pool(jobs, init_tile_worker, (self,)) as pool:
+				for task_done in pool.imap_unordered(render_tile_task, tasks, chunksize):
+					pass
 		else:
-			number_format = '{:0.0f}'
-
-		y_offset = ((int(self.img_max_y) % self.grid_factor) // self.scale) + self.padding
-		y_value = (int(self.img_max_y) // self.grid_factor) * number_increment
-		while y_offset < (self.imgheight + self.padding):
-			y_str = number_format.format(y_value)
-			self.draw_horizontal_numbers(
-				1 + ((6 - len(y_str)) * 5),
-				y_offset,
-				y_str
-			)
-			self.draw_horizontal_numbers(
-				self.padding + self.imgwidth + 4,
-				y_offset,
-				y_str
-			)
-			y_offset += px_offset
-			y_value -= number_increment
-
-		x_offset = ((self.grid_factor - (int(self.img_min_x) % self.grid_factor)) // self.scale) + self.padding
-		x_value = ((int(self.img_min_x) // self.grid_factor) + 1) * number_increment
-		while x_offset < (self.imgwidth + self.padding):
-			x_str = number_format.format(x_value)
-			self.draw_vertical_numbers(
-				x_offset,
-				self.imgheight + self.padding + ((len(x_str) * 5) + 3),
-				x_str
-			)
-			self.draw_vertical_numbers(
-				x_offset,
-				self.padding - 4,
-				x_str
-			)
-			x_offset += px_offset
-			x_value += number_increment
+			for task in tasks:
+				self.render_tile(*task)
+		self.tiling = False
+
+		viewer_html = tile_viewer_html.replace('TILE_TITLE', os.path.basename(outdirpath))
+		viewer_html = viewer_html.replace('TILE_SIZE', str(tile_size))
+		viewer_html = viewer_html.replace('TILE_LEVELS', repr([list(level) for level in levels]))
+		with open(os.path.join(outdirpath, 'index.html'), 'wt') as viewerfile:
+			viewerfile.write(viewer_html)
+
+		return len(tasks)
+
+	def render_tile(self, outdirpath, zoom, tile_x, tile_y):
+		"""Draw one tile of a tiled map, and save it.
+
+		The tile is drawn with a border as wide as the tile margin, then
+		cropped, since PIL can fill a shape differently where it is cut
+		off at the edge of an image."""
+
+		self.scale = self.tile_scale * (2 ** (self.max_zoom - zoom))
+		extent = tile_size * self.scale
+		margin = self.tile_margin()
+		border = max(16, int(math.ceil(margin / self.scale)))
+
+		self.imgwidth = tile_size + (border * 2)
+		self.imgheight = tile_size + (border * 2)
+		self.img_min_x = self.tile_origin_x + (tile_x * extent) - (border * self.scale)
+		self.img_max_x = self.img_min_x + (self.imgwidth * self.scale)
+		self.img_max_y = self.tile_origin_y - (tile_y * extent) + (border * self.scale)
+		self.img_min_y = self.img_max_y - (self.imgheight * self.scale)
+
+		self.fgimage = Image.new('RGB', (self.imgwidth, self.imgheight), image_colors['bg'])
+		self.fgdraw = ImageDraw.Draw(self.fgimage)
+		self.draw_grid()
+
+		# Narrow each list of items to the ones on this tile while drawing
+		tile_min_x = self.img_min_x + (border * self.scale)
+		tile_max_y = self.img_max_y - (border * self.scale)
+		full_lists = dict()
+		for list_name, area_index in self.tile_indexes.items():
+			full_lists[list_name] = getattr(self, list_name)
+			setattr(self, list_name, area_index.search(
+				tile_min_x - margin, tile_max_y - extent - margin,
+				tile_min_x + extent + margin, tile_max_y + margin
+			))
 
-		# This is how each subclass can have a different result
 		self.draw_object_specific_graphics()
 
-		# Paste the foreground onto the image
-		self.newimage.paste(self.fgimage, (self.padding, self.padding))
+		for list_name, items in full_lists.items():
+			setattr(self, list_name, items)
 
-		# Draw limit strings on top of the 1px border, straddling fg/bg
-		# Needs to happen after foreground is pasted
-		self.draw_horizontal_numbers(
-			(half_wide_minus_half_text),
-			(self.padding - 1),
-			max_y_str
-		)
-		self.draw_horizontal_numbers(
-			(half_wide_minus_half_text),
-			(self.padding + self.imgheight + 1),
-			min_y_str
-		)
-		self.draw_vertical_numbers(
-			(self.padding - 1),
-			(half_tall_plus_half_text),
-			min_x_str
-		)
-		self.draw_vertical_numbers(
-			(self.padding + self.imgwidth + 1),
-			(half_tall_plus_half_text),
-			max_x_str
-		)
+		tile = self.fgimage.crop((border, border, border + tile_size, border + tile_size))
+		tiledirpath = os.path.join(outdirpath, str(zoom), str(tile_x))
+		os.makedirs(tiledirpath, exist_ok=True)
+		tile.save(os.path.join(tiledirpath, '{}.png'.format(tile_y)), 'PNG')
+
+	def tile_margin(self):
+		"""How far outside a tile, in meters, an item can be and still show on it."""
 
-		# Save out the image
-		self.newimage.save(outfilepath, 'PNG')
+		return 8 * self.scale
 
 	def draw_object_specific_graphics(self):
 		"""Each class that is based on this one can redefine this
@@ -353,6 +645,10 @@ class GraphicBase(object):
 		"""Create the legend of informative text at the bottom left of
 		each image."""
 
+		# Tiles have no room for a legend
+		if self.tiling:
+			return
+
 		legend_x = 4
 		legend_y = self.imgheight + (self.padding * 2)
 		row_offset = 12
@@ -455,48 +751,69 @@ class GraphicBase(object):
 	def draw_horizontal_numbers(self, x, y, text_to_draw):
 		"""Using a trivial pixel font to draw 3x5 numbers horizontally."""
 
-		number_counter = -1
-		for number in text_to_draw:
-			number_counter += 1
-			bit_map = tiny_number_font[number]
-			row_counter = 0
-			point_counter = -1
-			for point in bit_map:
-				point_counter += 1
-				if (point_counter % 5 == 0):
-					point_counter = 0
-					row_counter += 1
-				if (point == '1'):
-					self.draw.point(
-						(
-							(x + (number_counter * 5) + point_counter),
-							((y - 4) + row_counter)
-						),
-						image_colors['fg']
-					)
+		label = tiny_number_label(text_to_draw, False)
+		left = x
+		top = y - 3
+		self.newimage.paste(image_colors['fg'], (left, top, left + label.width, top + label.height), label)
 
 	def draw_vertical_numbers(self, x, y, text_to_draw):
-		"""Using a trivial pixel font to draw 3x5 numbers vertically."""
-
-		number_counter = -1
-		for number in text_to_draw:
-			number_counter += 1
-			bit_map = tiny_number_font[number]
-			column_counter = 0
-			point_counter = -1
-			for point in bit_map:
-				point_counter += 1
-				if (point_counter % 5 == 0):
-					point_counter = 0
-					column_counter += 1
-				if (point == '1'):
-					self.draw.point(
-						(
-							((x - 4) + column_counter),
-							(y - (number_counter * 5) - point_counter)
-						),
-						image_colors['fg']
-					)
+		"""Using a trivial pixel font to draw 3x5 numbers vertically, reading upwards."""
+
+		label = tiny_number_label(text_to_draw, True)
+		left = x - 3
+		top = y - (label.height - 1)
+		self.newimage.paste(image_colors['fg'], (left, top, left + label.width, top + label.height), label)
+
+	def draw_dots(self, real_xs, real_ys, colors, dot_size=False):
+		"""Draw a dot on the foreground for each location, later ones on top.
+
+		colors is either one color for all dots, or a color for each.
+		Without a dot_size each dot is a single pixel, like draw.point,
+		otherwise it is a filled circle that size across."""
+
+		img_xs = self.img_xs(real_xs)
+		img_ys = self.img_ys(real_ys)
+		if isinstance(colors, str):
+			colors = [colors] * len(img_xs)
+
+		# A dot hides any earlier dot on the same pixel, so only the
+		# last dot on each pixel is drawn, keeping them in order
+		last_positions = dict(zip(zip(img_xs, img_ys), range(len(img_xs))))
+		positions = sorted(last_positions.values())
+
+		if not dot_size:
+			# Single pixels no longer overlap, so each color can go in one call
+			points_by_color = dict()
+			for position in positions:
+				color = colors[position]
+				if color not in points_by_color:
+					points_by_color[color] = list()
+				points_by_color[color].append((img_xs[position], img_ys[position]))
+
+			for color, points in points_by_color.items():
+				self.fgdraw.point(points, color)
+		else:
+			# Filling without an outline covers the same pixels, in less time
+			radius = dot_size / 2
+			for position in positions:
+				img_x = img_xs[position]
+				img_y = img_ys[position]
+				self.fgdraw.ellipse((img_x - radius, img_y - radius, img_x + radius, img_y + radius), colors[position])
+
+	def draw_trail(self, real_xs, real_ys, color):
+		"""Draw a line on the foreground through each location in order.
+
+		Locations on the same pixel as the one before add nothing to the
+		line, so each run of them is dropped to one point first, in a
+		single pass. The line drawn is exactly the same."""
+
+		points = [point for point, run in itertools.groupby(zip(self.img_xs(real_xs), self.img_ys(real_ys)))]
+
+		# A line needs two points, so a trail that never leaves its pixel is just that pixel
+		if len(points) == 1:
+			self.fgdraw.point(points, color)
+		else:
+			self.fgdraw.line(points, color)
 
 	def img_x(self, real_x):
 		"""Images are drawn at a scale, and have a different origin
@@ -514,6 +831,173 @@ class GraphicBase(object):
 		relative_y = int((real_y - self.img_min_y) / self.scale)
 		return self.imgheight - relative_y
 
+	def img_xs(self, real_xs):
+		"""Translate many x values from the real world to the image at once."""
+
+		return [int((real_x - self.img_min_x) / self.scale) for real_x in real_xs]
+
+	def img_ys(self, real_ys):
+		"""Translate many y values from the real world to the image at once."""
+
+		return [self.imgheight - int((real_y - self.img_min_y) / self.scale) for real_y in real_ys]
+
+
+class RenderContext(object):
+	"""A RenderContext keeps what images drawn in the same process can share.
+
+	This is the loaded font, and the most recent backgrounds (border,
+	grid and rulers) by extent and scale. An image at an extent and
+	scale that was drawn before starts from a copy of its background.
+	The backgrounds kept are limited by their total pixels, so a few
+	large images cannot fill memory.
+
+	Images are encoded in the output format on a background thread, one
+	at a time, so that text reports can be written in the meantime."""
+
+	def __init__(self, background_pixel_limit=16000000, image_format='png', image_encoding='balanced'):
+		self.font = False
+		self.backgrounds = dict()
+		self.background_pixels = 0
+		self.background_pixel_limit = background_pixel_limit
+		self.saving = False
+		self.saving_path = False
+		self.unsaved_paths = set()
+		self.set_image_output(image_format, image_encoding)
+
+	def set_image_output(self, image_format, image_encoding):
+		"""Set the format and encoding that images are saved with."""
+
+		self.image_format = image_format
+		self.image_encoding = image_encoding
+		self.image_extension, self.pil_format = image_formats[image_format]
+		self.save_options = find_save_options(self.pil_format, image_encoding)
+
+	def load_font(self):
+		"""Load the font for image text, the first time it is needed."""
+
+		if not self.font:
+			fontpath = os.path.join(basepath, 'fonts', 'proggy.pil')
+			self.font = ImageFont.load(fontpath)
+
+		return self.font
+
+	def find_background(self, key):
+		"""Find a background drawn before, or False."""
+
+		if key not in self.backgrounds:
+			return False
+
+		# Move it to the end, as the most recently used
+		background = self.backgrounds.pop(key)
+		self.backgrounds[key] = background
+		return background
+
+	def keep_background(self, key, newimage, fgimage, grid_factor):
+		"""Keep copies of a background for later images, forgetting the least
+		recently used ones to stay under the pixel limit."""
+
+		pixels = (newimage.size[0] * newimage.size[1]) + (fgimage.size[0] * fgimage.size[1])
+		if pixels > self.background_pixel_limit:
+			return
+
+		while self.background_pixels + pixels > self.background_pixel_limit:
+			self.background_pixels -= self.backgrounds.pop(next(iter(self.backgrounds)))[3]
+
+		self.backgrounds[key] = (newimage.copy(), fgimage.copy(), grid_factor, pixels)
+		self.background_pixels += pixels
+
+	def save_image(self, image, outfilepath):
+		"""Save an image on a background thread, once the image before it is saved."""
+
+		self.finish_saving()
+		self.saving_path = outfilepath
+		self.saving = threading.Thread(target=self.write_image, args=(image, outfilepath))
+		self.saving.start()
+
+	def write_image(self, image, outfilepath):
+		"""Encode and write an image in the output format, remembering the path if it fails."""
+
+		try:
+			image.save(outfilepath, self.pil_format, **self.save_options)
+		except (OSError, ValueError) as error:
+			self.unsaved_paths.add(outfilepath)
+			sys.stderr.write('ERROR: Could not save image {}: {}\n'.format(outfilepath, error))
+
+	def finish_saving(self):
+		"""Wait for the image being saved, if there is one. Returns False if the last image couldn't be saved."""
+
+		if self.saving:
+			self.saving.join()
+			self.saving = False
+
+		return self.saving_path not in self.unsaved_paths
+
+
+class Layer(object):
+	"""A Layer is a group of shapes drawn apart from an image, then pasted onto it through a mask.
+
+	The Layer covers an area of the given size, but only the bounding
+	box of its shapes is allocated, except for parts with a polygon.
+	Shapes are given as ImageDraw method names with their usual
+	arguments, and are drawn when the Layer is pasted."""
+
+	def __init__(self, size, color, mask_color='#000000'):
+		self.size = size
+		self.color = color
+		self.mask_color = mask_color
+		self.shapes = list()
+		self.mask_shapes = list()
+
+	def draw(self, shape, xy, fill=None, outline=None):
+		"""Add a shape to the colored image of the layer."""
+
+		self.shapes.append((shape, xy, fill, outline))
+
+	def draw_mask(self, shape, xy, fill=None, outline=None):
+		"""Add a shape to the mask of the layer."""
+
+		self.mask_shapes.append((shape, xy, fill, outline))
+
+	def paste_onto(self, image):
+		"""Draw the shapes within their bounding box, and paste them onto an image."""
+
+		points = [point for shape, xy, fill, outline in self.shapes + self.mask_shapes for point in xy]
+		if not points:
+			return
+
+		left = max(0, int(math.floor(min(point[0] for point in points))))
+		top = max(0, int(math.floor(min(point[1] for point in points))))
+		right = min(self.size[0], int(math.ceil(max(point[0] for point in points))) + 1)
+		bottom = min(self.size[1], int(math.ceil(max(point[1] for point in points))) + 1)
+		if left >= right or top >= bottom:
+			return
+
+		box = (left, top, right, bottom)
+		layerimg = self.draw_part('RGB', self.color, self.shapes, box)
+		layermask = self.draw_part('L', self.mask_color, self.mask_shapes, box)
+		image.paste(layerimg, (left, top), layermask)
+
+	def draw_part(self, mode, color, shapes, box):
+		"""Draw shapes on an image of the box, for the colored image or the mask."""
+
+		left, top, right, bottom = box
+
+		# Which pixels a polygon fills depends on where it sits, so
+		# polygons are drawn over the whole area, and the box cut out
+		if 'polygon' in [shape for shape, xy, fill, outline in shapes]:
+			layerpart = Image.new(mode, self.size, color)
+			layerdraw = ImageDraw.Draw(layerpart)
+			for shape, xy, fill, outline in shapes:
+				getattr(layerdraw, shape)(xy, fill, outline)
+			return layerpart.crop(box)
+
+		layerpart = Image.new(mode, (right - left, bottom - top), color)
+		layerdraw = ImageDraw.Draw(layerpart)
+		for shape, xy, fill, outline in shapes:
+			getattr(layerdraw, shape)([(x - left, y - top) for x, y in xy], fill, outline)
+
+		return layerpart
+
 
 class Fix(object):
 	"""A Fix is a single datum, a point in time and space.
@@ -527,6 +1011,8 @@ class Fix(object):
 		self.sun_metrics = sun_metrics
 		self.status = None # home or away
 		self.day_period = None # day or night
+		self.solar_elevation = None # degrees, if calculated
+		self.twilight = None # day, civil, nautical, astronomical, or night
 
 		self.set_values_from_csv()
 		self.determine_day_or_night()
@@ -535,15 +1021,14 @@ class Fix(object):
 		return 'Fix(csvrow={0!r})'.format(self.csvrow)
 
 	def __str__(self):
-		return '{}, {}, {}, {}, {}'.format(self.id, self.catid, self.dateobj.strftime(DATE_FMT_ISO), self.x, self.y)
+		return '{}, {}, {}, {}, {}'.format(self.id, self.catid, format_time(self.time, DATE_FMT_ISO), self.x, self.y)
 
 	def set_values_from_csv(self):
 		"""Process the raw data from CSV into attributes"""
 
 		self.id = self.csvrow[int(cfg_data_column_fixid)]
 		self.catid = self.csvrow[int(cfg_data_column_catid)]
-		self.dateobj = dateparser.parse(self.csvrow[int(cfg_data_column_utcdatetime)])
-		self.time = time.mktime(self.dateobj.timetuple())
+		self.time = epoch_time(dateparser.parse(self.csvrow[int(cfg_data_column_utcdatetime)]))
 		self.x = float(self.csvrow[int(cfg_data_column_utmx)])
 		self.y = float(self.csvrow[int(cfg_data_column_utmy)])
 
@@ -552,7 +1037,7 @@ class Fix(object):
 		if not self.sun_metrics:
 			return False
 
-		if self.sun_metrics.is_daylight(self.dateobj, 'utc'):
+		if self.sun_metrics.for_location(self.x, self.y).is_daylight(utc_dateobj(self.time), 'utc'):
 			self.day_period = 'day'
 		else:
 			self.day_period = 'night'
@@ -560,48 +1045,59 @@ class Fix(object):
 	def distance_from(self, other):
 		"""Calculate the distance of this fix from another object."""
 
-		delta_x = math.fabs(self.x - other.x)
-		delta_y = math.fabs(self.y - other.y)
-		return math.sqrt((delta_x ** 2) + (delta_y ** 2))
+		return catgm.distance(self.x, self.y, other.x, other.y)
 
 	def delay_from(self, other):
 		"""Calculate the time offset of this fix from anoethr oject."""
 
 		if isinstance(other, Cluster):
-			return math.fabs(self.time - other.end_time)
+			return catgm.delay(self.time, other.end_time)
 		else:
-			return math.fabs(self.time - other.time)
+			return catgm.delay(self.time, other.time)
+
+	def csv_report(self, parent_id, cat_id=False, status=False):
+		"""Create one line of csv output representing this fix.
+
+		The status is the fix's own, unless the parent gives one."""
 
-	def csv_report(self, parent_id, cat_id=False):
-		"""Create one line of csv output representing this fix."""
+		if not status:
+			status = self.status
 
 		field_list = [
 			parent_id,
 			self.id,
-			self.dateobj.strftime(DATE_FMT_ISO),
+			format_time(self.time, DATE_FMT_ISO),
 			'{:0.1f}'.format(self.x),
 			'{:0.1f}'.format(self.y),
-			self.status,
+			status,
 			self.day_period
 		]
 
+		# Solar position is only known if it has been calculated
+		if self.solar_elevation is None:
+			field_list.extend(['', ''])
+		else:
+			field_list.extend(['{:0.1f}'.format(self.solar_elevation), self.twilight])
+
 		# Add the cat ID if requested. Crossings need this.
 		if cat_id:
 			field_list.insert(1, self.catid)
 
 		sys.stdout.write(','.join(field_list) + '\n')
 
-	def descriptive_report(self, cat_id=False):
-		"""Describe this fix in descriptive text output."""
+	def descriptive_report(self, cat_id=False, status=False):
+		"""Describe this fix in descriptive text output, with its own status unless the parent gives one."""
 
 		short_status = {'home': 'O', 'away': '.'}
+		if not status:
+			status = self.status
 
 		field_list = [
 			self.id,
-			self.dateobj.strftime(DATE_FMT_ISO),
+			format_time(self.time, DATE_FMT_ISO),
 			'{:0.1f}'.format(self.x),
 			'{:0.1f}'.format(self.y),
-			short_status[self.status],
+			short_status[status],
 			self.day_period
 		]
 
@@ -615,44 +1111,7 @@ class Fix(object):
 		"""Calculate the angle and angular distance of this fix from an object."""
 
 		self.distance_from_center = self.distance_from(other)
-
-		#        0
-		#     q4 | q1
-		# 270 ---+--- 90
-		#     q3 | q2
-		#       180
-
-		if self.x >= other.x and self.y >= other.y:
-			# Quadrant 1, 0 to 90
-			delta_x = self.x - other.x
-			delta_y = self.y - other.y
-
-			prelim_angle = math.degrees(math.atan(delta_x / delta_y))
-			self.angle_from_center = prelim_angle
-
-		elif self.x >= other.x:
-			# Quadrant 2, 90 to 180
-			delta_x = self.x - other.x
-			delta_y = other.y - self.y
-
-			prelim_angle = math.degrees(math.atan(delta_y / delta_x))
-			self.angle_from_center = 90.0 + prelim_angle
-
-		elif self.y <= other.y:
-			# Quadrant 3, 180 to 270
-			delta_x = other.x - self.x
-			delta_y = other.y - self.y
-
-			prelim_angle = math.degrees(math.atan(delta_x / delta_y))
-			self.angle_from_center = 180.0 + prelim_angle
-
-		else:
-			# Quadrant 4, 270 to 360
-			delta_x = other.x - self.x
-			delta_y = self.y - other.y
-
-			prelim_angle = math.degrees(math.atan(delta_y / delta_x))
-			self.angle_from_center = 270.0 + prelim_angle
+		self.angle_from_center = catgm.bearing(other.x, other.y, self.x, self.y)
 
 
 class Trail(GraphicBase):
@@ -715,14 +1174,72 @@ class Trail(GraphicBase):
 	def calculate_angles(self):
 		"""Calculate the angle and angular distance for every fix."""
 
-		for fix in self.fixes:
-			fix.calculate_angle_and_distance(self)
+		xs = [fix.x for fix in self.fixes]
+		ys = [fix.y for fix in self.fixes]
+		distances = catgm.distances_from(self.x, self.y, xs, ys)
+		angles = catgm.bearings_from(self.x, self.y, xs, ys)
+
+		for fix, distance, angle in zip(self.fixes, distances, angles):
+			fix.distance_from_center = distance
+			fix.angle_from_center = angle
 
 	def filter_by_date(self):
 		"""Remove any fixes that don't fall between the start and end dates."""
 
 		self.fixes = [fix for fix in self.fixes if self.start_time <= fix.time <= self.end_time]
 
+	def find_fix_times(self):
+		"""Keep a list of fix times alongside the fixes, for binary searches.
+
+		The fixes need to be in chronological order first."""
+
+		self.fix_times = [fix.time for fix in self.fixes]
+
+	def position_at(self, request_time):
+		"""Estimate where the cat was at a given time, between the fixes on either side.
+
+		Returns (x, y, gap), where gap is the time between the two
+		fixes, or False if the time is outside the trail."""
+
+		return self.positions_at([request_time])[0]
+
+	def positions_at(self, request_times):
+		"""Estimate where the cat was at each of many times.
+
+		The times are visited in chronological order, so each binary
+		search only covers the part of the trail after the last one.
+		Results are in the same order as the times that were given."""
+
+		positions = [False] * len(request_times)
+		low = 0
+
+		for request_index in sorted(range(len(request_times)), key=lambda index: request_times[index]):
+			request_time = request_times[request_index]
+			low = bisect.bisect_left(self.fix_times, request_time, low)
+
+			# A fix at exactly this time needs no estimate
+			if low < len(self.fix_times) and self.fix_times[low] == request_time:
+				fix = self.fixes[low]
+				positions[request_index] = (fix.x, fix.y, 0)
+				continue
+
+			# There is nothing to estimate from before the first fix or after the last
+			if low == 0 or low == len(self.fix_times):
+				continue
+
+			before = self.fixes[low - 1]
+			after = self.fixes[low]
+			gap = after.time - before.time
+			fraction = (request_time - before.time) / gap
+
+			positions[request_index] = (
+				before.x + ((after.x - before.x) * fraction),
+				before.y + ((after.y - before.y) * fraction),
+				gap
+			)
+
+		return positions
+
 
 class Cluster(GraphicBase):
 	"""A Cluster is a collection of Fixes that are close in space and time.
@@ -731,19 +1248,35 @@ class Cluster(GraphicBase):
 	where a cat spent a significant amount of time. Each Trail may or
 	may not have any Clusters."""
 
+	# Set when an ID is given, otherwise made from the start time when asked for
+	assigned_id = False
+
 	def __init__(self, first_fix):
 		self.home_fixes = [first_fix]
 		self.away_fixes = list()
 		self.all_fixes = [first_fix]
-		self.id = first_fix.dateobj.strftime(DATE_FMT_ID)
 		self.catid = first_fix.catid
 
+		# Running sums of home fix locations, for the center
+		self.sum_x = first_fix.x
+		self.sum_y = first_fix.y
+
+	@property
+	def id(self):
+		"""The ID of a cluster is its start date, unless it was given another."""
+
+		if self.assigned_id:
+			return self.assigned_id
+		return format_time(self.home_fixes[0].time, DATE_FMT_ID)
+
+	@id.setter
+	def id(self, clusterid):
+		self.assigned_id = clusterid
+
 	def distance_from(self, other):
 		"""Calculate the distance of this cluster form another object."""
 
-		delta_x = math.fabs(self.x - other.x)
-		delta_y = math.fabs(self.y - other.y)
-		return math.sqrt((delta_x ** 2) + (delta_y ** 2))
+		return catgm.distance(self.x, self.y, other.x, other.y)
 
 	def delay_from(self, other):
 		"""Calculate the time offset of this cluster from another object."""
@@ -759,7 +1292,7 @@ class Cluster(GraphicBase):
 			else:
 				return time_separation
 		else:
-			return math.fabs(self.start_time - other.time)
+			return catgm.delay(self.start_time, other.time)
 
 	def add_fix(self, fix):
 		"""Incorporate a new fix into the cluster."""
@@ -768,61 +1301,51 @@ class Cluster(GraphicBase):
 
 		if (fix.status == 'home'):
 			self.home_fixes.append(fix)
-			self.recalculate_core_data()
+			self.sum_x += fix.x
+			self.sum_y += fix.y
+			self.update_core_data()
 		elif (fix.status == 'away'):
 			self.away_fixes.append(fix)
 
 	def recalculate_core_data(self):
-		"""Recalculate the core data, notably used when a fix as added."""
+		"""Recalculate the core data from scratch, for when the home fixes are set all at once."""
+
+		self.sum_x = 0
+		self.sum_y = 0
+		for fix in self.home_fixes:
+			self.sum_x += fix.x
+			self.sum_y += fix.y
+
+		self.update_core_data()
+
+	def update_core_data(self):
+		"""Update the core data from the running sums, notably used when a fix is added."""
 
 		self.start_time = self.home_fixes[0].time
-		self.start_dateobj = self.home_fixes[0].dateobj
 		self.end_time = self.home_fixes[-1].time
-		self.end_dateobj = self.home_fixes[-1].dateobj
 
 		self.elapsed_time = self.end_time - self.start_time
 
-		sum_x = 0
-		sum_y = 0
-		for fix in self.home_fixes:
-			sum_x += fix.x
-			sum_y += fix.y
-
-		self.x = sum_x / len(self.home_fixes)
-		self.y = sum_y / len(self.home_fixes)
+		self.x = self.sum_x / len(self.home_fixes)
+		self.y = self.sum_y / len(self.home_fixes)
 
 	def calculate_averages(self):
 		"""Calculate the extremes and averages, after all fixes have landed."""
 
-		x_list = [fix.x for fix in self.all_fixes]
-		y_list = [fix.y for fix in self.all_fixes]
-
-		self.max_x = max(x_list)
-		self.min_x = min(x_list)
-		self.max_y = max(y_list)
-		self.min_y = min(y_list)
+		calculate_cluster_averages([self])
 
-		self.spread_x = self.max_x - self.min_x
-		self.spread_y = self.max_y - self.min_y
+	def fix_status(self, fix):
+		"""Find whether a fix is home or away in this cluster."""
 
-		sum_distance = 0
-		for home_fix in self.home_fixes:
-			sum_distance += home_fix.distance_from(self)
-		self.avg_distance = sum_distance / len(self.home_fixes)
+		return fix.status
 
-		self.max_excursion = 0
-		for away_fix in self.away_fixes:
-			fix_excursion = away_fix.distance_from(self)
-			if fix_excursion > self.max_excursion:
-				self.max_excursion = fix_excursion
+	def apply_summary(self, summary):
+		"""Take on the extremes and averages from summarize_clusters."""
 
-		self.fidelity = 100 * (len(self.home_fixes) / len(self.all_fixes))
+		self.x, self.y, self.min_x, self.max_x, self.min_y, self.max_y, self.avg_distance, self.max_excursion, self.fidelity, self.away_pattern = summary
 
-		short_status = {'home': 'O', 'away': '.'}
-		away_pattern = ''
-		for fix in self.all_fixes:
-			away_pattern += short_status[fix.status]
-		self.away_pattern = away_pattern
+		self.spread_x = self.max_x - self.min_x
+		self.spread_y = self.max_y - self.min_y
 
 
 class DataPool(GraphicBase):
@@ -854,7 +1377,8 @@ class DataPool(GraphicBase):
 	def filter_by_location(self, distance_limit):
 		"""Remove any fixes that are not within a given distance from the center."""
 
-		self.fixes = [fix for fix in self.fixes if fix.distance_from(self) <= distance_limit]
+		distances = catgm.distances_from(self.x, self.y, [fix.x for fix in self.fixes], [fix.y for fix in self.fixes])
+		self.fixes = [fix for fix, distance in zip(self.fixes, distances) if distance <= distance_limit]
 
 	def find_bounds(self):
 		"""Find how far in each direction the data extends."""
@@ -916,6 +1440,147 @@ class DataPool(GraphicBase):
 		self.fixes = unique
 
 
+class FixIndex(object):
+	"""A FixIndex sorts Fixes into a grid of cells, chronologically within each cell.
+
+	It is built once, then used for many searches that each need the
+	fixes near one place and time. A search only looks at the cells
+	that touch its circle, and within each cell only at the window of
+	time it needs."""
+
+	def __init__(self, fixes, cell_size):
+		self.cell_size = cell_size
+		self.cells = dict()
+
+		# Remember the original order, so searches can return fixes in it
+		for position, fix in enumerate(fixes):
+			key = (int(fix.x // cell_size), int(fix.y // cell_size))
+			if key not in self.cells:
+				self.cells[key] = list()
+			self.cells[key].append((fix.time, position, fix))
+
+		# Each cell is kept as a list of times and a matching list of entries
+		for key, entries in self.cells.items():
+			entries.sort(key=lambda entry: (entry[0], entry[1]))
+			self.cells[key] = ([entry[0] for entry in entries], entries)
+
+	def search(self, center, distance_limit, start_time, end_time):
+		"""Find fixes within a distance of the center, and between the start and end time.
+
+		Fixes are returned in chronological order, ties in their
+		original order, like a filtered and sorted DataPool."""
+
+		first_x = int((center.x - distance_limit) // self.cell_size)
+		last_x = int((center.x + distance_limit) // self.cell_size)
+		first_y = int((center.y - distance_limit) // self.cell_size)
+		last_y = int((center.y + distance_limit) // self.cell_size)
+
+		found = list()
+		for cell_x in range(first_x, last_x + 1):
+			for cell_y in range(first_y, last_y + 1):
+				if (cell_x, cell_y) not in self.cells:
+					continue
+
+				times, entries = self.cells[(cell_x, cell_y)]
+				first = bisect.bisect_left(times, start_time)
+				last = bisect.bisect_right(times, end_time)
+				for entry in entries[first:last]:
+					if entry[2].distance_from(center) <= distance_limit:
+						found.append(entry)
+
+		found.sort(key=lambda entry: (entry[0], entry[1]))
+		return [entry[2] for entry in found]
+
+
+
+
+class AreaIndex(object):
+	"""An AreaIndex sorts items into a grid of cells, by the area they cover.
+
+	Items have an x and y, or a min_x, max_x, min_y and max_y if they
+	cover an area. A search finds the items in the cells that touch a
+	rectangle, in their original order."""
+
+	def __init__(self, items, cell_size):
+		self.items = items
+		self.cell_size = cell_size
+		self.cells = dict()
+
+		for position, item in enumerate(items):
+			min_x = getattr(item, 'min_x', item.x)
+			max_x = getattr(item, 'max_x', item.x)
+			min_y = getattr(item, 'min_y', item.y)
+			max_y = getattr(item, 'max_y', item.y)
+
+			for cell_x in range(int(min_x // cell_size), int(max_x // cell_size) + 1):
+				for cell_y in range(int(min_y // cell_size), int(max_y // cell_size) + 1):
+					if (cell_x, cell_y) not in self.cells:
+						self.cells[(cell_x, cell_y)] = list()
+					self.cells[(cell_x, cell_y)].append(position)
+
+	def search(self, min_x, min_y, max_x, max_y):
+		"""Find the items in cells touching a rectangle."""
+
+		positions = set()
+		for cell_x in range(int(min_x // self.cell_size), int(max_x // self.cell_size) + 1):
+			for cell_y in range(int(min_y // self.cell_size), int(max_y // self.cell_size) + 1):
+				if (cell_x, cell_y) in self.cells:
+					positions.update(self.cells[(cell_x, cell_y)])
+
+		return [self.items[position] for position in sorted(positions)]
+
+
+class IntervalTree(object):
+	"""An IntervalTree answers which of a fixed set of intervals contain a given point.
+
+	Each node keeps the intervals that contain its center point, and
+	passes those wholly before or after it down to its children. The
+	intervals are (start, end, item) tuples, and include both ends."""
+
+	def __init__(self, intervals):
+		self.left = False
+		self.right = False
+
+		endpoints = sorted([interval[0] for interval in intervals] + [interval[1] for interval in intervals])
+		self.center = endpoints[len(endpoints) // 2]
+
+		left_intervals = [interval for interval in intervals if interval[1] < self.center]
+		right_intervals = [interval for interval in intervals if interval[0] > self.center]
+		here = [interval for interval in intervals if interval[0] <= self.center <= interval[1]]
+
+		self.by_start = sorted(here, key=lambda interval: interval[0])
+		self.by_end = sorted(here, key=lambda interval: interval[1], reverse=True)
+
+		if left_intervals:
+			self.left = IntervalTree(left_intervals)
+		if right_intervals:
+			self.right = IntervalTree(right_intervals)
+
+	def search(self, point):
+		"""Return the items of every interval that contains the point."""
+
+		found = list()
+		node = self
+		while node:
+			if point < node.center:
+				for interval in node.by_start:
+					if interval[0] > point:
+						break
+					found.append(interval[2])
+				node = node.left
+			elif point > node.center:
+				for interval in node.by_end:
+					if interval[1] < point:
+						break
+					found.append(interval[2])
+				node = node.right
+			else:
+				found.extend(interval[2] for interval in node.by_start)
+				break
+
+		return found
+
+
 
 
 # FUNCTIONS
@@ -994,6 +1659,309 @@ def catid_to_color(catid):
 	else:
 		return '#{0:02X}{1:02X}{2:02X}'.format((254 - int(sixstr[0:2])), (220 - int(sixstr[2:4])), (186 - int(sixstr[4:6])))
 
+def find_cluster_members(times, xs, ys, catids, seed_start, seed_stop, scan_stop, radius, time_cutoff, used, complete=True):
+	"""Search chronological fix data for clusters, returning positions rather than objects.
+
+	This is the clustering scan shared by Trails and DataPools. Fixes
+	are given as parallel lists in chronological order. Every position
+	from seed_start to seed_stop is considered in turn as the start of
+	a cluster, searching ahead no further than scan_stop. Positions of
+	home fixes are added to used, which may be carried over from an
+	earlier call. If complete is False there is more data past
+	scan_stop, and any search that runs into scan_stop is reported as
+	truncated because its result may be wrong.
+
+	Each cluster is returned as a list of (position, status) pairs in
+	the order the fixes were added."""
+
+	clusters = list()
+	truncated = list()
+
+	for seed in range(seed_start, seed_stop):
+		# Don't try to make a cluster from a point that's already in another cluster
+		if seed in used:
+			continue
+
+		members = False
+		cats_involved = dict()
+		potential_away = list()
+
+		# The reference is the seed fix, then the center of the cluster
+		ref_time = times[seed]
+		ref_x = xs[seed]
+		ref_y = ys[seed]
+		sum_x = xs[seed]
+		sum_y = ys[seed]
+		home_count = 1
+
+		reached_cutoff = False
+		for position in range(seed + 1, scan_stop):
+			if position in used:
+				continue
+
+			# If we reach the time cutoff, stop searching
+			if math.fabs(times[position] - ref_time) > time_cutoff:
+				reached_cutoff = True
+				break
+
+			delta_x = math.fabs(xs[position] - ref_x)
+			delta_y = math.fabs(ys[position] - ref_y)
+			if math.sqrt((delta_x ** 2) + (delta_y ** 2)) <= radius:
+				# Create a new cluster if necessary
+				if not members:
+					members = [(seed, 'home')]
+					cats_involved[catids[seed]] = 1
+
+				cats_involved[catids[position]] = 1
+
+				# Away fixes only count for cats already involved in the cluster
+				for away_position in potential_away:
+					if catids[away_position] in cats_involved:
+						members.append((away_position, 'away'))
+
+				members.append((position, 'home'))
+				potential_away = list()
+				used.add(position)
+
+				# Same arithmetic as Cluster.recalculate_core_data
+				sum_x += xs[position]
+				sum_y += ys[position]
+				home_count += 1
+				ref_x = sum_x / home_count
+				ref_y = sum_y / home_count
+				ref_time = times[position]
+			else:
+				potential_away.append(position)
+
+		if not reached_cutoff and not complete:
+			truncated.append(seed)
+
+		if members:
+			clusters.append(members)
+
+	return clusters, truncated
+
+def clusters_from_members(fixes, member_lists, cluster_class=False, *cluster_args):
+	"""Build Cluster objects out of the position lists from find_cluster_members.
+
+	Statuses are assigned in the same order as the scan assigned
+	them, so a fix that is away in one cluster and home in a later one
+	ends up with the same status either way."""
+
+	if not cluster_class:
+		cluster_class = Cluster
+
+	clusters = list()
+	for members in member_lists:
+		first_fix = fixes[members[0][0]]
+		first_fix.status = 'home'
+		cluster = cluster_class(first_fix, *cluster_args)
+		for position, status in members[1:]:
+			fix = fixes[position]
+			fix.status = status
+			cluster.add_fix(fix)
+		clusters.append(cluster)
+
+	return clusters
+
+def summarize_clusters(xs, ys, short_statuses, ranges):
+	"""Calculate the center, extremes and averages of many clusters at once.
+
+	Fixes of all clusters are given as parallel lists, with each
+	cluster's home fixes together in chronological order, followed by
+	its away fixes. Each cluster is a (start, split, stop) range into
+	the lists, where home fixes run from start to split. short_statuses
+	holds the O/. status of each cluster's fixes in chronological
+	order, over the same start to stop span.
+
+	Each summary is (x, y, min_x, max_x, min_y, max_y, avg_distance,
+	max_excursion, fidelity, away_pattern)."""
+
+	summaries = list()
+	for start, split, stop in ranges:
+		# The center is summed in the same order as Cluster.add_fix
+		sum_x = 0
+		sum_y = 0
+		for position in range(start, split):
+			sum_x += xs[position]
+			sum_y += ys[position]
+		home_count = split - start
+		center_x = sum_x / home_count
+		center_y = sum_y / home_count
+
+		sum_distance = 0
+		for position in range(start, split):
+			sum_distance += math.sqrt(((xs[position] - center_x) ** 2) + ((ys[position] - center_y) ** 2))
+
+		max_excursion = 0
+		for position in range(split, stop):
+			excursion = math.sqrt(((xs[position] - center_x) ** 2) + ((ys[position] - center_y) ** 2))
+			if excursion > max_excursion:
+				max_excursion = excursion
+
+		cluster_xs = xs[start:stop]
+		cluster_ys = ys[start:stop]
+		summaries.append((
+			center_x,
+			center_y,
+			min(cluster_xs),
+			max(cluster_xs),
+			min(cluster_ys),
+			max(cluster_ys),
+			sum_distance / home_count,
+			max_excursion,
+			100 * (home_count / (stop - start)),
+			''.join(short_statuses[start:stop])
+		))
+
+	return summaries
+
+def calculate_cluster_averages(clusters):
+	"""Have summarize_clusters work out the extremes and averages of each cluster in one go."""
+
+	short_status = {'home': 'O', 'away': '.'}
+
+	xs = list()
+	ys = list()
+	short_statuses = list()
+	ranges = list()
+	for cluster in clusters:
+		start = len(xs)
+		for fix in cluster.home_fixes:
+			xs.append(fix.x)
+			ys.append(fix.y)
+		split = len(xs)
+		for fix in cluster.away_fixes:
+			xs.append(fix.x)
+			ys.append(fix.y)
+		for fix in cluster.all_fixes:
+			short_statuses.append(short_status[cluster.fix_status(fix)])
+		ranges.append((start, split, len(xs)))
+
+	for cluster, summary in zip(clusters, summarize_clusters(xs, ys, short_statuses, ranges)):
+		cluster.apply_summary(summary)
+
+def tiny_number_label(text_to_draw, vertical):
+	"""Rasterize a label in the tiny number font once, as a 1-bit mask.
+
+	Each character is 5 pixels wide and 7 tall. Vertical labels are
+	the horizontal ones turned to read upwards."""
+
+	key = (text_to_draw, vertical)
+	if key not in tiny_number_labels:
+		if vertical:
+			label = tiny_number_label(text_to_draw, False).transpose(Image.ROTATE_90)
+		else:
+			label = Image.new('1', (len(text_to_draw) * 5, 7), 0)
+			label.putdata([int(point) for row in range(7) for number in text_to_draw for point in tiny_number_font[number][row * 5:(row + 1) * 5]])
+		tiny_number_labels[key] = label
+
+	return tiny_number_labels[key]
+
+def init_tile_worker(graphic):
+	"""Keep the object being cut into tiles, in a tile worker process."""
+
+	global tile_worker_graphic
+	tile_worker_graphic = graphic
+
+def render_tile_task(task):
+	"""Draw one tile of a tiled map, in a tile worker process."""
+
+	tile_worker_graphic.render_tile(*task)
+
+def create_images(graphics, outfilepaths, scale, jobs=1):
+	"""Create the feedback image of each object, across a process pool with more than one job.
+
+	Workers are sent the whole list of objects once, since they often
+	share fixes, rather than one object with each image. Returns the
+	path of each image, or False where it couldn't be created."""
+
+	created = [False] * len(graphics)
+
+	if jobs > 1 and len(graphics) > 1:
+		chunksize = max(1, len(graphics) // (jobs * 4))
+		image_output = (render_context.image_format, render_context.image_encoding)
+		with multiprocessing.Pool(min(jobs, len(graphics)), init_image_worker, (graphics, scale) + image_output) as pool:
+			for position, result in pool.imap_unordered(create_image_task, list(enumerate(outfilepaths)), chunksize):
+				created[position] = result is not False
+	else:
+		for position, graphic in enumerate(graphics):
+			created[position] = graphic.create_image(outfilepaths[position], scale) is not False
+
+		# Each image is saved while the next is drawn, so failures are known at the end
+		render_context.finish_saving()
+		for position, outfilepath in enumerate(outfilepaths):
+			if outfilepath in render_context.unsaved_paths:
+				created[position] = False
+
+	return [image_created and outfilepath for outfilepath, image_created in zip(outfilepaths, created)]
+
+def init_image_worker(graphics, scale, image_format, image_encoding):
+	"""Keep the objects and scale of a batch of images, in an image worker process."""
+
+	global image_worker_batch
+	image_worker_batch = (graphics, scale)
+	set_image_output(image_format, image_encoding)
+
+def create_image_task(task):
+	"""Create one image of a batch, in an image worker process."""
+
+	position, outfilepath = task
+	graphics, scale = image_worker_batch
+	result = graphics[position].create_image(outfilepath, scale)
+
+	# The worker may be stopped as soon as the batch is done
+	if not render_context.finish_saving():
+		result = False
+
+	return (position, result)
+
+def set_image_output(image_format, image_encoding):
+	"""Set the format and encoding that the shared RenderContext saves images with."""
+
+	render_context.set_image_output(image_format, image_encoding)
+
+def find_save_options(pil_format, image_encoding):
+	"""Find the Pillow save options for a format, from a preset name or an effort level 0-9."""
+
+	if image_encoding in image_encodings:
+		return image_encodings[image_encoding].get(pil_format, dict())
+
+	level = int(image_encoding)
+	if pil_format == 'PNG':
+		return {'compress_level': level}
+	elif pil_format == 'WEBP':
+		return {'lossless': True, 'quality': level * 100 // 9, 'method': level * 6 // 9}
+	else:
+		return dict()
+
+def write_manifest(manifestpath, id_header, ids, imagepaths):
+	"""Write a CSV file listing the image created for each ID, blank if there is none."""
+
+	with open(manifestpath, 'wt', newline='') as manifestfile:
+		manifest = csvwriter(manifestfile)
+		manifest.writerow([id_header, 'Image_File'])
+		for item_id, imagepath in zip(ids, imagepaths):
+			manifest.writerow([item_id, os.path.basename(imagepath) if imagepath else ''])
+
+def check_image_format_arg(format_arg):
+	"""Check an image output format passed from the command line."""
+
+	image_format = format_arg.lower()
+	if image_format not in image_formats:
+		raise argparse.ArgumentTypeError('Not an image format: {}. Use one of {}.'.format(format_arg, ', '.join(image_formats)))
+
+	return image_format
+
+def check_image_encoding_arg(encoding_arg):
+	"""Check an image encoding passed from the command line, a preset name or an effort level 0-9."""
+
+	image_encoding = encoding_arg.lower()
+	if image_encoding not in image_encodings and image_encoding not in [str(level) for level in range(10)]:
+		raise argparse.ArgumentTypeError('Not an image encoding: {}. Use one of {}, or 0-9.'.format(encoding_arg, ', '.join(image_encodings)))
+
+	return image_encoding
+
 def comma_string_to_list(comma_string):
 	"""Convert comma-separated argument from command line into a list."""
 
@@ -1009,7 +1977,29 @@ def date_string_to_objects(date_str):
 		return False
 
 	dateobj = dateparser.parse(date_str)
-	return (dateobj, time.mktime(dateobj.timetuple()))
+	return (dateobj, epoch_time(dateobj))
+
+def epoch_time(dateobj):
+	"""Convert a datetime to seconds since the epoch. Naive datetimes are taken to be UTC."""
+
+	return calendar.timegm(dateobj.utctimetuple())
+
+def utc_dateobj(epoch_seconds):
+	"""Convert seconds since the epoch to a naive UTC datetime, reusing any made before."""
+
+	if epoch_seconds not in utc_dateobjs:
+		utc_dateobjs[epoch_seconds] = EPOCH_DATEOBJ + datetime.timedelta(seconds=epoch_seconds)
+
+	return utc_dateobjs[epoch_seconds]
+
+def format_time(epoch_seconds, date_format):
+	"""Format seconds since the epoch as a UTC date string, reusing any made before."""
+
+	key = (epoch_seconds, date_format)
+	if key not in formatted_times:
+		formatted_times[key] = utc_dateobj(epoch_seconds).strftime(date_format)
+
+	return formatted_times[key]
 
 def hours_arg_to_seconds(hours_arg):
 	"""Convert hour string argument from command line into seconds as an integer."""
@@ -1017,6 +2007,14 @@ def hours_arg_to_seconds(hours_arg):
 	seconds = int(hours_arg) * 3600
 	return seconds
 
+def jobs_arg_to_count(jobs_arg):
+	"""Convert job count argument from command line into a number of processes. Zero means every core."""
+
+	jobs = int(jobs_arg)
+	if jobs < 1:
+		jobs = os.cpu_count() or 1
+	return jobs
+
 def check_file_arg(file_arg):
 	"""Check the validity of a file argument passed from the command line."""
 
@@ -1095,7 +2093,11 @@ fallback_values = {
 	'start_date': '0',
 	'end_date': '0',
 	'dot_size': '4',
-	'perimeter_resolution': '9'
+	'perimeter_resolution': '9',
+	'catalogue_path': 'catalogue',
+	'utm_zone': '0',
+	'image_format': 'png',
+	'image_encoding': 'balanced'
 }
 
 config = RawConfigParser(fallback_values)
@@ -1108,6 +2110,9 @@ cfg_data_column_catid = config.get('Global_Settings', 'data_column_catid')
 cfg_data_column_utcdatetime = config.get('Global_Settings', 'data_column_utcdatetime')
 cfg_data_column_utmy = config.get('Global_Settings', 'data_column_utmy')
 cfg_data_column_utmx = config.get('Global_Settings', 'data_column_utmx')
+cfg_utm_zone = config.get('Global_Settings', 'utm_zone')
+cfg_image_format = config.get('Global_Settings', 'image_format')
+cfg_image_encoding = config.get('Global_Settings', 'image_encoding')
 
 cfg_cluster_radius = config.get('Cluster_Settings', 'radius')
 cfg_cluster_time_cutoff = config.get('Cluster_Settings', 'time_cutoff')
@@ -1132,3 +2137,7 @@ cfg_whodunit_time_cutoff = config.get('Whodunit_Settings', 'time_cutoff')
 cfg_matchsurvey_survey_file_path = config.get('Match_Survey_Settings', 'survey_file_path')
 cfg_matchsurvey_radius = config.get('Match_Survey_Settings', 'radius')
 cfg_matchsurvey_time_cutoff = config.get('Match_Survey_Settings', 'time_cutoff')
+cfg_matchsurvey_catalogue_path = config.get('Match_Survey_Settings', 'catalogue_path')
+
+# Images drawn in this process share a font and recent backgrounds
+render_context = RenderContext()
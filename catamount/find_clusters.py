@@ -39,6 +39,8 @@ class FCTrail(catcm.Trail):
 
 	It adds the ability to find clusters, do calculations, and display clusters."""
 
+	tile_lists = ('clusters', 'fixes')
+
 	def __init__(self, catid, radius, time_cutoff, minimum_count, minimum_stay):
 		catcm.Trail.__init__(self, catid)
 
@@ -53,87 +55,26 @@ class FCTrail(catcm.Trail):
 	def find_clusters(self):
 		"""Search through a list of fixes and identify clusters."""
 
-		# Start with a new list of all points, and an empty mapping for used points
-		fixes = list(self.fixes)
-		already_used = dict()
-
-		# Consider each point in turn
-		while fixes:
-			current_item = fixes.pop(0)
-
-			# Don't try to make a cluster from a point that's already in another cluster
-			if current_item.time in already_used:
-				continue
-
-			# Begin searching ahead in the chronology to find points matching the current one
-			if fixes:
-				potential_away_fixes = list()
-
-				for fix in fixes:
-
-					# If this fix has already been used in another cluster, don't consider it
-					if fix.time in already_used:
-						continue
-
-					# If we reach the time cutoff, stop searching.
-					if fix.delay_from(current_item) > self.time_cutoff:
-						break
-
-					# If the first two tests succeeded, and distance matches, we have a match
-					if fix.distance_from(current_item) <= self.radius:
-
-						# Create a new cluster if necessary
-						if isinstance(current_item, catcm.Fix):
-							first_fix = current_item
-							first_fix.status = 'home'
-							current_item = FCCluster(first_fix, self.radius, self.time_cutoff, self.minimum_count, self.minimum_stay, self.legend_start_date, self.legend_end_date)
+		# Fixes need to be in chronological order before this point
+		times = [fix.time for fix in self.fixes]
+		xs = [fix.x for fix in self.fixes]
+		ys = [fix.y for fix in self.fixes]
+		catids = [fix.catid for fix in self.fixes]
 
-						# Add any away points that may have accumulated.
-						# This should come before adding the home fix, for chronology
-						for away_fix in potential_away_fixes:
-							away_fix.status = 'away'
-							current_item.add_fix(away_fix)
+		member_lists, truncated = catcm.find_cluster_members(times, xs, ys, catids, 0, len(times), len(times), self.radius, self.time_cutoff, set())
 
-						# Add the matching point to the cluster.
-						# This should come after adding each away fix, for chronology
-						fix.status = 'home'
-						current_item.add_fix(fix)
+		cluster_args = (self.radius, self.time_cutoff, self.minimum_count, self.minimum_stay, self.legend_start_date, self.legend_end_date)
+		self.clusters.extend(catcm.clusters_from_members(self.fixes, member_lists, FCCluster, *cluster_args))
 
-						# Empty the list of potential away fixes
-						potential_away_fixes = list()
-
-						# Make a note that this fix has already appeared in a cluster
-						already_used[fix.time] = 1
-
-					# If the current point did not match, it is a potential away fix
-					else:
-						potential_away_fixes.append(fix)
-
-			# This is seen when we are able to pop one, but not search ahead.
-			# That means it's the last point from the list, unable to match anything
-			else:
-				pass
-
-			# All attempts to create a cluster around the current_item have now finished
-
-			# If we made a cluster, commit it to the list
-			if isinstance(current_item, catcm.Cluster):
-				self.clusters.append(current_item)
-				current_item = False
-			# If we did not make a cluster, current_item must be a fix that didn't match anything
-			else:
-				pass
-
-		# When we run out of fixes to examine, we may still have a cluster that needs to be committed
-		if isinstance(current_item, catcm.Cluster):
-			self.clusters.append(current_item)
+	def tile_margin(self):
+		"""Cluster circles reach out a radius from the center, past the fixes."""
 
+		return self.radius + catcm.GraphicBase.tile_margin(self)
 
 	def calculate_cluster_averages(self):
-		"""Call the averaging function for each cluster."""
+		"""Work out the averages for all clusters at once."""
 
-		for cluster in self.clusters:
-			cluster.calculate_averages()
+		catcm.calculate_cluster_averages(self.clusters)
 
 	def filter_clusters_by_count(self):
 		"""Remove clusters that have fewer than the minumum number of clusters."""
@@ -165,10 +106,10 @@ class FCTrail(catcm.Trail):
 		if all_points:
 			sys.stdout.write('\n')
 
-			fix_field_list = ['Cluster_ID', 'Fix_ID', 'Date', 'X', 'Y', 'Status', 'Day_Pd']
+			fix_field_list = ['Cluster_ID', 'Fix_ID', 'Date', 'X', 'Y', 'Status', 'Day_Pd', 'Sun_Elev', 'Twilight']
 			sys.stdout.write(','.join(fix_field_list) + '\n')
 
-			empty_field_list = ['', '', '', '', '', '', '']
+			empty_field_list = ['', '', '', '', '', '', '', '', '']
 
 			for cluster in self.clusters:
 				cluster.fixes_csv_report()
@@ -226,10 +167,7 @@ class FCTrail(catcm.Trail):
 			)
 
 		# Create a scatter plot of all fixes
-		for fix in self.fixes:
-			img_x = self.img_x(fix.x)
-			img_y = self.img_y(fix.y)
-			self.fgdraw.point((img_x, img_y), catcm.image_colors['fg'])
+		self.draw_dots([fix.x for fix in self.fixes], [fix.y for fix in self.fixes], catcm.image_colors['fg'])
 
 
 class FCCluster(catcm.Cluster):
@@ -252,8 +190,8 @@ class FCCluster(catcm.Cluster):
 
 		field_list = [
 			self.id,
-			self.start_dateobj.strftime(catcm.DATE_FMT_ISO),
-			self.end_dateobj.strftime(catcm.DATE_FMT_ISO),
+			catcm.format_time(self.start_time, catcm.DATE_FMT_ISO),
+			catcm.format_time(self.end_time, catcm.DATE_FMT_ISO),
 			'{:0.2f}'.format(self.elapsed_time / 3600),
 			'{:0.1f}'.format(self.x),
 			'{:0.1f}'.format(self.y),
@@ -276,7 +214,7 @@ class FCCluster(catcm.Cluster):
 		"""Create a descriptive stanza for this cluster."""
 
 		output = 'Cluster {}\n'.format(self.id)
-		output += '  Dates: From {} to {} (utc)\n'.format(self.start_dateobj.strftime(catcm.DATE_FMT_ISO), self.end_dateobj.strftime(catcm.DATE_FMT_ISO))
+		output += '  Dates: From {} to {} (utc)\n'.format(catcm.format_time(self.start_time, catcm.DATE_FMT_ISO), catcm.format_time(self.end_time, catcm.DATE_FMT_ISO))
 		output += '  Elapsed Time: {:0.2f} hours\n'.format(self.elapsed_time / 3600)
 		output += '  Center Location: {:0.2f} east, {:0.2f} north (NAD27)\n'.format(self.x, self.y)
 		output += '  Points: {} in cluster, {} away from cluster, {} total\n'.format(len(self.home_fixes), len(self.away_fixes), len(self.all_fixes))
@@ -312,8 +250,8 @@ class FCCluster(catcm.Cluster):
 
 		column_2 = list()
 		column_2.append(('Cluster ID', self.id))
-		column_2.append(('Start Date', self.start_dateobj.strftime(catcm.DATE_FMT_ISO_SHORT)))
-		column_2.append(('End Date', self.end_dateobj.strftime(catcm.DATE_FMT_ISO_SHORT)))
+		column_2.append(('Start Date', catcm.format_time(self.start_time, catcm.DATE_FMT_ISO_SHORT)))
+		column_2.append(('End Date', catcm.format_time(self.end_time, catcm.DATE_FMT_ISO_SHORT)))
 		column_2.append(('Center X', '{:0.1f}'.format(self.x)))
 		column_2.append(('Center Y', '{:0.1f}'.format(self.y)))
 		column_2.append(('Fidelity', '{}/{}, {:0.2f}%'.format(len(self.home_fixes), len(self.all_fixes), self.fidelity)))
@@ -336,22 +274,14 @@ class FCCluster(catcm.Cluster):
 		self.fgimage.paste(circleimg, (img_x - radius, img_y - radius), circlemask)
 
 		# Draw a line between all fixes
-		fix_line_coords = list()
-		for fix in self.all_fixes:
-			pt_img_x = self.img_x(fix.x)
-			pt_img_y = self.img_y(fix.y)
-			fix_line_coords.append((pt_img_x, pt_img_y))
-		self.fgdraw.line(fix_line_coords, catcm.image_colors['trail'])
+		self.draw_trail([fix.x for fix in self.all_fixes], [fix.y for fix in self.all_fixes], catcm.image_colors['trail'])
 
 		# Draw a cross at the center of the cluster
 		self.fgdraw.line([(img_x - 2, img_y), (img_x + 2, img_y)], catcm.image_colors['cluster'])
 		self.fgdraw.line([(img_x, img_y - 2), (img_x, img_y + 2)], catcm.image_colors['cluster'])
 
 		# Create a scatter plot of all fixes
-		for fix in self.all_fixes:
-			pt_img_x = self.img_x(fix.x)
-			pt_img_y = self.img_y(fix.y)
-			self.fgdraw.point((pt_img_x, pt_img_y), catcm.image_colors['fg'])
+		self.draw_dots([fix.x for fix in self.all_fixes], [fix.y for fix in self.all_fixes], catcm.image_colors['fg'])
 
 
 # FUNCTIONS
@@ -25,17 +25,29 @@
 # IMPORT
 
 import sys
+import bisect
+import multiprocessing
 
 from PIL import Image
 from PIL import ImageDraw
 
 import catamount.common as catcm
+import catamount.geometry as catgm
 
 
 # CONSTANTS/GLOBALS
 
 crossing_dot_size = 4
 
+# When finding clusters in parallel, the time axis is split into one
+# partition for each job, but none shorter than this many time cutoffs.
+# Each partition also starts searching partition_overlap time cutoffs
+# before its own span, and searches as far into the next one, so it
+# can fall in step with the partition before it and finish the
+# clusters that cross over.
+partition_minimum = 16
+partition_overlap = 2
+
 
 # CLASSES
 
@@ -44,6 +56,8 @@ class FXDataPool(catcm.DataPool):
 
 	This adds the ability to find crossings and display them."""
 
+	tile_lists = ('crossings',)
+
 	def __init__(self, radius, time_cutoff):
 		catcm.DataPool.__init__(self)
 
@@ -53,94 +67,259 @@ class FXDataPool(catcm.DataPool):
 		self.legend_start_date = '0'
 		self.legend_end_date = '0'
 
-	def find_clusters(self):
+	def find_clusters(self, jobs=1):
 		"""Search through a list of fixes and identify clusters.
 
 		This is based on find_clusters for a single cat, then adapted
-		to find clusters across multiple cats."""
-
-		self.clusters = list()
-
-		fixes = list(self.fixes) # A new list of all fixes
-		already_used = dict() # A map of which points have already been used
-		cats_involved = dict() # A map of which cats are involved in the cluster
-
-		# Consider each fix in the list in turn
-		while fixes:
-			# Take the first fix from the list
-			current_item = fixes.pop(0)
-
-			# If this fix has already been used in another cluster, skip it
-			if '{}-{}'.format(current_item.catid, current_item.time) in already_used:
-				continue
-
-			# Search ahead in the list of fixes, looking for matches
-			if fixes:
-				# This list keeps track of unmatched points in case they turn out to be "away" points
-				potential_away_fixes = list()
-
-				for fix in fixes:
-					# If this fix has already been used in another cluster, skip it
-					if '{}-{}'.format(fix.catid, fix.time) in already_used:
-						continue
-
-					# If we have gone past the time limit we can stop searching forward
-					if fix.delay_from(current_item) > self.time_cutoff:
-						break
-
-					# If time is okay and distance is okay, we found a match
-					if fix.distance_from(current_item) <= self.radius:
-
-						# Create a new cluster if necessary
-						if isinstance(current_item, catcm.Fix):
-							first_fix = current_item
-							first_fix.status = 'home'
-							current_item = catcm.Cluster(first_fix)
-							cats_involved[first_fix.catid] = 1
-
-						if not fix.catid in cats_involved:
-							cats_involved[fix.catid] = 1
-
-						# Add any away fixes that have accumulated
-						for away_fix in potential_away_fixes:
-							# Only add away fixes if they are for a cat already involved in this cluster
-							if away_fix.catid in cats_involved:
-								away_fix.status = 'away'
-								current_item.add_fix(away_fix)
-
-						# Add the matched fix to the cluster
-						fix.status = 'home'
-						current_item.add_fix(fix)
-
-						# Empty the potential away points list
-						potential_away_fixes = list()
+		to find clusters across multiple cats. With more than one job
+		the time axis is split into partitions that are searched in
+		parallel, then stitched together so that the clusters are the
+		same as those found by a single pass."""
+
+		# Fixes need to be in chronological order before this point
+		times = [fix.time for fix in self.fixes]
+		xs = [fix.x for fix in self.fixes]
+		ys = [fix.y for fix in self.fixes]
+		catids = [fix.catid for fix in self.fixes]
+
+		partitions = list()
+		if jobs > 1:
+			partitions = self.partition_by_time(times, jobs)
+
+		if len(partitions) > 1:
+			member_lists = self.find_clusters_in_partitions(times, xs, ys, catids, partitions, jobs)
+		else:
+			member_lists, truncated = catcm.find_cluster_members(times, xs, ys, catids, 0, len(times), len(times), self.radius, self.time_cutoff, set())
+
+		self.clusters = catcm.clusters_from_members(self.fixes, member_lists)
+
+	def partition_by_time(self, times, jobs):
+		"""Divide positions in the chronological list of fixes into time partitions.
+
+		Each partition is (scan_start, seed_start, seed_stop, scan_stop).
+		Clusters starting between seed_start and seed_stop are searched
+		for using fixes from scan_start to scan_stop, which overlap into
+		the partitions on either side."""
+
+		partitions = list()
+		if not times:
+			return partitions
+
+		span = max((times[-1] - times[0]) / jobs, self.time_cutoff * partition_minimum)
+		overlap = self.time_cutoff * partition_overlap
+		partition_start = times[0]
+		seed_start = 0
+		while seed_start < len(times):
+			partition_end = partition_start + span
+			seed_stop = bisect.bisect_left(times, partition_end, seed_start)
+			scan_start = bisect.bisect_left(times, partition_start - overlap, 0, seed_start)
+			scan_stop = bisect.bisect_right(times, partition_end + overlap, seed_stop)
+			if seed_stop > seed_start:
+				partitions.append((scan_start, seed_start, seed_stop, scan_stop))
+			partition_start = partition_end
+			seed_start = seed_stop
+
+		return partitions
+
+	def find_clusters_in_partitions(self, times, xs, ys, catids, partitions, jobs):
+		"""Search each time partition in a process pool, then stitch the results together.
+
+		Which clusters start at a position depends only on the home
+		fixes at or after it that earlier clusters have already used.
+		Each partition starts searching before its own span, so by the
+		time it reaches its span it has usually used the same fixes as
+		the stitched result. From the first position where the two
+		agree, the partition's clusters are the same as a single pass
+		would find, until a search runs off the end of the partition's
+		data. Positions the partitions can't account for are searched
+		against the stitched result."""
+
+		tasks = list()
+		for scan_start, seed_start, seed_stop, scan_stop in partitions:
+			tasks.append((
+				times[scan_start:scan_stop],
+				xs[scan_start:scan_stop],
+				ys[scan_start:scan_stop],
+				catids[scan_start:scan_stop],
+				seed_stop - scan_start,
+				self.radius,
+				self.time_cutoff,
+				scan_stop == len(times)
+			))
+
+		with multiprocessing.Pool(min(jobs, len(tasks))) as pool:
+			results = pool.map(find_partition_clusters, tasks)
+
+		member_lists = list()
+		used = set()
+		stitched_stop = 0
+
+		for (scan_start, seed_start, seed_stop, scan_stop), (partition_lists, partition_truncated) in zip(partitions, results):
+			# The partition knows nothing before its own data
+			if stitched_stop < scan_start:
+				new_lists, truncated = catcm.find_cluster_members(times, xs, ys, catids, stitched_stop, scan_start, len(times), self.radius, self.time_cutoff, used)
+				member_lists.extend(new_lists)
+				stitched_stop = scan_start
+
+			# Partition results are relative to the start of the partition's data
+			partition_clusters = dict()
+			for members in partition_lists:
+				partition_clusters[members[0][0] + scan_start] = [(position + scan_start, status) for position, status in members]
+			if partition_truncated:
+				trusted_stop = partition_truncated[0] + scan_start
+			else:
+				trusted_stop = seed_stop
 
-						# Mark the matched point as having already appeared in a cluster
-						already_used['{}-{}'.format(fix.catid, fix.time)] = 1
+			# Fixes at or past scan_start already used by the stitched result
+			stitched_clusters = dict()
+			stitched_used = set()
+			for members in member_lists:
+				if members[-1][0] < scan_start:
+					continue
+				if members[0][0] >= scan_start:
+					stitched_clusters[members[0][0]] = members
+				else:
+					stitched_used.update(position for position, status in members if status == 'home' and position >= scan_start)
+			partition_used = set()
+
+			# Walk forward until both have used the same fixes ahead
+			position = scan_start
+			while position < trusted_stop and stitched_used != partition_used:
+				if position >= stitched_stop:
+					new_lists, truncated = catcm.find_cluster_members(times, xs, ys, catids, position, position + 1, len(times), self.radius, self.time_cutoff, used)
+					member_lists.extend(new_lists)
+					stitched_stop = position + 1
+					if new_lists:
+						stitched_clusters[position] = new_lists[0]
+
+				for clusters, used_ahead in [(stitched_clusters, stitched_used), (partition_clusters, partition_used)]:
+					used_ahead.discard(position)
+					if position in clusters:
+						used_ahead.update(member_position for member_position, status in clusters[position][1:] if status == 'home')
+
+				position += 1
+
+			# Take the partition's own clusters until its data ran short
+			if stitched_used == partition_used:
+				for seed in range(max(position, stitched_stop), trusted_stop):
+					if seed in partition_clusters:
+						members = partition_clusters[seed]
+						member_lists.append(members)
+						used.update(member_position for member_position, status in members[1:] if status == 'home')
+				stitched_stop = max(stitched_stop, trusted_stop)
+
+		# Anything the last partition left is done in one pass
+		if stitched_stop < len(times):
+			new_lists, truncated = catcm.find_cluster_members(times, xs, ys, catids, stitched_stop, len(times), len(times), self.radius, self.time_cutoff, used)
+			member_lists.extend(new_lists)
+
+		return member_lists
+
+	def index_by_cat(self):
+		"""Divide the chronological fixes by cat, keeping a list of times for binary searches."""
+
+		cat_index = dict()
+		for fix in self.fixes:
+			if fix.catid not in cat_index:
+				cat_index[fix.catid] = (list(), list())
+			cat_index[fix.catid][0].append(fix.time)
+			cat_index[fix.catid][1].append(fix)
+
+		return cat_index
+
+	def find_focal_crossings(self, focal_catid, partner_catid=False):
+		"""Find crossings between one focal cat and the others, or one partner.
+
+		Rather than clustering the whole pool, each of the focal cat's
+		fixes is compared only with the fixes of other cats that fall
+		within the time cutoff, found by binary search. Meetings with
+		the same cat that are no more than the time cutoff apart are
+		grouped into one crossing between the two cats, and meetings
+		with the same cat that overlap in time are merged.
+
+		Crossings here are always between two cats. Where the pool scan
+		finds one crossing of three cats, this finds a crossing for each
+		pair of them that includes the focal cat."""
+
+		cat_index = self.index_by_cat()
+		self.crossings = list()
 
-					# If we didn't find a match, this point becomes a potential away point
-					else:
-						potential_away_fixes.append(fix)
+		if focal_catid not in cat_index:
+			return
+
+		focal_times, focal_fixes = cat_index[focal_catid]
+		focal_xs = [fix.x for fix in focal_fixes]
+		focal_ys = [fix.y for fix in focal_fixes]
+
+		if partner_catid:
+			other_catids = [catid for catid in [partner_catid] if catid in cat_index and catid != focal_catid]
+		else:
+			other_catids = sorted(catid for catid in cat_index if catid != focal_catid)
+
+		for other_catid in other_catids:
+			other_times, other_fixes = cat_index[other_catid]
+			other_xs = [fix.x for fix in other_fixes]
+			other_ys = [fix.y for fix in other_fixes]
+
+			# Each meeting is a list of matching fix pairs
+			meetings = list()
+			meeting_end = False
+			for focal_position, other_position in catgm.pairs_within(focal_times, focal_xs, focal_ys, other_times, other_xs, other_ys, self.time_cutoff, self.radius):
+				focal_fix = focal_fixes[focal_position]
+				other_fix = other_fixes[other_position]
+
+				# A new meeting begins after a gap longer than the time
+				# cutoff, or away from the center of the current meeting
+				pair_start = min(focal_fix.time, other_fix.time)
+				if meeting_end is False or pair_start - meeting_end > self.time_cutoff or catgm.distance(focal_fix.x, focal_fix.y, center_x, center_y) > self.radius:
+					meetings.append(list())
+					meeting_end = pair_start
+					sum_x = 0
+					sum_y = 0
+				meetings[-1].append((focal_fix, other_fix))
+				meeting_end = max(meeting_end, focal_fix.time, other_fix.time)
+
+				sum_x += focal_fix.x + other_fix.x
+				sum_y += focal_fix.y + other_fix.y
+				center_x = sum_x / (2 * len(meetings[-1]))
+				center_y = sum_y / (2 * len(meetings[-1]))
+
+			meetings = merge_overlapping_meetings(meetings)
+
+			for meeting in meetings:
+				self.crossings.append(self.meeting_to_crossing(meeting, focal_times, focal_fixes, other_times, other_fixes))
+
+		self.crossings = sorted(self.crossings, key=lambda crossing: crossing.start_time)
+
+	def meeting_to_crossing(self, meeting, focal_times, focal_fixes, other_times, other_fixes):
+		"""Turn a list of matching fix pairs into a Crossing of two cats."""
+
+		home_fixes = list()
+		seen = dict()
+		for pair in meeting:
+			for fix in pair:
+				if fix in seen:
+					continue
+				seen[fix] = 1
+				home_fixes.append(fix)
 
-			# This is seen when we are able to pop one, but not search ahead
-			else:
-				pass
+		start_time = min(fix.time for fix in home_fixes)
+		end_time = max(fix.time for fix in home_fixes)
 
-			# All attempts to create a cluster aroud the current fix have finished
+		# Any other fixes from the two cats during the meeting are away fixes
+		away_fixes = list()
+		for times, fixes in [(focal_times, focal_fixes), (other_times, other_fixes)]:
+			first = bisect.bisect_left(times, start_time)
+			last = bisect.bisect_right(times, end_time)
+			for fix in fixes[first:last]:
+				if fix not in seen:
+					away_fixes.append(fix)
 
-			# If we made a cluster, time to commit it to the list
-			if isinstance(current_item, catcm.Cluster):
-				self.clusters.append(current_item)
-				current_item = False
-				cats_involved = dict()
-			# If we did not make a cluster, this is an unmatched point that is okay to drop
-			else:
-				pass
+		home_fixes = sorted(home_fixes, key=lambda home_fix: home_fix.time)
+		catids = sorted([meeting[0][0].catid, meeting[0][1].catid])
+		crossingid = '{}-{}'.format(catcm.format_time(home_fixes[0].time, catcm.DATE_FMT_ID), '_'.join(catids))
 
-		# When all fixes have been examined, we may still have a
-		# cluster that needs to be committed
-		if isinstance(current_item, catcm.Cluster):
-			self.clusters.append(current_item)
+		return Crossing(crossingid, home_fixes, away_fixes, home_fixes + away_fixes, catids, self.radius, self.time_cutoff, self.legend_start_date, self.legend_end_date, meeting)
 
 	def clusters_to_crossings(self):
 		"""Turn a cluster into a crossing if it involves more than one cat."""
@@ -162,7 +341,7 @@ class FXDataPool(catcm.DataPool):
 
 			# Do the following if the cluster involves more than one cat
 			catids = sorted(catids)
-			crossingid = '{}-{}'.format(cluster.home_fixes[0].dateobj.strftime(catcm.DATE_FMT_ID), '_'.join(catids))
+			crossingid = '{}-{}'.format(catcm.format_time(cluster.home_fixes[0].time, catcm.DATE_FMT_ID), '_'.join(catids))
 			self.crossings.append(
 				Crossing(crossingid, cluster.home_fixes, cluster.away_fixes, cluster.all_fixes, catids, self.radius, self.time_cutoff, self.legend_start_date, self.legend_end_date)
 			)
@@ -224,10 +403,10 @@ class FXDataPool(catcm.DataPool):
 		if all_points:
 			sys.stdout.write('\n')
 
-			fix_field_list = ['Cross_ID', 'Cat_ID', 'Fix_ID', 'Date', 'X', 'Y', 'Status', 'Day_Pd']
+			fix_field_list = ['Cross_ID', 'Cat_ID', 'Fix_ID', 'Date', 'X', 'Y', 'Status', 'Day_Pd', 'Sun_Elev', 'Twilight']
 			sys.stdout.write(','.join(fix_field_list) + '\n')
 
-			empty_field_list = ['', '', '', '', '', '', '', '']
+			empty_field_list = ['', '', '', '', '', '', '', '', '', '']
 
 			for crossing in self.crossings:
 				crossing.fixes_csv_report()
@@ -268,45 +447,39 @@ class FXDataPool(catcm.DataPool):
 		self.draw_legend(True)
 
 		# Draw a faintly colored dot for every away point
-		awayimg = Image.new('RGB', (self.imgwidth, self.imgheight), catcm.image_colors['bg'])
-		awayimgdraw = ImageDraw.Draw(awayimg)
-		awaymask = Image.new('L', (self.imgwidth, self.imgheight), '#000000')
-		awaymaskdraw = ImageDraw.Draw(awaymask)
-		
+		away = catcm.Layer((self.imgwidth, self.imgheight), catcm.image_colors['bg'])
+
 		for crossing in self.crossings:
 			for away_fix in crossing.away_fixes:
 				img_x = self.img_x(away_fix.x)
 				img_y = self.img_y(away_fix.y)
 				radius = crossing_dot_size / 2
 				bigger = crossing_dot_size
-				awayimgdraw.ellipse(
+				away.draw(
+					'ellipse',
 					[(img_x - bigger, img_y - bigger), (img_x + bigger, img_y + bigger)],
 					self.cat_colors[away_fix.catid], self.cat_colors[away_fix.catid]
 				)
-				awaymaskdraw.ellipse(
+				away.draw_mask(
+					'ellipse',
 					[(img_x - radius, img_y - radius), (img_x + radius, img_y + radius)],
 					'#404040', '#404040'
 				)
-		
-		self.fgimage.paste(awayimg, (0, 0), awaymask)
+
+		away.paste_onto(self.fgimage)
 
 		# Draw a colored dot for every home point
-		for crossing in self.crossings:
-			for home_fix in crossing.home_fixes:
-				img_x = self.img_x(home_fix.x)
-				img_y = self.img_y(home_fix.y)
-				radius = crossing_dot_size / 2
-				self.fgdraw.ellipse(
-					[(img_x - radius, img_y - radius), (img_x + radius, img_y + radius)],
-					self.cat_colors[home_fix.catid], self.cat_colors[home_fix.catid]
-				)
+		home_fixes = [home_fix for crossing in self.crossings for home_fix in crossing.home_fixes]
+		self.draw_dots(
+			[home_fix.x for home_fix in home_fixes],
+			[home_fix.y for home_fix in home_fixes],
+			[self.cat_colors[home_fix.catid] for home_fix in home_fixes],
+			crossing_dot_size
+		)
 
 		# Draw a black dot for every point
-		for crossing in self.crossings:
-			for fix in crossing.all_fixes:
-				img_x = self.img_x(fix.x)
-				img_y = self.img_y(fix.y)
-				self.fgdraw.point((img_x, img_y), catcm.image_colors['fg'])
+		all_fixes = [fix for crossing in self.crossings for fix in crossing.all_fixes]
+		self.draw_dots([fix.x for fix in all_fixes], [fix.y for fix in all_fixes], catcm.image_colors['fg'])
 
 
 
@@ -316,8 +489,12 @@ class Crossing(catcm.Cluster):
 	A Crossing is like a meeting of two or more cats. It is also like
 	a Cluster that involves more than one cat."""
 
-	def __init__(self, crossingid, home_fixes, away_fixes, all_fixes, catids, radius, time_cutoff, legend_start_date, legend_end_date):
+	def __init__(self, crossingid, home_fixes, away_fixes, all_fixes, catids, radius, time_cutoff, legend_start_date, legend_end_date, meeting=False):
 		self.id = crossingid
+		self.meeting = meeting
+		self.home_set = False
+		if meeting:
+			self.home_set = set(home_fixes)
 		self.home_fixes = sorted(home_fixes, key=lambda home_fix: home_fix.time)
 		self.away_fixes = sorted(away_fixes, key=lambda away_fix: away_fix.time)
 		self.all_fixes = sorted(all_fixes, key=lambda all_fix: all_fix.time)
@@ -334,6 +511,20 @@ class Crossing(catcm.Cluster):
 		self.find_cat_colors()
 		self.find_closest_meeting()
 
+	def fix_status(self, fix):
+		"""Find whether a fix is home or away in this crossing.
+
+		Focal crossings, made from a meeting, can share fixes with
+		crossings of other cats, so they keep their own statuses.
+		Otherwise this is the fix's own status."""
+
+		if not self.home_set:
+			return fix.status
+		elif fix in self.home_set:
+			return 'home'
+		else:
+			return 'away'
+
 	def find_cat_colors(self):
 		"""Get the unique color for each cat involved in this crossing."""
 
@@ -348,7 +539,13 @@ class Crossing(catcm.Cluster):
 		"""Find which of the points in the crossing constitute the closest meeting.
 
 		Closest meeting is defined as two points, within the crossing
-		radius, which have the least time between them."""
+		radius, which have the least time between them. For a focal
+		crossing, these are its meeting's matching fix pairs."""
+
+		if self.meeting:
+			pairs = sorted(self.meeting, key=lambda pair: pair[0].delay_from(pair[1]))
+			self.closest_meetings = [pair if pair[0].catid == self.catids[0] else (pair[1], pair[0]) for pair in pairs[0:3]]
+			return
 
 		closest_time = sys.maxsize
 		closest_meetings = list()
@@ -382,8 +579,8 @@ class Crossing(catcm.Cluster):
 
 		field_list = [
 			self.id,
-			self.start_dateobj.strftime(catcm.DATE_FMT_ISO),
-			self.end_dateobj.strftime(catcm.DATE_FMT_ISO),
+			catcm.format_time(self.start_time, catcm.DATE_FMT_ISO),
+			catcm.format_time(self.end_time, catcm.DATE_FMT_ISO),
 			'{:0.2f}'.format(self.elapsed_time / 3600),
 			'{:0.1f}'.format(self.x),
 			'{:0.1f}'.format(self.y),
@@ -407,14 +604,14 @@ class Crossing(catcm.Cluster):
 		"""Have each fix in this crossing do a csv report."""
 
 		for fix in self.all_fixes:
-			fix.csv_report(self.id, cat_id=True)
+			fix.csv_report(self.id, cat_id=True, status=self.fix_status(fix))
 
 	def descriptive_report(self, all_points):
 		"""Create a descriptive report describing this one crossing."""
 
 		output = 'Crossing {}\n'.format(self.id)
 		output += '  Cats: {}\n'.format(', '.join(self.catids))
-		output += '  Dates: From {} to {} (utc)\n'.format(self.start_dateobj.strftime(catcm.DATE_FMT_ISO), self.end_dateobj.strftime(catcm.DATE_FMT_ISO))
+		output += '  Dates: From {} to {} (utc)\n'.format(catcm.format_time(self.start_time, catcm.DATE_FMT_ISO), catcm.format_time(self.end_time, catcm.DATE_FMT_ISO))
 		output += '  Elapsed Time: {:0.2f} hours\n'.format(self.elapsed_time / 3600)
 		output += '  Center Location: {:0.2f} east, {:0.2f} north (NAD27)\n'.format(self.x, self.y)
 		output += '  Closest Meetings:\n'
@@ -423,15 +620,15 @@ class Crossing(catcm.Cluster):
 			first = closest_meeting[0]
 			second = closest_meeting[1]
 			output += '    {:0.2f} hours, {:0.2f} meters:\n'.format(first.delay_from(second) / 3600, first.distance_from(second))
-			output += '      {}, {:0.02f} east, {:0.02f} north, {} utc\n'.format(first.catid, first.x, first.y, first.dateobj.strftime(catcm.DATE_FMT_ISO))
-			output += '      {}, {:0.02f} east, {:0.02f} north, {} utc\n'.format(second.catid, second.x, second.y, second.dateobj.strftime(catcm.DATE_FMT_ISO))
+			output += '      {}, {:0.02f} east, {:0.02f} north, {} utc\n'.format(first.catid, first.x, first.y, catcm.format_time(first.time, catcm.DATE_FMT_ISO))
+			output += '      {}, {:0.02f} east, {:0.02f} north, {} utc\n'.format(second.catid, second.x, second.y, catcm.format_time(second.time, catcm.DATE_FMT_ISO))
 
 		sys.stdout.write(output)
 	
 		if all_points:
 			sys.stdout.write('  All Points In This Crossing:\n')
 			for fix in self.all_fixes:
-				fix.descriptive_report(cat_id=True)
+				fix.descriptive_report(cat_id=True, status=self.fix_status(fix))
 
 		sys.stdout.write('\n')
 
@@ -447,8 +644,8 @@ class Crossing(catcm.Cluster):
 
 		column_2 = list()
 		column_2.append(('Crossing ID', self.id))
-		column_2.append(('Start Date', self.start_dateobj.strftime(catcm.DATE_FMT_ISO_SHORT)))
-		column_2.append(('End Date', self.end_dateobj.strftime(catcm.DATE_FMT_ISO_SHORT)))
+		column_2.append(('Start Date', catcm.format_time(self.start_time, catcm.DATE_FMT_ISO_SHORT)))
+		column_2.append(('End Date', catcm.format_time(self.end_time, catcm.DATE_FMT_ISO_SHORT)))
 		column_2.append(('Center X', '{:0.1f}'.format(self.x)))
 		column_2.append(('Center Y', '{:0.1f}'.format(self.y)))
 
@@ -480,47 +677,69 @@ class Crossing(catcm.Cluster):
 		self.fgdraw.line([(img_x, img_y - 2), (img_x, img_y + 2)], catcm.image_colors['crossing'])
 
 		# Draw a faintly colored dot for every away point
-		awayimg = Image.new('RGB', (self.imgwidth, self.imgheight), catcm.image_colors['bg'])
-		awayimgdraw = ImageDraw.Draw(awayimg)
-		awaymask = Image.new('L', (self.imgwidth, self.imgheight), '#000000')
-		awaymaskdraw = ImageDraw.Draw(awaymask)
-	
+		away = catcm.Layer((self.imgwidth, self.imgheight), catcm.image_colors['bg'])
+
 		for away_fix in self.away_fixes:
 			img_x = self.img_x(away_fix.x)
 			img_y = self.img_y(away_fix.y)
 			radius = crossing_dot_size / 2
 			bigger = crossing_dot_size
-			awayimgdraw.ellipse(
+			away.draw(
+				'ellipse',
 				[(img_x - bigger, img_y - bigger), (img_x + bigger, img_y + bigger)],
 				self.cat_colors[away_fix.catid], self.cat_colors[away_fix.catid]
 			)
-			awaymaskdraw.ellipse(
+			away.draw_mask(
+				'ellipse',
 				[(img_x - radius, img_y - radius), (img_x + radius, img_y + radius)],
 				'#404040', '#404040'
 			)
-		
-		self.fgimage.paste(awayimg, (0, 0), awaymask)
+
+		away.paste_onto(self.fgimage)
 
 		# Draw a colored dot for each home point
-		for home_fix in self.home_fixes:
-			img_x = self.img_x(home_fix.x)
-			img_y = self.img_y(home_fix.y)
-			radius = crossing_dot_size / 2
-			self.fgdraw.ellipse(
-				[(img_x - radius, img_y - radius), (img_x + radius, img_y + radius)],
-				self.cat_colors[home_fix.catid], self.cat_colors[home_fix.catid]
-			)
+		self.draw_dots(
+			[home_fix.x for home_fix in self.home_fixes],
+			[home_fix.y for home_fix in self.home_fixes],
+			[self.cat_colors[home_fix.catid] for home_fix in self.home_fixes],
+			crossing_dot_size
+		)
 
 		# Create a scatter plot of all fixes
-		for fix in self.all_fixes:
-			img_x = self.img_x(fix.x)
-			img_y = self.img_y(fix.y)
-			self.fgdraw.point((img_x, img_y), catcm.image_colors['fg'])
+		self.draw_dots([fix.x for fix in self.all_fixes], [fix.y for fix in self.all_fixes], catcm.image_colors['fg'])
 
 
 # FUNCTIONS
 
-def create_filename(start_date=False, end_date=False, catids=False, crossingid=False):
+def find_partition_clusters(task):
+	"""Find clusters within one time partition. Run in a worker process."""
+
+	times, xs, ys, catids, seed_stop, radius, time_cutoff, complete = task
+
+	return catcm.find_cluster_members(times, xs, ys, catids, 0, seed_stop, len(times), radius, time_cutoff, set(), complete)
+
+def merge_overlapping_meetings(meetings):
+	"""Merge meetings of the same two cats that overlap in time.
+
+	A meeting spans from its first fix to its last. Meetings that share
+	a fix always overlap, so after merging no two meetings share fixes."""
+
+	spans = list()
+	for meeting in meetings:
+		times = [fix.time for pair in meeting for fix in pair]
+		spans.append((min(times), max(times), meeting))
+
+	merged = list()
+	for start_time, end_time, meeting in sorted(spans, key=lambda span: span[0]):
+		if merged and start_time <= merged[-1][1]:
+			merged[-1][1] = max(merged[-1][1], end_time)
+			merged[-1][2].extend(meeting)
+		else:
+			merged.append([start_time, end_time, list(meeting)])
+
+	return [meeting for start_time, end_time, meeting in merged]
+
+def create_filename(start_date=False, end_date=False, catids=False, crossingid=False, focal_catid=False):
 	"""Create a filename for find_crossing text and image output."""
 
 	name_parts = ['crossings']
@@ -529,7 +748,10 @@ def create_filename(start_date=False, end_date=False, catids=False, crossingid=F
 	if date_part:
 		name_parts.append(date_part)
 
-	if catids:
+	if focal_catid:
+		others = [catid for catid in catids if catid != focal_catid] if catids else False
+		name_parts.append('{}_with_{}'.format(focal_catid, '_'.join(others) if others else 'all'))
+	elif catids:
 		name_parts.append('_'.join(catids))
 	else:
 		name_parts.append('all')
@@ -24,17 +24,23 @@
 
 # IMPORT
 
+import os
+import re
 import sys
+import heapq
+import datetime
+import multiprocessing
 
-from PIL import Image
-from PIL import ImageDraw
+from csv import reader as csvreader
 
 import catamount.common as catcm
+import catamount.geometry as catgm
 
 
 # CONSTANTS/GLOBALS
 
 whodunit_dot_size = 4
+whodunit_close_count = 10 # How many of the next closest points to report
 
 
 # CLASSES
@@ -45,57 +51,130 @@ class FWDataPool(catcm.DataPool):
 	This adds the ability to search the data for a match to a given
 	request, and to display those matches."""
 
-	def __init__(self, radius, time_cutoff, x, y):
+	def __init__(self, radius, time_cutoff, x, y, close_count=whodunit_close_count):
 		catcm.DataPool.__init__(self)
 
 		self.radius = radius
 		self.time_cutoff = time_cutoff
 		self.x = x
 		self.y = y
+		self.close_count = close_count
 
 		self.legend_date = '0'
 
+		# Set when this is one request in a batch
+		self.query_id = False
+
+		# Set when positions are estimated
+		self.estimates = False
+
+	def set_request_date(self, dateobj, request_time):
+		"""Set the request date, and the window of time worth searching around it."""
+
+		self.dateobj = dateobj
+		self.time = request_time
+
+		date_limit = datetime.timedelta(seconds=self.time_cutoff * 5)
+
+		self.start_dateobj = self.dateobj - date_limit
+		self.start_time = catcm.epoch_time(self.start_dateobj)
+
+		self.end_dateobj = self.dateobj + date_limit
+		self.end_time = catcm.epoch_time(self.end_dateobj)
+
+	def take_fixes_from_index(self, fix_index):
+		"""Take the fixes near the request from an index, rather than filtering every fix.
+
+		This gives the same fixes as filtering by date, then by five
+		times the radius, then putting them in chronological order."""
+
+		self.fixes = fix_index.search(self, self.radius * 5, self.start_time, self.end_time)
+
+	def create_trails(self):
+		"""Create a Trail for each cat, ready to estimate positions between fixes."""
+
+		trails = dict()
+		for fix in self.fixes:
+			if fix.catid not in trails:
+				trails[fix.catid] = catcm.Trail(fix.catid)
+			trails[fix.catid].fixes.append(fix)
+
+		for trail in trails.values():
+			trail.order_by_time()
+			trail.find_fix_times()
+
+		return trails
+
 	def find_matches(self):
-		"""Find fixes that match, and keep track of others which come close."""
+		"""Find fixes that match, and keep track of the few others which come closest."""
 
 		matches = list()
 		close = list()
 
-		for fix in self.fixes:
-			distance = fix.distance_from(self)
-			delay = fix.delay_from(self)
+		distances = catgm.distances_from(self.x, self.y, [fix.x for fix in self.fixes], [fix.y for fix in self.fixes])
+		delays = catgm.delays_from(self.time, [fix.time for fix in self.fixes])
+
+		for position, fix in enumerate(self.fixes):
+			distance = distances[position]
+			delay = delays[position]
 			closeness = (distance / self.radius) + (delay / self.time_cutoff)
 			if distance <= self.radius and delay <= self.time_cutoff:
 				new_match = Match(fix, 'Match', closeness, distance, delay)
 				matches.append(new_match)
 			else:
-				new_close = Match(fix, 'Close', closeness, distance, delay)
-				close.append(new_close)
+				close.append((closeness, position, distance, delay))
 
 		self.matches = sorted(matches, key=lambda match: match.closeness)
-		self.close = sorted(close, key=lambda close: close.closeness)
 
-	def csv_report(self):
-		"""Create a CSV report describing all the matches that were found."""
+		# A heap keeps the closest, ties in chronological order, and
+		# only those become Matches
+		self.close = list()
+		for closeness, position, distance, delay in heapq.nsmallest(self.close_count, close):
+			self.close.append(Match(self.fixes[position], 'Close', closeness, distance, delay))
 
-		field_list = ['Status', 'Cat_ID', 'Date', 'East_N27', 'North_N27', 'Closeness', 'Distance', 'Delay']
-		sys.stdout.write(','.join(field_list) + '\n')
+	def csv_report(self, header=True):
+		"""Create a CSV report describing all the matches that were found.
+
+		In a batch, every line starts with the query ID, and the header
+		is only wanted once."""
+
+		if header:
+			field_list = ['Status', 'Cat_ID', 'Date', 'East_N27', 'North_N27', 'Closeness', 'Distance', 'Delay']
+			if self.query_id is not False:
+				field_list.insert(0, 'Query_ID')
+			sys.stdout.write(','.join(field_list) + '\n')
 
 		# First line will be the request data
 		request_list = ['Request', '----', self.dateobj.strftime(catcm.DATE_FMT_ISO),
 			'{:0.1f}'.format(self.x), '{:0.1f}'.format(self.y), '----', '----', '----']
+		if self.query_id is not False:
+			request_list.insert(0, self.query_id)
 		sys.stdout.write(','.join(request_list) + '\n')
 
 		for match in self.matches:
-			match.csv_report()
+			match.csv_report(self.query_id)
+
+		for close in self.close:
+			close.csv_report(self.query_id)
 
-		for close in self.close[0:10]:
-			close.csv_report()
+	def estimates_csv_report(self, outfile, header=True):
+		"""Create a CSV report of each cat's estimated position at the request time, in its own file."""
+
+		if header:
+			field_list = ['Status', 'Cat_ID', 'Date', 'East_N27', 'North_N27', 'Distance', 'Gap']
+			if self.query_id is not False:
+				field_list.insert(0, 'Query_ID')
+			outfile.write(','.join(field_list) + '\n')
+
+		for estimate in self.estimates:
+			estimate.csv_report(outfile, self.dateobj, self.query_id)
 
 	def descriptive_report(self, all_points):
 		"""Create a descriptive report describing all the matches that were found."""
 
 		output = '\nWhodunit Settings Are As Follows:\n'
+		if self.query_id is not False:
+			output += '  * Query ID: {}\n'.format(self.query_id)
 		output += '  * Radius: {} meters\n'.format(self.radius)
 		output += '  * Time Cutoff: {} hours\n'.format(self.time_cutoff // 3600)
 		output += '  * Request Date: {}\n'.format(self.legend_date)
@@ -109,9 +188,18 @@ class FWDataPool(catcm.DataPool):
 
 		sys.stdout.write('\nNext Closest Points:\n')
 
-		for close in self.close[0:10]:
+		for close in self.close:
 			close.descriptive_report()
 
+		# Positions are only estimated when asked for
+		if self.estimates is False:
+			return
+
+		sys.stdout.write('\nEstimated Positions At Request Date:\n')
+
+		for estimate in self.estimates:
+			estimate.descriptive_report()
+
 	def draw_object_specific_graphics(self):
 		"""Draw graphics of all the found matches on the feedback image."""
 
@@ -136,56 +224,49 @@ class FWDataPool(catcm.DataPool):
 		img_x = self.img_x(self.x)
 		img_y = self.img_y(self.y)
 		radius = self.radius / self.scale
-		circleimg = Image.new('RGB', (self.imgwidth, self.imgheight), catcm.image_colors['whodunit'])
-		circlemask = Image.new('L', (self.imgwidth, self.imgheight), '#000000')
-		circlemaskdraw = ImageDraw.Draw(circlemask)
-		circlemaskdraw.ellipse(
+		circle = catcm.Layer((self.imgwidth, self.imgheight), catcm.image_colors['whodunit'])
+		circle.draw_mask(
+			'ellipse',
 			[(img_x - radius, img_y - radius), (img_x + radius, img_y + radius)],
 			'#000000', '#FFFFFF'
 		)
-		self.fgimage.paste(circleimg, (0, 0), circlemask)
+		circle.paste_onto(self.fgimage)
 
 		# Create a cross at the target location
 		self.fgdraw.line([(img_x - 2, img_y), (img_x + 2, img_y)], catcm.image_colors['whodunit'])
 		self.fgdraw.line([(img_x, img_y - 2), (img_x, img_y + 2)], catcm.image_colors['whodunit'])
 
 		# Draw a faintly colored dot for every close point
-		closeimg = Image.new('RGB', (self.imgwidth, self.imgheight), catcm.image_colors['bg'])
-		closeimgdraw = ImageDraw.Draw(closeimg)
-		closemask = Image.new('L', (self.imgwidth, self.imgheight), '#000000')
-		closemaskdraw = ImageDraw.Draw(closemask)
+		close_layer = catcm.Layer((self.imgwidth, self.imgheight), catcm.image_colors['bg'])
 
 		for close in self.close:
 			img_x = self.img_x(close.fix.x)
 			img_y = self.img_y(close.fix.y)
 			radius = whodunit_dot_size / 2
 			bigger = whodunit_dot_size
-			closeimgdraw.ellipse(
+			close_layer.draw(
+				'ellipse',
 				[(img_x - bigger, img_y - bigger), (img_x + bigger, img_y + bigger)],
 				self.cat_colors[close.fix.catid], self.cat_colors[close.fix.catid]
 			)
-			closemaskdraw.ellipse(
+			close_layer.draw_mask(
+				'ellipse',
 				[(img_x - radius, img_y - radius), (img_x + radius, img_y + radius)],
 				'#404040', '#404040'
 			)
 
-		self.fgimage.paste(closeimg, (0, 0), closemask)
+		close_layer.paste_onto(self.fgimage)
 
 		# Draw a colored dot for every match point
-		for match in self.matches:
-			img_x = self.img_x(match.fix.x)
-			img_y = self.img_y(match.fix.y)
-			radius = whodunit_dot_size / 2
-			self.fgdraw.ellipse(
-				[(img_x - radius, img_y - radius), (img_x + radius, img_y + radius)],
-				self.cat_colors[match.fix.catid], self.cat_colors[match.fix.catid]
-			)
+		self.draw_dots(
+			[match.fix.x for match in self.matches],
+			[match.fix.y for match in self.matches],
+			[self.cat_colors[match.fix.catid] for match in self.matches],
+			whodunit_dot_size
+		)
 
 		# Draw a black dot for every point
-		for fix in self.fixes:
-			img_x = self.img_x(fix.x)
-			img_y = self.img_y(fix.y)
-			self.fgdraw.point((img_x, img_y), catcm.image_colors['fg'])
+		self.draw_dots([fix.x for fix in self.fixes], [fix.y for fix in self.fixes], catcm.image_colors['fg'])
 
 
 class Match(object):
@@ -201,19 +282,23 @@ class Match(object):
 		self.distance = distance
 		self.delay = delay
 
-	def csv_report(self):
+	def csv_report(self, query_id=False):
 		"""Create a CSV report describing this one match."""
 
 		field_list = [
 			self.status,
 			self.fix.catid,
-			self.fix.dateobj.strftime(catcm.DATE_FMT_ISO),
+			catcm.format_time(self.fix.time, catcm.DATE_FMT_ISO),
 			'{:0.1f}'.format(self.fix.x),
 			'{:0.1f}'.format(self.fix.y),
 			'{:0.3f}'.format(self.closeness),
 			'{:0.1f}'.format(self.distance),
 			'{:0.1f}'.format(self.delay / 3600)
 		]
+
+		# Add the query ID in a batch
+		if query_id is not False:
+			field_list.insert(0, query_id)
 		sys.stdout.write(','.join(field_list) + '\n')
 
 	def descriptive_report(self):
@@ -221,7 +306,7 @@ class Match(object):
 
 		field_list = [
 			self.fix.catid,
-			self.fix.dateobj.strftime(catcm.DATE_FMT_ISO),
+			catcm.format_time(self.fix.time, catcm.DATE_FMT_ISO),
 			'{:0.1f} east'.format(self.fix.x),
 			'{:0.1f} north'.format(self.fix.y),
 			'{:6.3f}'.format(self.closeness),
@@ -231,11 +316,179 @@ class Match(object):
 		sys.stdout.write('    ' + ', '.join(field_list) + '\n')
 
 
+class Estimate(object):
+	"""An Estimate is where one cat probably was at the request time.
+
+	It lies on the line between the fixes before and after the
+	request, and the gap between those fixes says how uncertain it
+	is."""
+
+	def __init__(self, catid, x, y, gap, distance):
+		self.catid = catid
+		self.x = x
+		self.y = y
+		self.gap = gap
+		self.distance = distance
+
+	def csv_report(self, outfile, dateobj, query_id=False):
+		"""Create a CSV report describing this one estimate."""
+
+		field_list = [
+			'Estimate',
+			self.catid,
+			dateobj.strftime(catcm.DATE_FMT_ISO),
+			'{:0.1f}'.format(self.x),
+			'{:0.1f}'.format(self.y),
+			'{:0.1f}'.format(self.distance),
+			'{:0.1f}'.format(self.gap / 3600)
+		]
+
+		# Add the query ID in a batch
+		if query_id is not False:
+			field_list.insert(0, query_id)
+
+		outfile.write(','.join(field_list) + '\n')
+
+	def descriptive_report(self):
+		"""Create a descriptive report describing this one estimate."""
+
+		field_list = [
+			self.catid,
+			'{:0.1f} east'.format(self.x),
+			'{:0.1f} north'.format(self.y),
+			'{:6.1f} m'.format(self.distance),
+			'{:6.1f} h gap'.format(self.gap / 3600)
+		]
+		sys.stdout.write('    ' + ', '.join(field_list) + '\n')
+
+
 # FUNCTIONS
 
-def create_filename(date, x, y):
-	"""Create a filename for find_whodunit text and image output."""
+def read_queries(query_file_path):
+	"""Read a batch of requests from a CSV file, in the same terms as the command line.
+
+	Each row is: id, date, x, y. Returns a list of (query_id, date,
+	x, y) tuples, where the date is as from date_string_to_objects."""
+
+	queries = list()
+	with open(query_file_path, 'rt') as query_file:
+		for csvrow in csvreader(query_file):
+			try:
+				query_date = catcm.date_string_to_objects(csvrow[1])
+				query_x = catcm.constrain_integer(int(float(csvrow[2])), 0, 1000000)
+				query_y = catcm.constrain_integer(int(float(csvrow[3])), 0, 10000000)
+			except IndexError:
+				sys.stderr.write('Query row doesn’t have expected number of columns: {}\n'.format(csvrow))
+				continue
+			except:
+				sys.stderr.write('Query row doesn’t look like a request: {}\n'.format(csvrow))
+				continue
+
+			if not query_date:
+				sys.stderr.write('Query row doesn’t have a date: {}\n'.format(csvrow))
+				continue
+
+			queries.append((csvrow[0], query_date, query_x, query_y))
+
+	return queries
+
+def answer_batch(datapool, queries, radius, time_cutoff, close_count, estimates=False):
+	"""Answer a batch of requests from the fixes of one datapool, returning a datapool for each request.
+
+	The fixes are ordered, deduplicated and indexed once, then each
+	request takes only the fixes near it from the index. If asked,
+	every cat's position is estimated at each request time."""
+
+	datapool.order_by_time()
+	datapool.remove_duplicates()
+
+	# Grid cells the size of the location limit mean each search looks at a few cells
+	fix_index = catcm.FixIndex(datapool.fixes, radius * 5)
+
+	requestpools = list()
+	for query_id, query_date, query_x, query_y in queries:
+		requestpool = FWDataPool(radius, time_cutoff, query_x, query_y, close_count)
+		requestpool.query_id = query_id
+		requestpool.set_request_date(query_date[0], query_date[1])
+		requestpool.legend_date = query_date[0].strftime(catcm.DATE_FMT_ISO)
+
+		requestpool.take_fixes_from_index(fix_index)
+		if not requestpool.fixes:
+			sys.stderr.write('No data near request {}. Check the request date and coordinates.\n'.format(query_id))
+
+		requestpool.find_matches()
+		requestpools.append(requestpool)
+
+	# Rank every cat by its estimated distance at each request time
+	if estimates:
+		estimate_positions(requestpools, datapool.create_trails())
+
+	return requestpools
+
+def create_batch_images(requestpools, outdir_path, jobs=1):
+	"""Create a feedback image for every request in a batch that has data to show, across a process pool."""
+
+	image_tasks = list()
+	for requestpool in requestpools:
+		if not requestpool.fixes:
+			continue
+		imagename = create_filename((requestpool.dateobj, requestpool.time), requestpool.x, requestpool.y, requestpool.query_id)
+		image_tasks.append((requestpool, os.path.join(outdir_path, imagename + catcm.render_context.image_extension)))
+
+	if not image_tasks:
+		return list()
+
+	image_output = (catcm.render_context.image_format, catcm.render_context.image_encoding)
+	with multiprocessing.Pool(min(jobs, len(image_tasks)), catcm.set_image_output, image_output) as pool:
+		return pool.map(create_request_image, image_tasks)
+
+def estimate_positions(datapools, trails):
+	"""Estimate every cat's position at the request time of each datapool.
+
+	Each trail answers all the requests in one pass, then every
+	datapool ranks the cats by their distance from the request."""
+
+	request_times = [datapool.time for datapool in datapools]
+
+	for datapool in datapools:
+		datapool.estimates = list()
+
+	for catid in sorted(trails):
+		positions = trails[catid].positions_at(request_times)
+		for datapool, position in zip(datapools, positions):
+			if not position:
+				continue
+			x, y, gap = position
+			distance = catgm.distance(x, y, datapool.x, datapool.y)
+			datapool.estimates.append(Estimate(catid, x, y, gap, distance))
+
+	for datapool in datapools:
+		datapool.estimates = sorted(datapool.estimates, key=lambda estimate: estimate.distance)
+
+def create_request_image(task):
+	"""Create the feedback image for one request in a batch, returning its path or False. Run in a worker process."""
+
+	datapool, imagepath = task
+
+	datapool.find_bounds()
+	datapool.find_catids()
+	datapool.find_cat_colors()
+	datapool.create_image(imagepath, 'auto')
+
+	# The worker may be stopped as soon as the batch is done
+	if not catcm.render_context.finish_saving():
+		return False
+
+	return imagepath
+
+def create_filename(date, x, y, query_id=False):
+	"""Create a filename for find_whodunit text and image output.
+
+	The date is only the day, so requests in a batch add their query
+	ID to tell apart requests at one place on the same day."""
 
 	name_parts = ['whodunit', date[0].strftime(catcm.DATE_FMT_ID_SHORT), str(x), str(y)]
+	if query_id is not False:
+		name_parts.append(re.sub(r'[^\w-]', '-', query_id))
 
 	return '_'.join(name_parts)
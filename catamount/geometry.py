@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+
+# CatAmount analyzes GPS collar data to find time/space relationships.
+# Copyright (C) 2012-2019 Michael Rickard
+#  
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#  
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#  
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# This file provides the distance, delay, and angle calculations that
+# are shared by all of the other modules. Locations are UTM meters,
+# and times are seconds. The batch versions take plain lists, so that
+# whole trails can be worked on without going through each object.
+
+# IMPORT
+
+import math
+
+
+# FUNCTIONS
+
+def distance(x1, y1, x2, y2):
+	"""Calculate the distance between two locations."""
+
+	delta_x = math.fabs(x1 - x2)
+	delta_y = math.fabs(y1 - y2)
+	return math.sqrt((delta_x ** 2) + (delta_y ** 2))
+
+def distances_from(x, y, xs, ys):
+	"""Calculate the distance from one location to each of many."""
+
+	return [math.sqrt(((other_x - x) ** 2) + ((other_y - y) ** 2)) for other_x, other_y in zip(xs, ys)]
+
+def delay(time_1, time_2):
+	"""Calculate the time between two times, whichever comes first."""
+
+	return math.fabs(time_1 - time_2)
+
+def delays_from(time, times):
+	"""Calculate the time between one time and each of many."""
+
+	return [math.fabs(other_time - time) for other_time in times]
+
+def bearing(center_x, center_y, x, y):
+	"""Calculate the angle of a location from a center, in degrees clockwise from north.
+
+	       0
+	  270 -+- 90
+	      180
+	"""
+
+	return math.degrees(math.atan2(x - center_x, y - center_y)) % 360
+
+def bearings_from(center_x, center_y, xs, ys):
+	"""Calculate the angle of each of many locations from a center."""
+
+	return [math.degrees(math.atan2(x - center_x, y - center_y)) % 360 for x, y in zip(xs, ys)]
+
+def pairs_within(times_a, xs_a, ys_a, times_b, xs_b, ys_b, time_window, radius):
+	"""Find pairs of positions from two chronological lists that are close in time and space.
+
+	Pairs are no more than time_window apart in time, and no more than
+	radius apart in distance. Both lists must be in chronological
+	order. Pairs are yielded as (position in a, position in b), in
+	order of a, then b."""
+
+	first = 0
+	last = 0
+	for position_a, time_a in enumerate(times_a):
+		# The window onto b only ever moves forward
+		while first < len(times_b) and times_b[first] < time_a - time_window:
+			first += 1
+		if last < first:
+			last = first
+		while last < len(times_b) and times_b[last] <= time_a + time_window:
+			last += 1
+
+		for position_b in range(first, last):
+			if distance(xs_b[position_b], ys_b[position_b], xs_a[position_a], ys_a[position_a]) <= radius:
+				yield (position_a, position_b)
@@ -24,14 +24,22 @@
 
 # IMPORT
 
+import os
+import re
 import sys
 import pytz
-import time
+import hashlib
 import datetime
+import multiprocessing
+
+from csv import reader as csvreader
+from csv import writer as csvwriter
+from csv import DictReader
 
 from dateutil import parser as dateparser
 
 import catamount.common as catcm
+import catamount.geometry as catgm
 import catamount.find_clusters as catfc
 
 
@@ -45,6 +53,15 @@ maximum_time = 1893456000 # 2030-01-01
 minimum_location = {'x': 400000, 'y': 3500000}
 maximum_location = {'x': 650000, 'y': 6000000}
 
+# Survey rows are handed out to be parsed in chunks of this many
+survey_chunk_size = 500
+
+# Survey files repeat a lot of dates; each string is only parsed once
+parsed_survey_dates = dict()
+
+# Change this when the clustering changes, so old catalogue entries are not used
+catalogue_version = 2
+
 
 
 # CLASSES
@@ -67,6 +84,16 @@ class MSDataPool(catcm.DataPool):
 		self.trails = dict()
 		self.clusters = list()
 
+		# Cats whose clusters came from the catalogue rather than their fixes
+		self.catalogued_clusters = dict()
+		self.catalogued_fix_counts = dict()
+
+	def add_catalogued_clusters(self, catid, fix_count, clusters):
+		"""Take a cat's clusters from the catalogue, in place of its fixes."""
+
+		self.catalogued_clusters[catid] = clusters
+		self.catalogued_fix_counts[catid] = fix_count
+
 	def sort_into_trails(self):
 		# First, how many cats are we dealing with?
 		self.find_catids()
@@ -86,17 +113,196 @@ class MSDataPool(catcm.DataPool):
 			self.trails[catid].remove_duplicates()
 			self.trails[catid].order_by_time()
 
-	def find_all_clusters(self):
-		# Have each trail find its own clusters, and add them to the main list
+	def find_all_clusters(self, jobs=1):
+		"""Have each trail find its own clusters, then put them all in chronological order.
+
+		With more than one job, trails are searched in a process pool.
+		Workers are sent plain lists of times and locations, and send
+		back only a summary of each cluster."""
+
+		if jobs > 1 and len(self.catids) > 1:
+			self.find_clusters_in_pool(jobs)
+		else:
+			for catid in self.catids:
+				self.trails[catid].find_clusters()
+
+		cat_clusters = dict(self.catalogued_clusters)
 		for catid in self.catids:
-			self.trails[catid].find_clusters()
+			cat_clusters[catid] = self.trails[catid].clusters
 
-			for cluster in self.trails[catid].clusters:
+		# Add them to the main list, along with any from the catalogue
+		for catid in sorted(cat_clusters):
+			for cluster in cat_clusters[catid]:
 				self.clusters.append(cluster)
 
 		# Put clusters in chronological order
 		self.clusters = sorted(self.clusters, key=lambda cluster: cluster.start_time)
 
+	def find_clusters_in_pool(self, jobs):
+		"""Search trails for clusters in a process pool, keeping a ClusterSummary of each."""
+
+		# Hand out the longest trails first, so they don't finish last
+		catids = sorted(self.catids, key=lambda catid: len(self.trails[catid].fixes), reverse=True)
+
+		tasks = list()
+		for catid in catids:
+			fixes = self.trails[catid].fixes
+			tasks.append((
+				[fix.time for fix in fixes],
+				[fix.x for fix in fixes],
+				[fix.y for fix in fixes],
+				self.radius,
+				self.time_cutoff
+			))
+
+		with multiprocessing.Pool(min(jobs, len(tasks))) as pool:
+			results = pool.map(find_trail_cluster_summaries, tasks, chunksize=1)
+
+		for catid, summaries in zip(catids, results):
+			fixes = self.trails[catid].fixes
+			for start, end, x, y in summaries:
+				clusterid = catcm.format_time(fixes[start].time, catcm.DATE_FMT_ID)
+				new_cluster = ClusterSummary(clusterid, catid, fixes[start].time, fixes[end].time, x, y)
+				self.trails[catid].clusters.append(new_cluster)
+
+	def count_fixes(self):
+		"""Count fixes, including those of cats that came from the catalogue."""
+
+		return len(self.fixes) + sum(self.catalogued_fix_counts.values())
+
+	def count_cats(self):
+		"""Count cats with fixes, including those that came from the catalogue."""
+
+		return len(self.catids) + len([catid for catid, fix_count in self.catalogued_fix_counts.items() if fix_count])
+
+class ClusterIndex(object):
+	"""This narrows down which clusters could match a survey, without testing them all.
+
+	Cluster centers are sorted into a grid of cells as wide as the
+	radius. Within each cell, an interval tree holds the time each
+	cluster covers, padded by the time cutoff on either side."""
+
+	def __init__(self, clusters, radius, time_cutoff):
+		self.radius = radius
+		self.cell_size = max(radius, 1)
+
+		# Pad a little extra, so rounding can't leave out a cluster that matches
+		padding = time_cutoff + 1
+
+		cell_intervals = dict()
+		for position, cluster in enumerate(clusters):
+			key = (int(cluster.x // self.cell_size), int(cluster.y // self.cell_size))
+			if key not in cell_intervals:
+				cell_intervals[key] = list()
+			cell_intervals[key].append((cluster.start_time - padding, cluster.end_time + padding, (position, cluster)))
+
+		self.cells = dict()
+		for key, intervals in cell_intervals.items():
+			self.cells[key] = catcm.IntervalTree(intervals)
+
+	def search(self, survey):
+		"""Return (position, cluster) for every candidate cluster near the survey's time and place."""
+
+		reach = self.radius + 1
+		first_x = int((survey.x - reach) // self.cell_size)
+		last_x = int((survey.x + reach) // self.cell_size)
+		first_y = int((survey.y - reach) // self.cell_size)
+		last_y = int((survey.y + reach) // self.cell_size)
+
+		candidates = list()
+		for cell_x in range(first_x, last_x + 1):
+			for cell_y in range(first_y, last_y + 1):
+				if (cell_x, cell_y) in self.cells:
+					candidates.extend(self.cells[(cell_x, cell_y)].search(survey.time))
+
+		return candidates
+
+class ClusterCatalogue(object):
+	"""An on-disk catalogue of each cat's clusters, for one radius and time cutoff.
+
+	Each cat's entry is kept with a fingerprint of the cat's raw rows
+	from the data file, only those that parse as fixes. As long as the
+	rows don't change, the entry can be used instead of finding the
+	cat's clusters again."""
+
+	def __init__(self, catalogue_path, radius, time_cutoff):
+		self.catalogue_path = catalogue_path
+		self.radius = radius
+		self.time_cutoff = time_cutoff
+
+	def fingerprint(self, csvrows):
+		"""Create a fingerprint of one cat's raw rows and everything else that shapes its clusters."""
+
+		hasher = hashlib.sha1()
+		settings = [catalogue_version, self.radius, self.time_cutoff, catcm.cfg_data_column_fixid, catcm.cfg_data_column_catid,
+			catcm.cfg_data_column_utcdatetime, catcm.cfg_data_column_utmy, catcm.cfg_data_column_utmx]
+		hasher.update(repr(settings).encode('utf-8'))
+		for csvrow in csvrows:
+			hasher.update('\x1f'.join(csvrow).encode('utf-8'))
+			hasher.update(b'\n')
+
+		return hasher.hexdigest()
+
+	def entry_path(self, catid):
+		"""Path of the catalogue entry for one cat."""
+
+		safe_catid = re.sub('[^A-Za-z0-9]', '_', catid)
+		entry_name = 'clusters_{}_{}m_{}s.csv'.format(safe_catid, self.radius, self.time_cutoff)
+		return os.path.join(self.catalogue_path, entry_name)
+
+	def load(self, catid, fingerprint):
+		"""Return (fix count, clusters) for a cat, or False if there is no entry for these rows."""
+
+		try:
+			with open(self.entry_path(catid), 'rt') as entry_file:
+				csvrows = csvreader(entry_file)
+				first_row = next(csvrows)
+				if first_row[1] != fingerprint:
+					return False
+				fix_count = int(first_row[3])
+
+				# Skip the header of the cluster rows
+				next(csvrows)
+
+				clusters = list()
+				for csvrow in csvrows:
+					clusters.append(ClusterSummary(csvrow[0], catid, float(csvrow[1]), float(csvrow[2]), float(csvrow[3]), float(csvrow[4])))
+		except (OSError, StopIteration, IndexError, ValueError):
+			return False
+
+		return (fix_count, clusters)
+
+	def save(self, catid, fingerprint, fix_count, clusters):
+		"""Write the entry for a cat. Floats are written so that they read back exactly."""
+
+		os.makedirs(self.catalogue_path, exist_ok=True)
+
+		with open(self.entry_path(catid), 'wt', newline='') as entry_file:
+			csvrows = csvwriter(entry_file)
+			csvrows.writerow(['Fingerprint', fingerprint, 'Fixes', fix_count])
+			csvrows.writerow(['Cluster_ID', 'Start_Time', 'End_Time', 'Center_X', 'Center_Y'])
+			for cluster in clusters:
+				csvrows.writerow([cluster.id, repr(cluster.start_time), repr(cluster.end_time), repr(cluster.x), repr(cluster.y)])
+
+class ClusterSummary(catcm.Cluster):
+	"""A cluster found by a worker process or loaded from the catalogue.
+
+	It carries what is needed to match surveys and report on them,
+	but not the fixes it was made from."""
+
+	def __init__(self, clusterid, catid, start_time, end_time, x, y):
+		self.id = clusterid
+		self.catid = catid
+		self.start_time = start_time
+		self.end_time = end_time
+		self.elapsed_time = end_time - start_time
+		self.x = x
+		self.y = y
+
+		self.home_fixes = list()
+		self.away_fixes = list()
+		self.all_fixes = list()
+
 class SurveyPool(object):
 	"""This turns a survey file into something manageable to use as the basis for a search."""
 
@@ -107,7 +313,13 @@ class SurveyPool(object):
 		self.surveys = list()
 
 	def search_for_matching_clusters(self, datapool):
-		"""For each survey, look for a matching cluster in the datapool."""
+		"""For each survey, look for a matching cluster in the datapool.
+
+		Only the clusters the index offers as candidates are tested.
+		Matches are ranked by closeness, ties in the order of the
+		datapool's clusters, the same as testing every cluster."""
+
+		cluster_index = ClusterIndex(datapool.clusters, self.radius, self.time_cutoff)
 
 		for survey in self.surveys:
 			# Don't search if the survey has major problems
@@ -115,16 +327,33 @@ class SurveyPool(object):
 				continue
 
 			matches = list()
-			
-			for cluster in datapool.clusters:
+
+			for position, cluster in cluster_index.search(survey):
 				distance = cluster.distance_from(survey)
 				delay = survey.delay_from(cluster)
 				closeness = (distance / self.radius) + (delay / self.time_cutoff)
 				if distance <= self.radius and delay <= self.time_cutoff:
 					cluster.closeness = closeness
-					matches.append(cluster)
+					matches.append((closeness, position, cluster))
+
+			survey.matching_clusters = [match[2] for match in sorted(matches, key=lambda match: (match[0], match[1]))]
 
-			survey.matching_clusters = sorted(matches, key=lambda cluster: cluster.closeness)
+	def read_surveys(self, survey_file, date_headers, location_easting_headers, location_northing_headers, jobs=1):
+		"""Create a Survey from each row of an open survey file.
+
+		Rows are read in chunks. With more than one job, chunks are
+		turned into Surveys in a process pool, still in file order."""
+
+		csvrows = DictReader(survey_file)
+		tasks = ((chunk, date_headers, location_easting_headers, location_northing_headers) for chunk in chunk_rows(csvrows, survey_chunk_size))
+
+		if jobs > 1:
+			with multiprocessing.Pool(jobs) as pool:
+				for surveys in pool.imap(create_surveys, tasks):
+					self.surveys.extend(surveys)
+		else:
+			for task in tasks:
+				self.surveys.extend(create_surveys(task))
 
 	def csv_report(self):
 		"""For each survey, display any matching clusters that were found."""
@@ -139,7 +368,6 @@ class Survey(object):
 	"""This represents a single field survey, equivalent to one line in the survey spreadsheet."""
 
 	def __init__(self, data_set, date_headers, location_easting_headers, location_northing_headers):
-		self.data_set = data_set
 		self.date_headers = date_headers
 		self.location_easting_headers = location_easting_headers
 		self.location_northing_headers = location_northing_headers
@@ -152,7 +380,7 @@ class Survey(object):
 		self.matching_clusters = list()
 
 		# Surveys arrive with all their data, so we can process them right away
-		self.parse_survey_data()
+		self.parse_survey_data(data_set)
 
 		attributes_okay = self.test_attribute_presence()
 		if not attributes_okay:
@@ -163,11 +391,17 @@ class Survey(object):
 		self.find_average_location('x', 'easting')
 		self.find_average_location('y', 'northing')
 
-	def parse_survey_data(self):
-		"""Turn input dict of keys and values into named attributes."""
+	def parse_survey_data(self, data_set):
+		"""Turn input dict of keys and values into named attributes.
+
+		Only the ID and the date and location columns are kept."""
+
+		wanted_headers = set(['ID'] + self.date_headers + self.location_easting_headers + self.location_northing_headers)
 
-		for data_key, data_value in self.data_set.items():
-			self.attributes[data_key.strip()] = data_value.strip()
+		for data_key, data_value in data_set.items():
+			data_key = data_key.strip()
+			if data_key in wanted_headers:
+				self.attributes[data_key] = data_value.strip()
 
 	def test_attribute_presence(self):
 		"""Test if all data we are expecting are here, warn/abort/instruct if not."""
@@ -200,17 +434,11 @@ class Survey(object):
 			if not this_value:
 				continue
 
-			# Parse the string into a datetime object
-			try:
-				dateobj = dateparser.parse(this_value, default=default_date)
-			except ValueError:
+			# Parse the string into seconds
+			seconds = parse_survey_date(this_value)
+			if seconds is False:
 				self.minor_problems.append('This date string could not be parsed: {}. Please correct survey file.'.format(this_value))
-
-			# Apply the default time zone
-			dateobj = mountain_time.localize(dateobj)
-
-			# Convert to seconds
-			seconds = time.mktime(dateobj.timetuple())
+				continue
 
 			time_list.append(seconds)
 
@@ -223,7 +451,7 @@ class Survey(object):
 		self.time = sum(time_list) / len(time_list)
 
 		# Add the average time as a datetime object
-		self.dateobj = datetime.datetime.fromtimestamp(self.time)
+		self.dateobj = datetime.datetime.fromtimestamp(self.time, mountain_time)
 
 		# Check if the average is in the expected range
 		if not minimum_time < self.time < maximum_time:
@@ -275,7 +503,7 @@ class Survey(object):
 			else:
 				delay = 0
 		else:
-			delay = math.fabs(self.time - other.time)
+			delay = catgm.delay(self.time, other.time)
 
 		return delay
 
@@ -285,10 +513,15 @@ class Survey(object):
 		field_list = [
 			self.attributes['ID'],
 			'{:0.1f}'.format(self.x),
-			'{:0.1f}'.format(self.y),
-			self.dateobj.strftime(catcm.DATE_FMT_ISO)
+			'{:0.1f}'.format(self.y)
 		]
 
+		# A survey without usable dates has no average date to show
+		if hasattr(self, 'dateobj'):
+			field_list.append(self.dateobj.strftime(catcm.DATE_FMT_ISO))
+		else:
+			field_list.append('')
+
 		if self.major_problems:
 			field_list.append('"{}"'.format(' '.join(self.major_problems)))
 		else:
@@ -318,3 +551,64 @@ def create_filename():
 	"""Create a filename for match_survey text output."""
 
 	return 'match_survey_to_cluster_{}'.format(datetime.datetime.now().strftime(catcm.DATE_FMT_ID_SHORT))
+
+def parse_survey_date(date_string):
+	"""Convert a survey date string to seconds, or False if it can't be parsed."""
+
+	if date_string not in parsed_survey_dates:
+		try:
+			dateobj = dateparser.parse(date_string, default=default_date)
+		except (ValueError, OverflowError):
+			parsed_survey_dates[date_string] = False
+		else:
+			# Apply the default time zone, then convert to seconds
+			dateobj = mountain_time.localize(dateobj)
+			parsed_survey_dates[date_string] = catcm.epoch_time(dateobj)
+
+	return parsed_survey_dates[date_string]
+
+def chunk_rows(csvrows, chunk_size):
+	"""Read rows from a CSV reader, yielding them in lists of up to chunk_size."""
+
+	chunk = list()
+	for csvrow in csvrows:
+		chunk.append(csvrow)
+		if len(chunk) >= chunk_size:
+			yield chunk
+			chunk = list()
+
+	if chunk:
+		yield chunk
+
+def create_surveys(task):
+	"""Create a Survey for each row in a chunk. Can be run in a worker process."""
+
+	csvrows, date_headers, location_easting_headers, location_northing_headers = task
+
+	return [Survey(csvrow, date_headers, location_easting_headers, location_northing_headers) for csvrow in csvrows]
+
+def find_trail_cluster_summaries(task):
+	"""Find the clusters in one trail, in a worker process.
+
+	Each cluster comes back as (start, end, x, y), where start and end
+	are positions of its first and last home fixes in the trail. The
+	center is averaged the same way as Cluster.recalculate_core_data."""
+
+	times, xs, ys, radius, time_cutoff = task
+	catids = [False] * len(times)
+
+	member_lists, truncated = catcm.find_cluster_members(times, xs, ys, catids, 0, len(times), len(times), radius, time_cutoff, set())
+
+	summaries = list()
+	for members in member_lists:
+		home_positions = [position for position, status in members if status == 'home']
+
+		sum_x = 0
+		sum_y = 0
+		for position in home_positions:
+			sum_x += xs[position]
+			sum_y += ys[position]
+
+		summaries.append((home_positions[0], home_positions[-1], sum_x / len(home_positions), sum_y / len(home_positions)))
+
+	return summaries
@@ -26,8 +26,11 @@
 
 import math
 
+from collections import Counter
+
 from PIL import Image
-from PIL import ImageDraw
+from PIL import ImageChops
+from PIL import ImageFilter
 
 import catamount.common as catcm
 
@@ -40,11 +43,12 @@ class STDataPool(catcm.DataPool):
 	This adds the ability to divide the data into trails, and display
 	territory graphics."""
 
-	def __init__(self, dot_size, perimeter_resolution):
+	def __init__(self, dot_size, perimeter_resolution, density=False):
 		catcm.DataPool.__init__(self)
 
 		self.dot_size = dot_size
 		self.perimeter_resolution = perimeter_resolution
+		self.density = density
 
 		self.legend_start_date = '0'
 		self.legend_end_date = '0'
@@ -82,6 +86,8 @@ class STDataPool(catcm.DataPool):
 
 		column_2 = list()
 		column_2.append(('Scale', '1 px = {} m'.format(self.scale)))
+		if self.density:
+			column_2.append(('Shading', 'Fix density'))
 
 		self.legend_info = [column_1, column_2]
 		self.draw_legend(True)
@@ -104,30 +110,85 @@ class STDataPool(catcm.DataPool):
 				if not available_fixes:
 					continue
 
-				available_fixes = sorted(available_fixes, key=lambda fix: fix.distance_from_center)
-				farthest_fix = available_fixes[-1]
+				# The last of the farthest, as the end of a sort by distance would be
+				farthest_fix = max(reversed(available_fixes), key=lambda fix: fix.distance_from_center)
 				pt_img_x = self.img_x(farthest_fix.x)
 				pt_img_y = self.img_y(farthest_fix.y)
 				border_points.append((pt_img_x, pt_img_y))
 
-			borderimg = Image.new('RGB', (self.imgwidth, self.imgheight), self.cat_colors[trail.catid])
-			bordermask = Image.new('L', (self.imgwidth, self.imgheight), '#000000')
-			bordermaskdraw = ImageDraw.Draw(bordermask)
-			bordermaskdraw.polygon(border_points, '#404040', '#FFFFFF')
-			self.fgimage.paste(borderimg, (0, 0), bordermask)
+			border = catcm.Layer((self.imgwidth, self.imgheight), self.cat_colors[trail.catid])
+			border.draw_mask('polygon', border_points, '#404040', '#FFFFFF')
+			border.paste_onto(self.fgimage)
+
+
+		# Shade where each cat's fixes are densest, or create a colored
+		# dot for every fix. We do dots in chrono order across all cats,
+		# so that newer points wind up on top, the least obscured, and
+		# older points are more obscured.
+		if self.density:
+			self.draw_density()
+		else:
+			self.draw_dots(
+				[fix.x for fix in self.fixes],
+				[fix.y for fix in self.fixes],
+				[self.cat_colors[fix.catid] for fix in self.fixes],
+				self.dot_size
+			)
 
+	def draw_density(self):
+		"""Shade each cat's color over its territory by how many of its fixes fall on each pixel.
 
-		# Create a colored dot for every fix. We do these in chrono
-		# order across all cats, so that newer points wind up on top,
-		# the least obscured, and older points are more obscured.
-		px_radius = self.dot_size / 2
-		for fix in self.fixes:
-			img_x = self.img_x(fix.x)
-			img_y = self.img_y(fix.y)
-			self.fgdraw.ellipse(
-				[(img_x - px_radius, img_y - px_radius), (img_x + px_radius, img_y + px_radius)],
-				self.cat_colors[fix.catid]
+		The fixes on each pixel are counted, and the counts are spread
+		over the dot size, so that drawing takes time by the pixel rather
+		than by the fix. Counts are shaded on a log scale, so a few fixes
+		still show next to a den site. Each cat is only shaded within
+		the box around its fixes, and the shading is multiplied into the
+		image like overlapping inks. The result doesn't depend on the
+		order of the cats, and where territories overlap both show."""
+
+		# The blur spreads shading about three times its radius
+		margin = int(math.ceil(self.dot_size * 1.5)) + 4
+
+		for trail in self.trails.values():
+			counts = Counter(
+				point for point in zip(
+					self.img_xs([fix.x for fix in trail.fixes]),
+					self.img_ys([fix.y for fix in trail.fixes])
+				)
+				if 0 <= point[0] < self.imgwidth and 0 <= point[1] < self.imgheight
 			)
+			if not counts:
+				continue
+
+			log_most = math.log(max(counts.values()) + 1)
+			shades = dict((count, int(255 * math.log(count + 1) / log_most)) for count in set(counts.values()))
+
+			# Only the box around this cat's fixes, and the blur, is allocated
+			left = max(0, min(img_x for img_x, img_y in counts) - margin)
+			top = max(0, min(img_y for img_x, img_y in counts) - margin)
+			right = min(self.imgwidth, max(img_x for img_x, img_y in counts) + margin + 1)
+			bottom = min(self.imgheight, max(img_y for img_x, img_y in counts) + margin + 1)
+			box_width = right - left
+
+			levels = bytearray(box_width * (bottom - top))
+			for (img_x, img_y), count in counts.items():
+				levels[((img_y - top) * box_width) + img_x - left] = shades[count]
+
+			density = Image.frombytes('L', (box_width, bottom - top), bytes(levels))
+			if self.dot_size > 1:
+				density = density.filter(ImageFilter.GaussianBlur(self.dot_size / 2))
+
+			# Stretch the shading back out after spreading it, lifting the
+			# faint edges of lone fixes, and stop short of opaque
+			highest = density.getextrema()[1]
+			if not highest:
+				continue
+			density = density.point(lambda level: int(192 * math.sqrt(level / highest)))
+
+			tint = Image.new('RGB', density.size, '#FFFFFF')
+			tint.paste(self.cat_colors[trail.catid], (0, 0) + density.size, density)
+			box = (left, top, right, bottom)
+			self.fgimage.paste(ImageChops.multiply(self.fgimage.crop(box), tint), box)
 
 
 # FUNCTIONS
@@ -23,6 +23,7 @@
 
 # IMPORT
 
+import sys
 import math
 import datetime
 import pytz
@@ -48,6 +49,20 @@ default_latitude = 47.92027778
 default_longitude = 106.91722222
 default_tz_local = 'Asia/Ulaanbaatar'
 
+# Sunrise and sunset shift a little with the time of the request, not
+# only its date. Requests this many seconds or less from the earliest
+# or latest sunrise or sunset of their day get the full calculation.
+daily_table_margin = 300
+
+# Twilight classes, each with the lowest solar elevation (degrees) it
+# covers. Below the last one is night. The day starts where sunrise is
+# calculated, with the sun's upper edge on the horizon.
+twilight_classes = [(-0.833, 'day'), (-6, 'civil'), (-12, 'nautical'), (-18, 'astronomical')]
+
+# With the UTM zone of the data known, day and night are worked out for
+# squares of this many meters. Across 25 km, sunrise moves about a minute.
+sun_grid_cell_size = 25000
+
 # CLASSES
 
 class SunMetrics(object):
@@ -67,9 +82,16 @@ class SunMetrics(object):
 	def __init__(self, latitude=default_latitude, longitude=default_longitude, tz_local=default_tz_local):
 		self.latitude = latitude
 		self.longitude = longitude
-		self.tz_local = pytz.timezone(tz_local)
+		if isinstance(tz_local, str):
+			self.tz_local = pytz.timezone(tz_local)
+		else:
+			self.tz_local = tz_local
 		self.tz_utc = pytz.timezone('UTC')
 
+		# Filled in as needed by is_daylight
+		self.local_dates = dict()
+		self.daily_table = dict()
+
 		# Start with "now" as the date and time
 		self.datetime_utc = self.tz_utc.localize(datetime.datetime.utcnow())
 		self.datetime_local = self.datetime_utc.astimezone(self.tz_local)
@@ -79,57 +101,11 @@ class SunMetrics(object):
 	def calculate(self):
 		"""Calculate the sunrise, sunset, solar noon, and other things along the way."""
 
-		# Convert the UTC time to decimal days, used in calculating Julian Date
-		utc_decimal_time = self.time_to_decimal_day(self.datetime_utc.time())
-
-		# Julian Date. Calculation from (Danby 1988, p. 207; Sinnott 1991, p. 183).
-		# This equation contains an approximation making it only useful for years between 1901 and 2099
-		Julian_Date = (367 * self.datetime_utc.year) - (7 * (self.datetime_utc.year + ((self.datetime_utc.month + 9) // 12)) // 4) + ((275 * self.datetime_utc.month) // 9) + self.datetime_utc.day + 1721013.5 + utc_decimal_time
-
 		# Julian century, hundreds of years since 2000-01
-		Julian_century = (Julian_Date - 2451545) / 36525
-
-		# Geometric Mean Long Sun (degrees)
-		GM_Long = (280.46646 + Julian_century * (36000.76983 + Julian_century * 0.0003032)) % 360
-
-		# Geometric Mean Anom Sun (degrees)
-		GM_Anom = 357.52911 + Julian_century * (35999.05029 - 0.0001537 * Julian_century)
-
-		# Eccentricity of Earth's orbit
-		Eccent = 0.016708634 - (Julian_century * (0.000042037 + (0.0000001267 * Julian_century)))
-
-		# Sun Eq of Ctr
-		S_Eq_Ctr = math.sin(math.radians(GM_Anom)) * (1.914602 - Julian_century * (0.004817 + 0.000014 * Julian_century)) + math.sin(math.radians(2 * GM_Anom)) * (0.019993 - 0.000101 * Julian_century) + math.sin(math.radians(3 * GM_Anom)) * 0.000289
-
-		# Sun True Long (degrees)
-		S_True_Long = GM_Long + S_Eq_Ctr
-
-		## Sun True Anom (degrees)
-		#S_True_Anom = GM_Anom + S_Eq_Ctr
-
-		## Sun Rad Vector (Astronomical Units)
-		#S_Rad_Vector = (1.000001018 * (1 - (Eccent * Eccent))) / (1 + (Eccent * math.cos(math.radians(S_True_Anom))))
-
-		# Sun App Long (degrees)
-		S_App_Long = S_True_Long - 0.00569 - 0.00478 * math.sin(math.radians(125.04 - 1934.136 * Julian_century))
-
-		# Mean Obliq Ecliptic (degrees)
-		M_Obliq = 23 + (26 + ((21.448 - Julian_century * (46.815 + Julian_century * (0.00059 - Julian_century * 0.001813)))) / 60) / 60
-
-		# Obliq Corr (degrees)
-		Obliq = M_Obliq + 0.00256 * math.cos(math.radians(125.04 - 1934.136 * Julian_century))
+		Julian_century = julian_century(self.datetime_utc)
 
-		## Sun Rt Ascen (degrees)
-		#S_Rt_Ascen = math.degrees( math.atan2( (math.cos(math.radians(Obliq)) * math.sin(math.radians(S_App_Long))), math.cos(math.radians(S_App_Long)) ) )
-
-		# Sun Declination (degrees)
-		S_Declination = math.degrees(math.asin(math.sin(math.radians(Obliq)) * math.sin(math.radians(S_App_Long))))
-
-		# var y
-		var_y = math.tan(math.radians(Obliq / 2)) * math.tan(math.radians(Obliq / 2))
-
-		# Eq of time (minutes)
-		Eq_of_time = 4 * math.degrees(var_y * math.sin(2 * math.radians(GM_Long)) - 2 * Eccent * math.sin(math.radians(GM_Anom)) + 4 * Eccent * var_y * math.sin(math.radians(GM_Anom)) * math.cos(2 * math.radians(GM_Long)) - 0.5 * var_y * var_y * math.sin(4 * math.radians(GM_Long)) - 1.25 * Eccent * Eccent * math.sin(2 * math.radians(GM_Anom)))
+		# Sun Declination (degrees) and Eq of time (minutes)
+		S_Declination, Eq_of_time = declination_and_equation_of_time(Julian_century)
 
 		# Hour Angle sunrise (degrees)
 		hour_angle_sunrise = math.degrees(math.acos(math.cos(math.radians(90.833)) / (math.cos(math.radians(self.latitude)) * math.cos(math.radians(S_Declination))) - math.tan(math.radians(self.latitude)) * math.tan(math.radians(S_Declination))))
@@ -221,6 +197,23 @@ class SunMetrics(object):
 		return self.tz_utc.localize(naive_datetime)
 
 	def is_daylight(self, datetime_request, utc_or_local):
+		"""Find whether the sun is up at the requested date and time.
+
+		UTC requests are first checked against the table for their
+		local date, and only recalculated when close to sunrise or
+		sunset. A request answered from the table does not change the
+		date of this object."""
+
+		if utc_or_local == 'utc':
+			day_bounds = self.find_day_bounds(datetime_request)
+			if day_bounds:
+				sunrise_earliest, sunrise_latest, sunset_earliest, sunset_latest = day_bounds
+
+				if sunrise_latest < datetime_request < sunset_earliest:
+					return True
+				if datetime_request < sunrise_earliest or datetime_request > sunset_latest:
+					return False
+
 		self.new_date(datetime_request, utc_or_local)
 
 		if self.sunrise_utc <= self.datetime_utc <= self.sunset_utc:
@@ -228,10 +221,366 @@ class SunMetrics(object):
 		else:
 			return False
 
+	def find_day_bounds(self, datetime_utc):
+		"""Return the table entry for the local date of a naive UTC datetime.
+
+		The entry is the earliest and latest sunrise, then the earliest
+		and latest sunset, across that date, widened by the margin. All
+		are naive UTC datetimes. False means the table can't be used."""
+
+		# Look up where the local date changes during this UTC date
+		utc_date = datetime_utc.date()
+		if utc_date not in self.local_dates:
+			self.local_dates[utc_date] = self.find_local_date_change(utc_date)
+
+		if not self.local_dates[utc_date]:
+			return False
+
+		change_moment, date_before, date_after = self.local_dates[utc_date]
+		if datetime_utc < change_moment:
+			local_date = date_before
+		else:
+			local_date = date_after
+
+		if local_date not in self.daily_table:
+			self.daily_table[local_date] = self.calculate_day_bounds(local_date)
+
+		return self.daily_table[local_date]
+
+	def find_local_date_change(self, utc_date):
+		"""Find when the local date changes during a UTC date.
+
+		Returns the naive UTC moment of the change, and the local dates
+		before and after it. False means the change couldn't be found."""
+
+		day_start = datetime.datetime(utc_date.year, utc_date.month, utc_date.day)
+		day_end = day_start + datetime.timedelta(days=1)
+
+		date_before = self.utc_to_local_date(day_start)
+		date_after = self.utc_to_local_date(day_end - datetime.timedelta(microseconds=1))
+		if date_before == date_after:
+			return (day_end, date_before, date_after)
+
+		# The change is at local midnight, unless the time zone skips it
+		local_midnight = datetime.datetime(date_after.year, date_after.month, date_after.day)
+		change_moment = self.tz_local.localize(local_midnight).astimezone(self.tz_utc).replace(tzinfo=None)
+		if self.utc_to_local_date(change_moment) != date_after:
+			return False
+		if self.utc_to_local_date(change_moment - datetime.timedelta(microseconds=1)) != date_before:
+			return False
+
+		return (change_moment, date_before, date_after)
+
+	def utc_to_local_date(self, datetime_utc):
+		"""Convert a naive UTC datetime to a local date."""
+
+		return self.tz_utc.localize(datetime_utc).astimezone(self.tz_local).date()
+
+	def calculate_day_bounds(self, local_date):
+		"""Calculate sunrise and sunset at the first and last moments of a local date."""
+
+		local_midnight = datetime.datetime(local_date.year, local_date.month, local_date.day)
+		next_midnight = local_midnight + datetime.timedelta(days=1)
+		first_moment = self.tz_local.localize(local_midnight).astimezone(self.tz_utc).replace(tzinfo=None)
+		last_moment = self.tz_local.localize(next_midnight).astimezone(self.tz_utc).replace(tzinfo=None) - datetime.timedelta(seconds=1)
+
+		sunrises = list()
+		sunsets = list()
+		for moment in [first_moment, last_moment]:
+			self.new_date(moment, 'utc')
+			sunrises.append(self.sunrise_utc.replace(tzinfo=None))
+			sunsets.append(self.sunset_utc.replace(tzinfo=None))
+
+		margin = datetime.timedelta(seconds=daily_table_margin)
+		return (min(sunrises) - margin, max(sunrises) + margin, min(sunsets) - margin, max(sunsets) + margin)
+
+	def for_location(self, x, y):
+		"""Return the SunMetrics to use at a UTM location. This one place serves everywhere."""
+
+		return self
+
+	def label_fixes(self, fixes):
+		"""Give each fix its solar elevation and twilight class, working out all fixes together."""
+
+		# Imported here, as catamount.common reads the config file
+		import catamount.common as catcm
+
+		positions = solar_positions([catcm.utc_dateobj(fix.time) for fix in fixes], self.latitude, self.longitude)
+
+		for fix, (sunrise_utc, sunset_utc, solar_elevation_angle, twilight) in zip(fixes, positions):
+			fix.solar_elevation = solar_elevation_angle
+			fix.twilight = twilight
+
 	def output(self):
 		print('Request:    {}\nSunrise:    {}\nSolar Noon: {}\nSunset:     {}\n'.format(self.datetime_utc, self.sunrise_utc, self.solar_noon_utc, self.sunset_utc))
 
 
+class SunMetricsGrid(object):
+	"""Sun metrics that follow the location of each fix, across a grid of UTM cells.
+
+	Each cell has its own SunMetrics, placed at the center of the cell,
+	so sunrise and sunset are worked out once per cell and local date.
+	Local dates follow the sun rather than a time zone: each cell uses
+	the whole quarter hour offset nearest its longitude."""
+
+	def __init__(self, zone, northern=True, cell_size=None):
+		self.zone = zone
+		self.northern = northern
+		if cell_size is None:
+			cell_size = sun_grid_cell_size
+		self.cell_size = cell_size
+
+		self.cell_metrics = dict()
+
+	def for_location(self, x, y):
+		"""Return the SunMetrics for the cell containing a UTM location."""
+
+		cell = (int(x // self.cell_size), int(y // self.cell_size))
+		if cell not in self.cell_metrics:
+			center_x = (cell[0] + 0.5) * self.cell_size
+			center_y = (cell[1] + 0.5) * self.cell_size
+			latitudes, longitudes = utm_to_latlong([center_x], [center_y], self.zone, self.northern)
+			offset_minutes = int(round(longitudes[0] * 4 / 15)) * 15
+			self.cell_metrics[cell] = SunMetrics(latitudes[0], longitudes[0], pytz.FixedOffset(offset_minutes))
+
+		return self.cell_metrics[cell]
+
+	def label_fixes(self, fixes):
+		"""Give each fix its solar elevation and twilight class, at its own location."""
+
+		# Imported here, as catamount.common reads the config file
+		import catamount.common as catcm
+
+		latitudes, longitudes = utm_to_latlong([fix.x for fix in fixes], [fix.y for fix in fixes], self.zone, self.northern)
+		positions = solar_positions([catcm.utc_dateobj(fix.time) for fix in fixes], latitudes, longitudes)
+
+		for fix, (sunrise_utc, sunset_utc, solar_elevation_angle, twilight) in zip(fixes, positions):
+			fix.solar_elevation = solar_elevation_angle
+			fix.twilight = twilight
+
+
+# FUNCTIONS
+
+def julian_century(datetime_utc):
+	"""Find the Julian century of a UTC datetime, hundreds of years since 2000-01."""
+
+	# Convert the UTC time to decimal days, used in calculating Julian Date
+	utc_decimal_time = ((datetime_utc.hour * 3600) + (datetime_utc.minute * 60) + datetime_utc.second) / 86400.0
+
+	# Julian Date. Calculation from (Danby 1988, p. 207; Sinnott 1991, p. 183).
+	# This equation contains an approximation making it only useful for years between 1901 and 2099
+	Julian_Date = (367 * datetime_utc.year) - (7 * (datetime_utc.year + ((datetime_utc.month + 9) // 12)) // 4) + ((275 * datetime_utc.month) // 9) + datetime_utc.day + 1721013.5 + utc_decimal_time
+
+	return (Julian_Date - 2451545) / 36525
+
+def declination_and_equation_of_time(Julian_century):
+	"""Find the sun's declination (degrees) and the equation of time (minutes)."""
+
+	# Geometric Mean Long Sun (degrees)
+	GM_Long = (280.46646 + Julian_century * (36000.76983 + Julian_century * 0.0003032)) % 360
+
+	# Geometric Mean Anom Sun (degrees)
+	GM_Anom = 357.52911 + Julian_century * (35999.05029 - 0.0001537 * Julian_century)
+
+	# Eccentricity of Earth's orbit
+	Eccent = 0.016708634 - (Julian_century * (0.000042037 + (0.0000001267 * Julian_century)))
+
+	# Sun Eq of Ctr
+	S_Eq_Ctr = math.sin(math.radians(GM_Anom)) * (1.914602 - Julian_century * (0.004817 + 0.000014 * Julian_century)) + math.sin(math.radians(2 * GM_Anom)) * (0.019993 - 0.000101 * Julian_century) + math.sin(math.radians(3 * GM_Anom)) * 0.000289
+
+	# Sun True Long (degrees)
+	S_True_Long = GM_Long + S_Eq_Ctr
+
+	## Sun True Anom (degrees)
+	#S_True_Anom = GM_Anom + S_Eq_Ctr
+
+	## Sun Rad Vector (Astronomical Units)
+	#S_Rad_Vector = (1.000001018 * (1 - (Eccent * Eccent))) / (1 + (Eccent * math.cos(math.radians(S_True_Anom))))
+
+	# Sun App Long (degrees)
+	S_App_Long = S_True_Long - 0.00569 - 0.00478 * math.sin(math.radians(125.04 - 1934.136 * Julian_century))
+
+	# Mean Obliq Ecliptic (degrees)
+	M_Obliq = 23 + (26 + ((21.448 - Julian_century * (46.815 + Julian_century * (0.00059 - Julian_century * 0.001813)))) / 60) / 60
+
+	# Obliq Corr (degrees)
+	Obliq = M_Obliq + 0.00256 * math.cos(math.radians(125.04 - 1934.136 * Julian_century))
+
+	## Sun Rt Ascen (degrees)
+	#S_Rt_Ascen = math.degrees( math.atan2( (math.cos(math.radians(Obliq)) * math.sin(math.radians(S_App_Long))), math.cos(math.radians(S_App_Long)) ) )
+
+	# Sun Declination (degrees)
+	S_Declination = math.degrees(math.asin(math.sin(math.radians(Obliq)) * math.sin(math.radians(S_App_Long))))
+
+	# var y
+	var_y = math.tan(math.radians(Obliq / 2)) * math.tan(math.radians(Obliq / 2))
+
+	# Eq of time (minutes)
+	Eq_of_time = 4 * math.degrees(var_y * math.sin(2 * math.radians(GM_Long)) - 2 * Eccent * math.sin(math.radians(GM_Anom)) + 4 * Eccent * var_y * math.sin(math.radians(GM_Anom)) * math.cos(2 * math.radians(GM_Long)) - 0.5 * var_y * var_y * math.sin(4 * math.radians(GM_Long)) - 1.25 * Eccent * Eccent * math.sin(2 * math.radians(GM_Anom)))
+
+	return (S_Declination, Eq_of_time)
+
+def solar_positions(dateobjs, latitude=default_latitude, longitude=default_longitude, sun_times=False):
+	"""Find the sun's position, and the day's sunrise and sunset if asked, for many dates in one pass.
+
+	Dates are naive UTC datetime.datetime objects. Latitude and
+	longitude can each be one value, or a list with a value per date.
+
+	Returns a (sunrise, sunset, elevation, twilight) tuple per date.
+	Sunrise and sunset are UTC datetimes around solar noon on the UTC
+	date, or None if the sun doesn't rise and set that day or sun_times
+	is False. Elevation is in degrees, without correcting for
+	atmospheric refraction.
+
+	The declination and equation of time are worked out once for each
+	UTC hour, at half past. They change too slowly in an hour to move
+	the elevation by more than about 0.01 degrees."""
+
+	tz_utc = pytz.timezone('UTC')
+	sunrise_zenith_cos = math.cos(math.radians(90.833))
+
+	hourly_sun = dict()
+	positions = list()
+	for index, dateobj in enumerate(dateobjs):
+		if isinstance(latitude, list):
+			this_latitude = latitude[index]
+		else:
+			this_latitude = latitude
+
+		if isinstance(longitude, list):
+			this_longitude = longitude[index]
+		else:
+			this_longitude = longitude
+
+		hour_key = (dateobj.year, dateobj.month, dateobj.day, dateobj.hour)
+		if hour_key not in hourly_sun:
+			hourly_sun[hour_key] = declination_and_equation_of_time(julian_century(dateobj.replace(minute=30, second=0, microsecond=0)))
+		S_Declination, Eq_of_time = hourly_sun[hour_key]
+
+		sin_latitude = math.sin(math.radians(this_latitude))
+		cos_latitude = math.cos(math.radians(this_latitude))
+		sin_declination = math.sin(math.radians(S_Declination))
+		cos_declination = math.cos(math.radians(S_Declination))
+
+		# True Solar Time (minutes)
+		utc_decimal_time = ((dateobj.hour * 3600) + (dateobj.minute * 60) + dateobj.second) / 86400.0
+		true_solar_time = ((utc_decimal_time * 1440) + Eq_of_time + (4 * this_longitude)) % 1440
+
+		# Hour Angle (degrees)
+		if (true_solar_time / 4) < 0:
+			hour_angle = (true_solar_time / 4) + 180
+		else:
+			hour_angle = (true_solar_time / 4) - 180
+
+		# Solar Elevation Angle (degrees), from the Solar Zenith Angle
+		zenith_cos = (sin_latitude * sin_declination) + (cos_latitude * cos_declination * math.cos(math.radians(hour_angle)))
+		solar_elevation_angle = 90 - math.degrees(math.acos(max(-1, min(1, zenith_cos))))
+
+		# Hour Angle sunrise (degrees); out of range near the poles, where the sun stays up or down
+		if sun_times:
+			hour_angle_sunrise_cos = sunrise_zenith_cos / (cos_latitude * cos_declination) - (sin_latitude / cos_latitude) * (sin_declination / cos_declination)
+		else:
+			hour_angle_sunrise_cos = None
+
+		if hour_angle_sunrise_cos is not None and -1 <= hour_angle_sunrise_cos <= 1:
+			hour_angle_sunrise = math.degrees(math.acos(hour_angle_sunrise_cos))
+
+			# Solar noon, sunrise, and sunset (UTC decimal days)
+			solar_noon = (720 - (4 * this_longitude) - Eq_of_time) / 1440
+			sunrise = solar_noon - (hour_angle_sunrise * 4 / 1440)
+			sunset = solar_noon + (hour_angle_sunrise * 4 / 1440)
+
+			base_date = datetime.datetime(dateobj.year, dateobj.month, dateobj.day)
+			sunrise_utc = tz_utc.localize(base_date + datetime.timedelta(seconds=int(sunrise * 86400)))
+			sunset_utc = tz_utc.localize(base_date + datetime.timedelta(seconds=int(sunset * 86400)))
+		else:
+			sunrise_utc = None
+			sunset_utc = None
+
+		positions.append((sunrise_utc, sunset_utc, solar_elevation_angle, classify_twilight(solar_elevation_angle)))
+
+	return positions
+
+def classify_twilight(solar_elevation_angle):
+	"""Name the twilight class of a solar elevation: day, civil, nautical, astronomical, or night."""
+
+	for lowest_elevation, twilight in twilight_classes:
+		if solar_elevation_angle > lowest_elevation:
+			return twilight
+
+	return 'night'
+
+def utm_to_latlong(xs, ys, zone, northern=True):
+	"""Convert lists of UTM eastings and northings to lists of latitudes and longitudes.
+
+	Uses the WGS84 ellipsoid, and the usual series expansion of the
+	inverse transverse Mercator projection."""
+
+	# Everything that depends only on the ellipsoid and zone is worked out once
+	k0 = 0.9996
+	a = 6378137.0
+	flattening = 1 / 298.257223563
+	e2 = flattening * (2 - flattening)
+	ep2 = e2 / (1 - e2)
+	e1 = (1 - math.sqrt(1 - e2)) / (1 + math.sqrt(1 - e2))
+	mu_divisor = a * (1 - (e2 / 4) - (3 * e2 ** 2 / 64) - (5 * e2 ** 3 / 256))
+	central_meridian = math.radians(((zone - 1) * 6) - 180 + 3)
+
+	latitudes = list()
+	longitudes = list()
+	for x, y in zip(xs, ys):
+		x = x - 500000
+		if not northern:
+			y = y - 10000000
+
+		# Footpoint latitude
+		mu = (y / k0) / mu_divisor
+		phi1 = mu + ((3 * e1 / 2) - (27 * e1 ** 3 / 32)) * math.sin(2 * mu) + ((21 * e1 ** 2 / 16) - (55 * e1 ** 4 / 32)) * math.sin(4 * mu) + (151 * e1 ** 3 / 96) * math.sin(6 * mu) + (1097 * e1 ** 4 / 512) * math.sin(8 * mu)
+
+		sin_phi1 = math.sin(phi1)
+		cos_phi1 = math.cos(phi1)
+		tan_phi1 = math.tan(phi1)
+		N1 = a / math.sqrt(1 - e2 * sin_phi1 ** 2)
+		R1 = a * (1 - e2) / (1 - e2 * sin_phi1 ** 2) ** 1.5
+		T1 = tan_phi1 ** 2
+		C1 = ep2 * cos_phi1 ** 2
+		D = x / (N1 * k0)
+
+		latitude = phi1 - (N1 * tan_phi1 / R1) * ((D ** 2 / 2) - ((5 + 3 * T1 + 10 * C1 - 4 * C1 ** 2 - 9 * ep2) * D ** 4 / 24) + ((61 + 90 * T1 + 298 * C1 + 45 * T1 ** 2 - 252 * ep2 - 3 * C1 ** 2) * D ** 6 / 720))
+		longitude = central_meridian + (D - ((1 + 2 * T1 + C1) * D ** 3 / 6) + ((5 - 2 * C1 + 28 * T1 - 3 * C1 ** 2 + 8 * ep2 + 24 * T1 ** 2) * D ** 5 / 120)) / cos_phi1
+
+		latitudes.append(math.degrees(latitude))
+		longitudes.append(math.degrees(longitude))
+
+	return (latitudes, longitudes)
+
+def create_sun_metrics(utm_zone):
+	"""Create a SunMetrics for the default location, or a SunMetricsGrid if the UTM zone of the data is known.
+
+	The zone is its number followed by N or S, such as "12N". A zone
+	of "0" means it isn't known."""
+
+	utm_zone = utm_zone.strip().upper()
+	if utm_zone in ['', '0']:
+		return SunMetrics()
+
+	hemisphere = utm_zone[-1]
+	if hemisphere in ['N', 'S']:
+		utm_zone = utm_zone[:-1]
+	else:
+		hemisphere = 'N'
+
+	try:
+		zone = int(utm_zone)
+	except ValueError:
+		zone = 0
+
+	if not 1 <= zone <= 60:
+		sys.stderr.write('Invalid UTM zone: {}. Using the default location for day and night.\n'.format(utm_zone))
+		return SunMetrics()
+
+	return SunMetricsGrid(zone, hemisphere == 'N')
+
 if __name__ == "__main__":
 	sun_metrics = SunMetrics()
 	sun_metrics.output()
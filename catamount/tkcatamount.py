@@ -1093,9 +1093,14 @@ class MainWindow(object):
 				textfilename = filename + '.txt'
 			textwindow = TextWindow(script_process.stdout.decode('utf-8'), self.outdir_path.get(), textfilename)
 
-		imagefilepath = os.path.join(self.outdir_path.get(), filename + '.png')
-		if os.path.isfile(imagefilepath):
-			graphicwindow = GraphicWindow(imagefilepath)
+		# The image is saved in the configured format, unless that one isn't known
+		image_formats = sorted(catcm.image_formats, key=lambda image_format: image_format != catcm.cfg_image_format)
+		for image_format in image_formats:
+			image_extension = catcm.image_formats[image_format][0]
+			imagefilepath = os.path.join(self.outdir_path.get(), filename + image_extension)
+			if os.path.isfile(imagefilepath):
+				graphicwindow = GraphicWindow(imagefilepath)
+				break
 
 	def launch_find_clusters(self):
 		cluster_start_date = catcm.date_string_to_objects(self.cluster_start_date.get())
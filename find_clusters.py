@@ -57,6 +57,32 @@ argman.add_argument(
 	help='Specify an output directory.'
 )
 
+argman.add_argument(
+	'-if', '--image_format',
+	dest='image_format', action='store',
+	type=catcm.check_image_format_arg, default=catcm.cfg_image_format,
+	help='Save images as png, webp (lossless), tiff or ppm (uncompressed).'
+)
+
+argman.add_argument(
+	'-ie', '--image_encoding',
+	dest='image_encoding', action='store',
+	type=catcm.check_image_encoding_arg, default=catcm.cfg_image_encoding,
+	help='Encode images for speed, size or balanced, or with an effort level from 0 to 9.'
+)
+
+argman.add_argument(
+	'-ni', '--no_image',
+	dest='no_image', action='store_true',
+	help='Only do the text report, skipping the work needed just for the image.'
+)
+
+argman.add_argument(
+	'-io', '--image_only',
+	dest='image_only', action='store_true',
+	help='Only create the image, skipping the work needed just for the text report.'
+)
+
 argman.add_argument(
 	'-c', '--catid',
 	dest='catid', action='store',
@@ -120,6 +146,32 @@ argman.add_argument(
 	help='Zoom in on a specific cluster.'
 )
 
+argman.add_argument(
+	'-tl', '--tiles',
+	dest='tiles', action='store_true',
+	help='Draw all clusters as a tiled map with a viewer, which can be any size.'
+)
+
+argman.add_argument(
+	'-ts', '--tile_scale',
+	dest='tile_scale', action='store',
+	type=int, default='50',
+	help='Meters per pixel of the most detailed map tiles.'
+)
+
+argman.add_argument(
+	'-za', '--zoom_all',
+	dest='zoom_all', action='store_true',
+	help='Zoom in on every cluster, each in its own image, listed in a manifest.'
+)
+
+argman.add_argument(
+	'-j', '--jobs',
+	dest='jobs', action='store',
+	type=catcm.jobs_arg_to_count, default='0',
+	help='Number of processes used to draw map tiles or cluster images. 0 uses every core.'
+)
+
 # Using the argument parser to do a lot of work:
 # * Prefer command line arguments
 # * Fall back on config file values
@@ -130,11 +182,28 @@ args = argman.parse_args()
 # Make sure integer arguments are in a reasonable range.
 args.radius = catcm.constrain_integer(args.radius, 0, 1000)
 args.time_cutoff = catcm.constrain_integer(args.time_cutoff, 0, 31536000)
+args.tile_scale = catcm.constrain_integer(args.tile_scale, 1, 100000)
 args.minimum_count = catcm.constrain_integer(args.minimum_count, 0, 100)
 args.minimum_stay = catcm.constrain_integer(args.minimum_stay, 0, 8640000)
 
-# Create a SunMetrics object so any fixes can compute day and night
-sun_metrics = catsm.SunMetrics()
+# Save images in the requested format and encoding
+catcm.set_image_output(args.image_format, args.image_encoding)
+
+if args.no_image and args.image_only:
+	argman.error('Ask for no image, or only an image, not both.')
+
+if args.clusterid and args.zoom_all:
+	argman.error('Zoom in on one cluster, or all of them, not both.')
+
+if args.no_image and (args.tiles or args.zoom_all):
+	argman.error('Tiles and zoomed images are images, so they can\'t be drawn with no image.')
+
+# Create a SunMetrics object so any fixes can compute day and night,
+# which only the text report shows
+if args.image_only:
+	sun_metrics = False
+else:
+	sun_metrics = catsm.create_sun_metrics(catcm.cfg_utm_zone)
 
 # Open and process the data file
 with open(args.datafile_path, 'rt') as datafile:
@@ -186,8 +255,13 @@ trail.order_by_time()
 # Remove any duplicate entries, seen in some data sets
 trail.remove_duplicates()
 
-# Find the farthest distance in each direction
-trail.find_bounds()
+# Find the position of the sun for every fix, which only csv-all shows
+if sun_metrics and args.text_style == 'csv-all':
+	sun_metrics.label_fixes(trail.fixes)
+
+# Find the farthest distance in each direction, for the image
+if not args.no_image:
+	trail.find_bounds()
 
 # Find clusters
 trail.find_clusters()
@@ -197,7 +271,7 @@ trail.calculate_cluster_averages()
 
 # Get image name and path ready
 imagename = catfc.create_filename(args.catid, args.start_date, args.end_date, args.clusterid)
-imagepath = os.path.join(args.outdir_path, imagename + '.png')
+imagepath = os.path.join(args.outdir_path, imagename + catcm.render_context.image_extension)
 
 # Prepare date limiting strings for use in image legends
 if args.start_date:
@@ -212,10 +286,13 @@ if args.clusterid:
 	cluster = trail.return_cluster_by_id(args.clusterid)
 
 	# Create feedback image
-	cluster.create_image(imagepath, 'auto')
+	if not args.no_image:
+		cluster.create_image(imagepath, 'auto')
 
 	# Do a text report of this cluster; show all points by default
-	if args.text_style == 'csv':
+	if args.image_only:
+		pass
+	elif args.text_style == 'csv':
 		cluster.csv_report
 	else:
 		cluster.descriptive_report(True)
@@ -229,11 +306,26 @@ else:
 	trail.filter_clusters_by_count()
 	trail.filter_clusters_by_stay()
 
-	# Create feedback image
-	trail.create_image(imagepath, 50)
+	# Create feedback image, a tiled map of any size, or an image of every cluster
+	if args.no_image:
+		pass
+	elif args.zoom_all:
+		clusterpaths = [os.path.join(args.outdir_path, catfc.create_filename(args.catid, args.start_date, args.end_date, cluster.id) + catcm.render_context.image_extension) for cluster in trail.clusters]
+		clusterpaths = catcm.create_images(trail.clusters, clusterpaths, 'auto', args.jobs)
+		manifestpath = os.path.join(args.outdir_path, imagename + '_manifest.csv')
+		catcm.write_manifest(manifestpath, 'Cluster_ID', [cluster.id for cluster in trail.clusters], clusterpaths)
+		sys.stderr.write('{} cluster images listed in {}.\n'.format(len([clusterpath for clusterpath in clusterpaths if clusterpath]), manifestpath))
+	elif args.tiles:
+		tilepath = os.path.join(args.outdir_path, imagename)
+		tile_count = trail.create_tiles(tilepath, args.tile_scale, args.jobs)
+		sys.stderr.write('{} map tiles drawn in {}.\n'.format(tile_count, tilepath))
+	else:
+		trail.create_image(imagepath, 50)
 
 	# Do a text report of all clusters found
-	if args.text_style == 'descriptive-all':
+	if args.image_only:
+		pass
+	elif args.text_style == 'descriptive-all':
 		trail.descriptive_report(True)
 	elif args.text_style == 'descriptive':
 		trail.descriptive_report(False)
@@ -244,3 +336,6 @@ else:
 
 	# Account of what was done
 	sys.stderr.write('{} clusters found.\n'.format(len(trail.clusters)))
+
+# Wait for the feedback image to finish saving
+catcm.render_context.finish_saving()
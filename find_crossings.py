@@ -56,6 +56,32 @@ argman.add_argument(
 	help='Specify an output directory.'
 )
 
+argman.add_argument(
+	'-if', '--image_format',
+	dest='image_format', action='store',
+	type=catcm.check_image_format_arg, default=catcm.cfg_image_format,
+	help='Save images as png, webp (lossless), tiff or ppm (uncompressed).'
+)
+
+argman.add_argument(
+	'-ie', '--image_encoding',
+	dest='image_encoding', action='store',
+	type=catcm.check_image_encoding_arg, default=catcm.cfg_image_encoding,
+	help='Encode images for speed, size or balanced, or with an effort level from 0 to 9.'
+)
+
+argman.add_argument(
+	'-ni', '--no_image',
+	dest='no_image', action='store_true',
+	help='Only do the text report, skipping the work needed just for the image.'
+)
+
+argman.add_argument(
+	'-io', '--image_only',
+	dest='image_only', action='store_true',
+	help='Only create the image, skipping the work needed just for the text report.'
+)
+
 argman.add_argument(
 	'-c', '--catids',
 	dest='catids', action='store',
@@ -105,6 +131,46 @@ argman.add_argument(
 	help='Zoom in on a specific crossing.'
 )
 
+argman.add_argument(
+	'-j', '--jobs',
+	dest='jobs', action='store',
+	type=catcm.jobs_arg_to_count, default='0',
+	help='Number of processes used to find crossings and draw images. 0 uses every core.'
+)
+
+argman.add_argument(
+	'-fc', '--focal_catid',
+	dest='focal_catid', action='store',
+	type=str, default=False,
+	help='Only find crossings involving this cat, comparing its trail with the others. Each crossing is between two cats, so three cats meeting are shown as pairs.'
+)
+
+argman.add_argument(
+	'-pc', '--partner_catid',
+	dest='partner_catid', action='store',
+	type=str, default=False,
+	help='With a focal cat, only find crossings between it and this cat.'
+)
+
+argman.add_argument(
+	'-tl', '--tiles',
+	dest='tiles', action='store_true',
+	help='Draw all crossings as a tiled map with a viewer, which can be any size.'
+)
+
+argman.add_argument(
+	'-ts', '--tile_scale',
+	dest='tile_scale', action='store',
+	type=int, default='100',
+	help='Meters per pixel of the most detailed map tiles.'
+)
+
+argman.add_argument(
+	'-za', '--zoom_all',
+	dest='zoom_all', action='store_true',
+	help='Zoom in on every crossing, each in its own image, listed in a manifest.'
+)
+
 # Using the argument parser to do a lot of work:
 # * Prefer command line arguments
 # * Fall back on config file values
@@ -115,9 +181,35 @@ args = argman.parse_args()
 # Make sure integer arguments are in a reasonable range.
 args.radius = catcm.constrain_integer(args.radius, 0, 1000)
 args.time_cutoff = catcm.constrain_integer(args.time_cutoff, 0, 31536000)
+args.tile_scale = catcm.constrain_integer(args.tile_scale, 1, 100000)
+
+# Save images in the requested format and encoding
+catcm.set_image_output(args.image_format, args.image_encoding)
+
+if args.no_image and args.image_only:
+	argman.error('Ask for no image, or only an image, not both.')
 
-# Create a SunMetrics object so any fixes can compute day and night
-sun_metrics = catsm.SunMetrics()
+if args.crossingid and args.zoom_all:
+	argman.error('Zoom in on one crossing, or all of them, not both.')
+
+if args.no_image and (args.tiles or args.zoom_all):
+	argman.error('Tiles and zoomed images are images, so they can\'t be drawn with no image.')
+
+# A focused query only needs the partner's data, if there is one
+if args.partner_catid and not args.focal_catid:
+	argman.error('A partner cat needs a focal cat.')
+
+if args.focal_catid and args.partner_catid:
+	args.catids = [args.focal_catid, args.partner_catid]
+elif args.focal_catid and args.catids and args.focal_catid not in args.catids:
+	args.catids.append(args.focal_catid)
+
+# Create a SunMetrics object so any fixes can compute day and night,
+# which only the text report shows
+if args.image_only:
+	sun_metrics = False
+else:
+	sun_metrics = catsm.create_sun_metrics(catcm.cfg_utm_zone)
 
 # Open and process the data file
 with open(args.datafile_path, 'rt') as datafile:
@@ -171,11 +263,20 @@ datapool.order_by_time()
 # Remove any duplicate entries, seen in some data sets
 datapool.remove_duplicates()
 
-# First we make clusters out of all points in the datapool
-datapool.find_clusters()
+# Find the position of the sun for every fix, which only csv-all shows
+if sun_metrics and args.text_style == 'csv-all':
+	sun_metrics.label_fixes(datapool.fixes)
 
-# Now convert clusters to crossings if they qualify
-datapool.clusters_to_crossings()
+# A focused query follows the focal cat's trail
+if args.focal_catid:
+	datapool.find_focal_crossings(args.focal_catid, args.partner_catid)
+
+else:
+	# First we make clusters out of all points in the datapool
+	datapool.find_clusters(args.jobs)
+
+	# Now convert clusters to crossings if they qualify
+	datapool.clusters_to_crossings()
 
 
 # Check to see if any crossings were found before continuing
@@ -184,13 +285,14 @@ if not datapool.crossings:
 
 
 # Get things ready to create an image
-datapool.find_bounds()
-datapool.find_catids()
-datapool.find_cat_colors()
+if not args.no_image:
+	datapool.find_bounds()
+	datapool.find_catids()
+	datapool.find_cat_colors()
 
 # Get image name and path ready
-imagename = catfx.create_filename(args.start_date, args.end_date, args.catids, args.crossingid)
-imagepath = os.path.join(args.outdir_path, imagename + '.png')
+imagename = catfx.create_filename(args.start_date, args.end_date, args.catids, args.crossingid, args.focal_catid)
+imagepath = os.path.join(args.outdir_path, imagename + catcm.render_context.image_extension)
 
 # Prepare date limiting strings for use in image legends
 if args.start_date:
@@ -205,10 +307,13 @@ if args.crossingid:
 	crossing = datapool.return_crossing_by_id(args.crossingid)
 
 	# Create a feedback image
-	crossing.create_image(imagepath, 'auto')
+	if not args.no_image:
+		crossing.create_image(imagepath, 'auto')
 
 	# Do a text report of this cluster; show all points by default
-	if args.text_style == 'csv':
+	if args.image_only:
+		pass
+	elif args.text_style == 'csv':
 		crossing.csv_report
 	else:
 		crossing.descriptive_report(True)
@@ -218,11 +323,26 @@ if args.crossingid:
 
 # Otherwise report on all crossings
 else:
-	# Create a feedback image
-	datapool.create_image(imagepath, 100)
+	# Create a feedback image, a tiled map of any size, or an image of every crossing
+	if args.no_image:
+		pass
+	elif args.zoom_all:
+		crossingpaths = [os.path.join(args.outdir_path, catfx.create_filename(args.start_date, args.end_date, args.catids, crossing.id, args.focal_catid) + catcm.render_context.image_extension) for crossing in datapool.crossings]
+		crossingpaths = catcm.create_images(datapool.crossings, crossingpaths, 'auto', args.jobs)
+		manifestpath = os.path.join(args.outdir_path, imagename + '_manifest.csv')
+		catcm.write_manifest(manifestpath, 'Crossing_ID', [crossing.id for crossing in datapool.crossings], crossingpaths)
+		sys.stderr.write('{} crossing images listed in {}.\n'.format(len([crossingpath for crossingpath in crossingpaths if crossingpath]), manifestpath))
+	elif args.tiles:
+		tilepath = os.path.join(args.outdir_path, imagename)
+		tile_count = datapool.create_tiles(tilepath, args.tile_scale, args.jobs)
+		sys.stderr.write('{} map tiles drawn in {}.\n'.format(tile_count, tilepath))
+	else:
+		datapool.create_image(imagepath, 100)
 
 	# Do a text report on crossings found
-	if args.text_style == 'descriptive-all':
+	if args.image_only:
+		pass
+	elif args.text_style == 'descriptive-all':
 		datapool.descriptive_report(True)
 	elif args.text_style == 'descriptive':
 		datapool.descriptive_report(False)
@@ -233,3 +353,6 @@ else:
 
 	# Account of what was done
 	sys.stderr.write('{} crossings found.\n'.format(len(datapool.crossings)))
+
+# Wait for the feedback image to finish saving
+catcm.render_context.finish_saving()
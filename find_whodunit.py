@@ -26,9 +26,7 @@
 
 import os
 import sys
-import time
 import argparse
-import datetime
 
 from csv import reader as csvreader
 
@@ -57,6 +55,32 @@ argman.add_argument(
 	help='Specify an output directory.'
 )
 
+argman.add_argument(
+	'-if', '--image_format',
+	dest='image_format', action='store',
+	type=catcm.check_image_format_arg, default=catcm.cfg_image_format,
+	help='Save images as png, webp (lossless), tiff or ppm (uncompressed).'
+)
+
+argman.add_argument(
+	'-ie', '--image_encoding',
+	dest='image_encoding', action='store',
+	type=catcm.check_image_encoding_arg, default=catcm.cfg_image_encoding,
+	help='Encode images for speed, size or balanced, or with an effort level from 0 to 9.'
+)
+
+argman.add_argument(
+	'-ni', '--no_image',
+	dest='no_image', action='store_true',
+	help='Only do the text report, skipping the work needed just for the image.'
+)
+
+argman.add_argument(
+	'-io', '--image_only',
+	dest='image_only', action='store_true',
+	help='Only create the image, skipping the work needed just for the text report.'
+)
+
 argman.add_argument(
 	'-r', '--radius',
 	dest='radius', action='store',
@@ -74,21 +98,21 @@ argman.add_argument(
 argman.add_argument(
 	'-d', '--date',
 	dest='date', action='store',
-	type=catcm.date_string_to_objects, default=False, required=True,
+	type=catcm.date_string_to_objects, default=False,
 	help='Date to use as basis for the search. YYYY-MM-DD.'
 )
 
 argman.add_argument(
 	'-cx', '--x_coordinate',
 	dest='x', action='store',
-	type=int, default=False, required=True,
+	type=int, default=False,
 	help='X Coordinate (NAD27) to use as basis for the search.'
 )
 
 argman.add_argument(
 	'-cy', '--y_coordinate',
 	dest='y', action='store',
-	type=int, default=False, required=True,
+	type=int, default=False,
 	help='Y Coordinate (NAD27) to use as basis for the search.'
 )
 
@@ -99,6 +123,39 @@ argman.add_argument(
 	help='Text output style: csv, descriptive.'
 )
 
+argman.add_argument(
+	'-n', '--close_count',
+	dest='close_count', action='store',
+	type=int, default=catfw.whodunit_close_count,
+	help='Number of next closest points to report and show.'
+)
+
+argman.add_argument(
+	'-es', '--estimates',
+	dest='estimates', action='store_true',
+	help='Estimate where each cat was at the request time. CSV output writes these to their own file.'
+)
+
+argman.add_argument(
+	'-q', '--query_file_path',
+	dest='query_file_path', action='store',
+	type=catcm.check_file_arg, default=False,
+	help='Answer a batch of requests from this CSV file instead. Each row is: id, date, x, y.'
+)
+
+argman.add_argument(
+	'-bi', '--batch_images',
+	dest='batch_images', action='store_true',
+	help='Create a feedback image for every request in a batch.'
+)
+
+argman.add_argument(
+	'-j', '--jobs',
+	dest='jobs', action='store',
+	type=catcm.jobs_arg_to_count, default='0',
+	help='Number of processes used to create batch images. 0 uses every core.'
+)
+
 # Using the argument parser to do a lot of work:
 # * Prefer command line arguments
 # * Fall back on config file values
@@ -106,18 +163,35 @@ argman.add_argument(
 # * Check validity of arguments
 args = argman.parse_args()
 
+# A single request needs a date and coordinates
+if not args.query_file_path and (not args.date or args.x is False or args.y is False):
+	argman.error('A date and coordinates are required, unless a query file is given.')
+
 # Make sure integer arguments are in a reasonable range.
 args.radius = catcm.constrain_integer(args.radius, 0, 1000)
 args.time_cutoff = catcm.constrain_integer(args.time_cutoff, 0, 31536000)
 args.x = catcm.constrain_integer(args.x, 0, 1000000)
 args.y = catcm.constrain_integer(args.y, 0, 10000000)
+args.close_count = catcm.constrain_integer(args.close_count, 0, 1000)
+
+# Save images in the requested format and encoding
+catcm.set_image_output(args.image_format, args.image_encoding)
+
+if args.no_image and args.image_only:
+	argman.error('Ask for no image, or only an image, not both.')
+
+if args.no_image and args.batch_images:
+	argman.error('Batch images are images, so they can\'t be drawn with no image.')
+
+if args.image_only and args.estimates:
+	argman.error('Estimates are part of the text report, so they can\'t be made with only an image.')
 
 # Open and process the data file
 with open(args.datafile_path, 'rt') as datafile:
 	csvrows = csvreader(datafile)
 
 	# Create a new DataPool object to work with
-	datapool = catfw.FWDataPool(args.radius, args.time_cutoff, args.x, args.y)
+	datapool = catfw.FWDataPool(args.radius, args.time_cutoff, args.x, args.y, args.close_count)
 
 	# For every row, create a Fix object and add it to the DataPool
 	for csvrow in csvrows:
@@ -134,65 +208,112 @@ with open(args.datafile_path, 'rt') as datafile:
 		datapool.fixes.append(new_fix)
 
 
-# Limit data to within X times the time cutoff of the target date
-datapool.dateobj = args.date[0]
-datapool.time = args.date[1]
+# A batch of requests shares one index of the data
+if args.query_file_path:
+	queries = catfw.read_queries(args.query_file_path)
+	if not queries:
+		sys.exit('No requests were found in the query file.')
 
-date_limit = datetime.timedelta(seconds=args.time_cutoff * 5)
+	requestpools = catfw.answer_batch(datapool, queries, args.radius, args.time_cutoff, args.close_count, args.estimates)
 
-datapool.start_dateobj = datapool.dateobj - date_limit
-datapool.start_time = time.mktime(datapool.start_dateobj.timetuple())
+	# Do one combined text report
+	if not args.image_only:
+		for requestpool in requestpools:
+			if args.text_style == 'descriptive':
+				requestpool.descriptive_report(False)
+			else:
+				requestpool.csv_report(requestpool is requestpools[0])
 
-datapool.end_dateobj = datapool.dateobj + date_limit
-datapool.end_time = time.mktime(datapool.end_dateobj.timetuple())
+	# The estimates are a different table, so CSV output puts them in their own file
+	if args.estimates and args.text_style != 'descriptive':
+		estimatesname = 'whodunit_' + os.path.splitext(os.path.basename(args.query_file_path))[0] + '_estimates.csv'
+		estimatespath = os.path.join(args.outdir_path, estimatesname)
+		with open(estimatespath, 'wt') as estimatesfile:
+			for requestpool in requestpools:
+				requestpool.estimates_csv_report(estimatesfile, requestpool is requestpools[0])
+		sys.stderr.write('Estimated positions written to {}.\n'.format(estimatespath))
 
-datapool.filter_by_date()
+	# Create feedback images in parallel, for requests that have data to show
+	if args.batch_images or args.image_only:
+		catfw.create_batch_images(requestpools, args.outdir_path, args.jobs)
 
-# Filtering by date may have removed everything
-if len(datapool.fixes) < 1:
-	sys.exit('No data remaining after filtering by date. Check the request date.')
+	# Account of what was done
+	match_count = sum(len(requestpool.matches) for requestpool in requestpools)
+	sys.stderr.write('{} requests answered, {} matches found.\n'.format(len(requestpools), match_count))
 
+else:
+	# Limit data to within X times the time cutoff of the target date
+	datapool.set_request_date(args.date[0], args.date[1])
 
-# Limit data to within X times the radius of the target coordinates
-datapool.x = args.x
-datapool.y = args.y
+	# Estimate each cat's position from all of its fixes, before any are
+	# filtered out. Trails need fixes in order, without duplicates.
+	if args.estimates:
+		datapool.order_by_time()
+		datapool.remove_duplicates()
+		catfw.estimate_positions([datapool], datapool.create_trails())
 
-datapool.filter_by_location(args.radius * 5)
+	datapool.filter_by_date()
 
-# Filtering by location may have removed everything
-if len(datapool.fixes) < 1:
-	sys.exit('No data remaining after filtering by location. Check the request coordinates.')
+	# Filtering by date may have removed everything
+	if len(datapool.fixes) < 1:
+		sys.exit('No data remaining after filtering by date. Check the request date.')
 
 
-# Put remaining fixes in chronological order
-datapool.order_by_time()
+	# Limit data to within X times the radius of the target coordinates
+	datapool.x = args.x
+	datapool.y = args.y
 
-# Remove any duplicate entries, seen in some data sets
-datapool.remove_duplicates()
+	datapool.filter_by_location(args.radius * 5)
 
-# Find any matches
-datapool.find_matches()
+	# Filtering by location may have removed everything
+	if len(datapool.fixes) < 1:
+		sys.exit('No data remaining after filtering by location. Check the request coordinates.')
 
-# Get things ready to create an image
-datapool.find_bounds()
-datapool.find_catids()
-datapool.find_cat_colors()
 
-# Get image name and path ready
-imagename = catfw.create_filename(args.date, args.x, args.y)
-imagepath = os.path.join(args.outdir_path, imagename + '.png')
+	# Put remaining fixes in chronological order
+	datapool.order_by_time()
 
-# Prepare date for legend
-datapool.legend_date = args.date[0].strftime(catcm.DATE_FMT_ISO)
+	# Remove any duplicate entries, seen in some data sets
+	datapool.remove_duplicates()
 
-# Create a feedback image
-datapool.create_image(imagepath, 'auto')
+	# Find any matches
+	datapool.find_matches()
+
+	# Get things ready to create an image
+	if not args.no_image:
+		datapool.find_bounds()
+		datapool.find_catids()
+		datapool.find_cat_colors()
+
+	# Get image name and path ready
+	imagename = catfw.create_filename(args.date, args.x, args.y)
+	imagepath = os.path.join(args.outdir_path, imagename + catcm.render_context.image_extension)
+
+	# Prepare date for legend
+	datapool.legend_date = args.date[0].strftime(catcm.DATE_FMT_ISO)
+
+	# Create a feedback image
+	if not args.no_image:
+		datapool.create_image(imagepath, 'auto')
+
+	# Do a text report on crossings found
+	if args.image_only:
+		pass
+	elif args.text_style == 'descriptive':
+		datapool.descriptive_report(False)
+	else:
+		datapool.csv_report()
+
+	# The estimates are a different table, so CSV output puts them in their own file
+	if args.estimates and args.text_style != 'descriptive':
+		estimatespath = os.path.join(args.outdir_path, imagename + '_estimates.csv')
+		with open(estimatespath, 'wt') as estimatesfile:
+			datapool.estimates_csv_report(estimatesfile)
+		sys.stderr.write('Estimated positions written to {}.\n'.format(estimatespath))
+
+	# Account of what was done
+	sys.stderr.write('{} matches found.\n'.format(len(datapool.matches)))
 
-# Do a text report on crossings found
-if args.text_style == 'descriptive':
-	datapool.descriptive_report(False)
-else:
-	datapool.csv_report()
 
-# Account of what was done
-sys.stderr.write('{} matches found.\n'.format(len(datapool.matches)))
+# Wait for any feedback image to finish saving
+catcm.render_context.finish_saving()
@@ -32,7 +32,6 @@ import sys
 import argparse
 
 from csv import reader as csvreader
-from csv import DictReader
 
 import catamount.common as catcm
 import catamount.match_survey_to_cluster as catms
@@ -95,6 +94,26 @@ argman.add_argument(
 	help='Design time cutoff of a match, in hours.'
 )
 
+argman.add_argument(
+	'-j', '--jobs',
+	dest='jobs', action='store',
+	type=catcm.jobs_arg_to_count, default='0',
+	help='Number of processes used to find clusters and read surveys. 0 uses every core.'
+)
+
+argman.add_argument(
+	'-k', '--catalogue_path',
+	dest='catalogue_path', action='store',
+	type=os.path.abspath, default=catcm.cfg_matchsurvey_catalogue_path,
+	help='Keep each cat\'s clusters in this directory, and reuse them while its fixes are unchanged.'
+)
+
+argman.add_argument(
+	'-rc', '--rebuild_catalogue',
+	dest='rebuild_catalogue', action='store_true',
+	help='Find every cat\'s clusters again, replacing what is in the catalogue.'
+)
+
 # Using the argument parser to do a lot of work:
 # * Prefer command line arguments
 # * Fall back on config file values
@@ -108,14 +127,14 @@ args.time_cutoff = catcm.constrain_integer(args.time_cutoff, 0, 31536000)
 
 #print('Process the data file...')
 
-# Open and process the data file
+# Open the data file, and divide its rows up by cat. Rows that don't
+# parse are skipped here, before any fingerprinting, so the warnings
+# are the same whether or not a cat comes from the catalogue.
+rows_by_cat = dict()
+fixes_by_cat = dict()
 with open(args.datafile_path, 'rt') as datafile:
 	csvrows = csvreader(datafile)
 
-	# Create a new DataPool object to work with
-	datapool = catms.MSDataPool(args.radius, args.time_cutoff)
-
-	# For every row, create a Fix object and it to the DataPool
 	for csvrow in csvrows:
 		try:
 			new_fix = catcm.Fix(csvrow)
@@ -126,8 +145,32 @@ with open(args.datafile_path, 'rt') as datafile:
 			sys.stderr.write('CSV row doesn’t look like data: {}\n'.format(csvrow))
 			continue
 
-		# Add the fix to the datapool
-		datapool.fixes.append(new_fix)
+		catid = new_fix.catid
+		if catid not in rows_by_cat:
+			rows_by_cat[catid] = list()
+			fixes_by_cat[catid] = list()
+		rows_by_cat[catid].append(csvrow)
+		fixes_by_cat[catid].append(new_fix)
+
+# Create a new DataPool object to work with
+datapool = catms.MSDataPool(args.radius, args.time_cutoff)
+
+# Take clusters from the catalogue for cats whose rows haven't changed,
+# and add the fixes of the rest
+catalogue = catms.ClusterCatalogue(args.catalogue_path, args.radius, args.time_cutoff)
+fingerprints = dict()
+fix_counts = dict()
+for catid, csvrows in rows_by_cat.items():
+	fingerprints[catid] = catalogue.fingerprint(csvrows)
+
+	if not args.rebuild_catalogue:
+		catalogue_entry = catalogue.load(catid, fingerprints[catid])
+		if catalogue_entry:
+			datapool.add_catalogued_clusters(catid, *catalogue_entry)
+			continue
+
+	datapool.fixes.extend(fixes_by_cat[catid])
+	fix_counts[catid] = len(fixes_by_cat[catid])
 
 #print('Find all clusters in the data file...')
 
@@ -135,21 +178,26 @@ with open(args.datafile_path, 'rt') as datafile:
 datapool.sort_into_trails()
 
 # Find clusters within those trails
-datapool.find_all_clusters()
+datapool.find_all_clusters(args.jobs)
 
-#print('Process the survey file...')
+# Store clusters for the cats that weren't in the catalogue
+for catid in rows_by_cat:
+	if catid in datapool.catalogued_clusters:
+		continue
 
-# Open and process the survey file
-with open(args.survey_file_path, 'rt') as survey_file:
-	csvrows = DictReader(survey_file)
+	if catid in datapool.trails:
+		catalogue.save(catid, fingerprints[catid], fix_counts[catid], datapool.trails[catid].clusters)
+	else:
+		catalogue.save(catid, fingerprints[catid], 0, list())
 
-	# Create a new SurveyPool object to work with
-	surveypool = catms.SurveyPool(args.radius, args.time_cutoff)
+#print('Process the survey file...')
 
-	for csvrow in csvrows:
-		survey = catms.Survey(csvrow, date_headers, location_easting_headers, location_northing_headers)
+# Create a new SurveyPool object to work with
+surveypool = catms.SurveyPool(args.radius, args.time_cutoff)
 
-		surveypool.surveys.append(survey)
+# Open and process the survey file
+with open(args.survey_file_path, 'rt') as survey_file:
+	surveypool.read_surveys(survey_file, date_headers, location_easting_headers, location_northing_headers, args.jobs)
 
 # Search for matching clusters
 surveypool.search_for_matching_clusters(datapool)
@@ -166,8 +214,8 @@ for survey in surveypool.surveys:
 		success_count += 1
 
 # Feedback to error channel
-error_feedback = '{} fixes found in the data file.\n'.format(len(datapool.fixes))
-error_feedback += ' {} clusters found across {} cats.\n'.format(len(datapool.clusters), len(datapool.catids))
+error_feedback = '{} fixes found in the data file.\n'.format(datapool.count_fixes())
+error_feedback += ' {} clusters found across {} cats.\n'.format(len(datapool.clusters), datapool.count_cats())
 error_feedback += ' {} surveys found in the surveys file.\n'.format(len(surveypool.surveys))
 error_feedback += ' {} surveys matched to clusters ({:0.1f}% success).\n'.format(success_count, 100 * (success_count / len(surveypool.surveys)))
 
@@ -55,6 +55,32 @@ argman.add_argument(
 	help='Specify an output directory.'
 )
 
+argman.add_argument(
+	'-if', '--image_format',
+	dest='image_format', action='store',
+	type=catcm.check_image_format_arg, default=catcm.cfg_image_format,
+	help='Save images as png, webp (lossless), tiff or ppm (uncompressed).'
+)
+
+argman.add_argument(
+	'-ie', '--image_encoding',
+	dest='image_encoding', action='store',
+	type=catcm.check_image_encoding_arg, default=catcm.cfg_image_encoding,
+	help='Encode images for speed, size or balanced, or with an effort level from 0 to 9.'
+)
+
+argman.add_argument(
+	'-ni', '--no_image',
+	dest='no_image', action='store_true',
+	help='Only do the text report, skipping the work needed just for the image.'
+)
+
+argman.add_argument(
+	'-io', '--image_only',
+	dest='image_only', action='store_true',
+	help='Only create the image, skipping the work needed just for the text report.'
+)
+
 argman.add_argument(
 	'-c', '--catids',
 	dest='catids', action='store',
@@ -76,6 +102,12 @@ argman.add_argument(
 	help='Resolution of perimeter in degrees.'
 )
 
+argman.add_argument(
+	'-dn', '--density',
+	dest='density', action='store_true',
+	help='Shade territories by the density of fixes, rather than drawing a dot for each.'
+)
+
 argman.add_argument(
 	'-d1', '--start_date',
 	dest='start_date', action='store',
@@ -101,6 +133,12 @@ args = argman.parse_args()
 args.dot_size = catcm.constrain_integer(args.dot_size, 2, 100)
 args.perimeter_resolution = catcm.constrain_integer(args.perimeter_resolution, 1, 120)
 
+# Save images in the requested format and encoding
+catcm.set_image_output(args.image_format, args.image_encoding)
+
+if args.no_image and args.image_only:
+	argman.error('Ask for no image, or only an image, not both.')
+
 # Open and process the data file
 with open(args.datafile_path, 'rt') as datafile:
 	csvrows = csvreader(datafile)
@@ -114,7 +152,7 @@ with open(args.datafile_path, 'rt') as datafile:
 		sys.exit('No CSV data was found after checking cat ids. Cat ids were {}.'.format(','.join(args.catids)))
 
 	# Create a new DataPool object to work with
-	datapool = catst.STDataPool(args.dot_size, args.perimeter_resolution)
+	datapool = catst.STDataPool(args.dot_size, args.perimeter_resolution, args.density)
 
 	# For every row, create a Fix object and add it to the DataPool
 	for csvrow in csvrows:
@@ -153,26 +191,32 @@ datapool.remove_duplicates()
 
 # Divide fixes up into trails, which are used for graphing
 datapool.create_trails()
-datapool.calculate_angles()
 
-# Get things ready to create an image.
-datapool.find_bounds()
-datapool.find_catids()
-datapool.find_cat_colors()
+# There is no text report, so without an image only the count is left
+if not args.no_image:
+	datapool.calculate_angles()
 
-# Create an image
-imagename = catst.create_filename(args.start_date, args.end_date, args.catids)
-imagepath = os.path.join(args.outdir_path, imagename + '.png')
+	# Get things ready to create an image.
+	datapool.find_bounds()
+	datapool.find_catids()
+	datapool.find_cat_colors()
 
-# Prepare date limiting strings for use in image legends
-if args.start_date:
-	datapool.legend_start_date = args.start_date[0].strftime(catcm.DATE_FMT_ISO_SHORT)
+	# Create an image
+	imagename = catst.create_filename(args.start_date, args.end_date, args.catids)
+	imagepath = os.path.join(args.outdir_path, imagename + catcm.render_context.image_extension)
 
-if args.end_date:
-	datapool.legend_end_date = args.end_date[0].strftime(catcm.DATE_FMT_ISO_SHORT)
+	# Prepare date limiting strings for use in image legends
+	if args.start_date:
+		datapool.legend_start_date = args.start_date[0].strftime(catcm.DATE_FMT_ISO_SHORT)
 
-# Create a feedback image
-datapool.create_image(imagepath, 'auto')
+	if args.end_date:
+		datapool.legend_end_date = args.end_date[0].strftime(catcm.DATE_FMT_ISO_SHORT)
+
+	# Create a feedback image
+	datapool.create_image(imagepath, 'auto')
 
 # Accounting of what was found
 sys.stderr.write('{} territories shown.\n'.format(len(datapool.trails)))
+
+# Wait for the feedback image to finish saving
+catcm.render_context.finish_saving()